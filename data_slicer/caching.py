@@ -0,0 +1,301 @@
+"""
+Small caching utilities: an in-memory least-recently-used cache and a
+simple on-disk store for np.arrays, as well as helpers to create cache keys.
+"""
+import hashlib
+import logging
+import os
+import pathlib
+import threading
+import types
+from collections import OrderedDict
+
+import numpy as np
+
+from data_slicer.utilities import CONFIG_DIR
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+CACHE_DIR = pathlib.Path.home() / CONFIG_DIR / 'cache'
+
+# Default size limit of every DiskCache
+DISK_CACHE_BYTES = 2**30
+
+#_Functions_____________________________________________________________________
+
+def hash_key(*parts) :
+    """ Create a hex digest that identifies the given *parts*. np.arrays
+    are hashed by their content, shape and dtype, everything else by its
+    ``repr``.
+    """
+    h = hashlib.sha1()
+    for part in parts :
+        if isinstance(part, np.ndarray) :
+            h.update(str((part.shape, part.dtype.str)).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, (list, tuple)) :
+            h.update(b'(')
+            h.update(hash_key(*part).encode())
+            h.update(b')')
+        else :
+            h.update(repr(part).encode())
+    return h.hexdigest()
+
+def _value_token(value, seen) :
+    """ Return a string that identifies *value* as it enters a function
+    (through its globals, closure or defaults), or *None* if it cannot be
+    identified reliably, e.g. because it is a mutable object.
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str,
+                                           bytes, np.generic)) :
+        return repr(value)
+    elif isinstance(value, np.ndarray) :
+        return hash_key(value)
+    elif isinstance(value, (tuple, frozenset)) :
+        parts = [_value_token(v, seen) for v in value]
+        return None if None in parts else hash_key(*parts)
+    elif isinstance(value, types.FunctionType) :
+        return _function_token(value, seen)
+    elif isinstance(value, types.ModuleType) :
+        return 'module ' + value.__name__
+    elif isinstance(value, (type, types.BuiltinFunctionType, np.ufunc)) :
+        # Classes and compiled functions are identified by their name
+        return '{} {}'.format(getattr(value, '__module__', None),
+                              getattr(value, '__qualname__', value.__name__))
+    return None
+
+def _code_token(code) :
+    """ Return a hex digest of the bytecode and constants of *code*,
+    including those of nested functions, and the list of the global
+    names it uses.
+    """
+    parts = [code.co_code, repr(code.co_names)]
+    names = list(code.co_names)
+    for const in code.co_consts :
+        if isinstance(const, types.CodeType) :
+            # The repr of code objects contains their memory address
+            token, nested_names = _code_token(const)
+            parts.append(token)
+            names.extend(nested_names)
+        else :
+            parts.append(repr(const))
+    return hash_key(*parts), names
+
+def _function_token(func, seen) :
+    if func in seen :
+        # Recursive functions
+        return 'recursion'
+    seen = seen | {func}
+    token, names = _code_token(func.__code__)
+    parts = [token]
+    defaults = (func.__defaults__ or ()) + \
+               tuple(sorted((func.__kwdefaults__ or dict()).items()))
+    cells = tuple(cell.cell_contents for cell in func.__closure__ or []
+                  if _has_contents(cell))
+    namespace = func.__globals__
+    used = tuple((name, namespace[name]) for name in dict.fromkeys(names)
+                 if name in namespace)
+    for value in (defaults, cells, used) :
+        part = _value_token(value, seen)
+        if part is None :
+            return None
+        parts.append(part)
+    return hash_key(*parts)
+
+def _has_contents(cell) :
+    try :
+        cell.cell_contents
+    except ValueError :
+        return False
+    return True
+
+def function_token(func) :
+    """ Return a string that identifies the python function *func*
+    independently of the session it was created in: its bytecode
+    (including nested functions), constants, default arguments and the
+    values it closes over, as well as the values of the global variables it
+    uses. Other functions it uses are identified the same way, modules and
+    classes by their name.
+
+    Returns *None* if *func* cannot be identified this way, e.g. if it is
+    not a python function or depends on mutable objects (like lists or
+    dicts), whose content may change without changing the token.
+    """
+    if not isinstance(func, types.FunctionType) :
+        return None
+    return _function_token(func, frozenset())
+
+def nbytes_of(value) :
+    """ Estimate the memory footprint of *value* (np.arrays and tuples,
+    lists or dicts thereof).
+    """
+    if isinstance(value, np.ndarray) :
+        return value.nbytes
+    elif isinstance(value, (list, tuple)) :
+        return sum(nbytes_of(v) for v in value)
+    elif isinstance(value, dict) :
+        return sum(nbytes_of(v) for v in value.values())
+    else :
+        return getattr(value, 'nbytes', 0)
+
+#_Classes_______________________________________________________________________
+
+class LRUCache() :
+    """
+    Thread-safe in-memory cache that discards the least recently used
+    entries once it holds more than *max_items* entries or more than
+    *max_bytes* bytes (as estimated by :func:`nbytes_of
+    <data_slicer.caching.nbytes_of>`).
+    """
+    def __init__(self, max_items=None, max_bytes=None) :
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __repr__(self) :
+        return '<LRUCache: {} entries, {} bytes>'.format(len(self),
+                                                         self.nbytes)
+
+    def __len__(self) :
+        return len(self._entries)
+
+    def __contains__(self, key) :
+        with self._lock :
+            return key in self._entries
+
+    def get(self, key, default=None) :
+        """ Return the entry stored under *key* (marking it as recently
+        used) or *default*.
+        """
+        with self._lock :
+            try :
+                value = self._entries.pop(key)
+            except KeyError :
+                return default
+            self._entries[key] = value
+            return value
+
+    def put(self, key, value) :
+        """ Store *value* under *key*, evicting old entries if necessary. """
+        with self._lock :
+            if key in self._entries :
+                self.nbytes -= nbytes_of(self._entries.pop(key))
+            self._entries[key] = value
+            self.nbytes += nbytes_of(value)
+            self._evict()
+
+    def pop(self, key, default=None) :
+        """ Remove and return the entry stored under *key*. """
+        with self._lock :
+            try :
+                value = self._entries.pop(key)
+            except KeyError :
+                return default
+            self.nbytes -= nbytes_of(value)
+            return value
+
+    def keys(self) :
+        """ Return a list of all keys, least recently used first. """
+        with self._lock :
+            return list(self._entries.keys())
+
+    def clear(self) :
+        """ Remove all entries. """
+        with self._lock :
+            self._entries.clear()
+            self.nbytes = 0
+
+    def set_limits(self, max_items=None, max_bytes=None) :
+        """ Change the limits and evict entries if necessary. """
+        with self._lock :
+            self.max_items = max_items
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self) :
+        while len(self._entries) > 1 and (
+              (self.max_items is not None and
+               len(self._entries) > self.max_items) or
+              (self.max_bytes is not None and self.nbytes > self.max_bytes)) :
+            key, value = self._entries.popitem(last=False)
+            self.nbytes -= nbytes_of(value)
+
+class DiskCache() :
+    """
+    Store dictionaries of np.arrays as ``.npz`` files in a subdirectory of
+    *directory* for the given *version*, such that files written by other
+    versions of the code are never read. Once the files exceed *max_bytes*,
+    the least recently used ones are deleted. Failures to read or write
+    (e.g. on read-only file systems) are logged and otherwise ignored, such
+    that the cache can always be used optimistically.
+    """
+    def __init__(self, directory, max_bytes=DISK_CACHE_BYTES, version=1) :
+        self.directory = pathlib.Path(directory) / 'v{}'.format(version)
+        self.max_bytes = max_bytes
+
+    def __repr__(self) :
+        return '<DiskCache: {}>'.format(self.directory)
+
+    def path(self, key) :
+        """ Return the path of the file corresponding to *key*. """
+        return self.directory / '{}.npz'.format(key)
+
+    def get(self, key) :
+        """ Return the dictionary of arrays stored under *key* or *None*. """
+        path = self.path(key)
+        if not path.exists() :
+            return None
+        try :
+            with np.load(path) as f :
+                arrays = {name: f[name] for name in f.files}
+            # Mark the file as recently used
+            os.utime(path)
+            return arrays
+        except Exception as e :
+            logger.warning('Could not read cache file {}: {}'.format(path, e))
+            return None
+
+    def put(self, key, arrays) :
+        """ Store the dictionary of np.arrays *arrays* under *key*. """
+        path = self.path(key)
+        try :
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first to avoid leaving broken files
+            tmp = path.with_suffix('.tmp')
+            with open(tmp, 'wb') as f :
+                np.savez(f, **arrays)
+            tmp.replace(path)
+            self._evict(keep=path)
+        except Exception as e :
+            logger.warning('Could not write cache file {}: {}'.format(path,
+                                                                      e))
+
+    def nbytes(self) :
+        """ Return the total size of the files of this cache. """
+        return sum(path.stat().st_size
+                   for path in self.directory.glob('*.npz'))
+
+    def _evict(self, keep) :
+        """ Delete the least recently used files (except *keep*) until the
+        cache fits into *max_bytes*.
+        """
+        if self.max_bytes is None :
+            return
+        files = [(path.stat().st_mtime, path.stat().st_size, path)
+                 for path in self.directory.glob('*.npz')]
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files) :
+            if total <= self.max_bytes :
+                break
+            if path != keep :
+                path.unlink()
+                total -= size
+
+    def clear(self) :
+        """ Delete all files of this cache. """
+        for path in self.directory.glob('*.npz') :
+            path.unlink()
@@ -0,0 +1,181 @@
+"""
+Out-of-core datasets that are read in chunks on demand.
+
+A :class:`ChunkedArray <data_slicer.chunked.ChunkedArray>` wraps any
+array-like that supports slicing (e.g. a `dask <https://dask.org>`_ array,
+an h5py or zarr dataset or a np.memmap) and divides it into a grid of
+chunks. Only the chunks that a slice or cut touches are read, and they are
+kept in a cache that is shared by all ChunkedArrays and limited to
+:const:`CACHE_BYTES <data_slicer.chunked.CACHE_BYTES>`. This allows
+interactive slicing of datasets that are much larger than the memory::
+
+    import dask.array as da
+    data = da.from_zarr('huge.zarr')
+    mw = pit.MainWindow(data=data)
+"""
+import itertools
+import logging
+
+import numpy as np
+
+from data_slicer.caching import LRUCache
+from data_slicer.lazy import LazyArray, SubArray, chunk_overlap, \
+                             chunk_region, chunks_in, region_shape
+from data_slicer.utilities import map_chunks
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Memory budget of the chunk cache
+CACHE_BYTES = 2**30
+
+# Approximate size of the chunks if the data does not define any
+CHUNK_BYTES = 2**22
+
+#_Functions_____________________________________________________________________
+
+# Chunks of all ChunkedArrays, keyed by (token, chunk index)
+chunk_cache = LRUCache(max_bytes=CACHE_BYTES)
+
+# Unique tokens that identify ChunkedArrays in the cache (ids of deleted
+# objects may be reused)
+_tokens = itertools.count()
+
+def set_cache_size(nbytes) :
+    """ Change the memory budget of the chunk cache to *nbytes*. """
+    chunk_cache.set_limits(max_bytes=nbytes)
+
+def default_chunks(shape, dtype) :
+    """ Return a chunk shape of about :const:`CHUNK_BYTES
+    <data_slicer.chunked.CHUNK_BYTES>` that is as close to a cube as the
+    *shape* allows.
+    """
+    n_elements = max(1, CHUNK_BYTES // np.dtype(dtype).itemsize)
+    chunks = list(shape)
+    # Distribute the elements over the dimensions, starting with the
+    # shortest ones, which might not use their share
+    remaining = len(shape)
+    for d in np.argsort(shape) :
+        edge = int(round(n_elements**(1/remaining)))
+        chunks[d] = max(1, min(shape[d], edge))
+        n_elements = max(1, n_elements // chunks[d])
+        remaining -= 1
+    return tuple(chunks)
+
+def is_chunkable(data) :
+    """ Return *True* if *data* is an array-like that is neither an 
+    in-memory np.array nor a :class:`LazyArray <data_slicer.lazy.LazyArray>`, 
+    but can be wrapped in a :class:`ChunkedArray 
+    <data_slicer.chunked.ChunkedArray>`. Memory-mapped files (np.memmap) 
+    are chunkable.
+    """
+    if is_memmap(data) :
+        return True
+    if isinstance(data, (np.ndarray, LazyArray)) :
+        return False
+    return all(hasattr(data, attribute) for attribute in
+               ('shape', 'dtype', '__getitem__'))
+
+def is_memmap(data) :
+    """ Return *True* if *data* is a np.memmap that is backed by a file. """
+    return isinstance(data, np.memmap) and \
+           getattr(data, 'filename', None) is not None
+
+def as_chunked(data, chunks=None) :
+    """ Wrap *data* in a :class:`ChunkedArray
+    <data_slicer.chunked.ChunkedArray>` if :func:`is_chunkable
+    <data_slicer.chunked.is_chunkable>`, otherwise return it unchanged.
+    """
+    if is_chunkable(data) :
+        return ChunkedArray(data, chunks=chunks)
+    return data
+
+#_Classes_______________________________________________________________________
+
+class ChunkedArray(LazyArray) :
+    """
+    Lazy view of the array-like *source* that reads it chunk by chunk. Read
+    chunks are stored in *cache* (by default the shared :data:`chunk_cache
+    <data_slicer.chunked.chunk_cache>`) and reused by later accesses.
+
+    **Parameters**
+
+    ======  ====================================================================
+    source  array-like that supports indexing with tuples of slices and has
+            *shape* and *dtype* attributes.
+    chunks  tuple of int; shape of the chunks. Defaults to the chunks of
+            *source* (for dask, h5py and zarr) or :func:`default_chunks
+            <data_slicer.chunked.default_chunks>`.
+    cache   :class:`LRUCache <data_slicer.caching.LRUCache>`.
+    ======  ====================================================================
+    """
+    def __init__(self, source, chunks=None, cache=None) :
+        self.source = source
+        shape = tuple(int(n) for n in source.shape)
+        if chunks is None :
+            # dask arrays define *chunksize*, h5py and zarr *chunks*
+            chunks = getattr(source, 'chunksize', None) or \
+                     getattr(source, 'chunks', None)
+            if chunks is None or len(chunks) != len(shape) or \
+               not all(isinstance(n, (int, np.integer)) for n in chunks) :
+                chunks = default_chunks(shape, source.dtype)
+        self.chunks = tuple(max(1, int(n)) for n in chunks)
+        self.cache = chunk_cache if cache is None else cache
+        self._token = next(_tokens)
+        super().__init__(shape, source.dtype)
+
+    def __repr__(self) :
+        return '<ChunkedArray shape={}, dtype={}, chunks={}>'.format(
+                self.shape, self.dtype, self.chunks)
+
+    @property
+    def cached_chunks(self) :
+        """ Indices of the chunks of this array that are currently cached. """
+        return [key[1] for key in self.cache.keys() if key[0] == self._token]
+
+    def _read_chunk(self, index) :
+        key = (self._token, index)
+        chunk = self.cache.get(key)
+        if chunk is None :
+            region = chunk_region(index, self.chunks, self.shape)
+            chunk = np.asarray(self.source[region], dtype=self.dtype)
+            self.cache.put(key, chunk)
+        return chunk
+
+    def _compute(self, region) :
+        block = np.empty(region_shape(region), dtype=self.dtype)
+        if 0 in block.shape :
+            return block
+        indices = list(chunks_in(region, self.chunks))
+
+        def read(chunk) :
+            for index in indices[chunk] :
+                in_region, in_chunk = chunk_overlap(
+                    region, chunk_region(index, self.chunks, self.shape))
+                block[in_region] = self._read_chunk(index)[in_chunk]
+
+        # Reading the chunks in parallel helps with slow storage and with
+        # sources that compute their chunks (like dask)
+        map_chunks(read, len(indices), chunk_size=1)
+        return block
+
+    def reduce(self, ufunc, axis=None, dtype=None, n_workers=None) :
+        """ Blockwise reduction (see :meth:`LazyArray.reduce
+        <data_slicer.lazy.LazyArray.reduce>`). Data that does not fit into
+        the cache is streamed from the source, such that the cached chunks
+        are not replaced.
+        """
+        budget = self.cache.max_bytes
+        if budget is None or self.nbytes <= budget :
+            return super().reduce(ufunc, axis=axis, dtype=dtype,
+                                  n_workers=n_workers)
+        whole = tuple(slice(0, n) for n in self.shape)
+        return SubArray(self.source, whole).reduce(ufunc, axis=axis,
+                                                   dtype=dtype,
+                                                   n_workers=n_workers)
+
+    def clear_cache(self) :
+        """ Remove the chunks of this array from the cache. """
+        for index in self.cached_chunks :
+            self.cache.pop((self._token, index))
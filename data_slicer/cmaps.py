@@ -19,6 +19,13 @@ from data_slicer.utilities import CACHED_CMAPS_FILENAME, CONFIG_DIR
 
 logger = logging.getLogger('ds.'+__name__)
 
+# Ways in which data values can be mapped to colors, see transfer_function()
+DISPLAY_MODES = ('linear', 'log', 'equalize')
+# Number of entries of lookup tables created by make_lut()
+LUT_SIZE = 4096
+# Number of decades spanned by the 'log' display mode
+LOG_DECADES = 4
+
 class ds_cmap(ColorMap) :
     """ Simple subclass of :class:`pyqtgraph.ColorMap`. Adds vmax, 
     powerlaw normalization and a convenience function to change alpha.
@@ -33,6 +40,9 @@ class ds_cmap(ColorMap) :
     def set_gamma(self, *args, **kwargs) :
         pass
 
+    def set_vmax(self, *args, **kwargs) :
+        pass
+
 class ds_cmap_legacy(ColorMap) :
     """ Simple subclass of :class:`pyqtgraph.ColorMap`. Adds vmax, 
     powerlaw normalization and a convenience function to change alpha.
@@ -166,6 +176,66 @@ def convert_ds_to_matplotlib(data_slicer_cmap, cmap_name='converted_cmap') :
                                                         colors, N)
     return matplotlib_cmap
 
+def transfer_function(mode='linear', levels=None, histogram=None, gamma=1, 
+                      vmax=1, n=LUT_SIZE) :
+    """
+    Calculate how *n* evenly spaced data values between *levels* are mapped 
+    onto the interval [0, 1] of a colormap.
+
+    **Parameters**
+
+    =========  =================================================================
+    mode       str; one of :const:`DISPLAY_MODES 
+               <data_slicer.cmaps.DISPLAY_MODES>`. 'linear' maps the values 
+               linearly, 'log' logarithmically over :const:`LOG_DECADES 
+               <data_slicer.cmaps.LOG_DECADES>` decades and 'equalize' 
+               through the cumulative distribution of the data, such that 
+               all colors are used equally often (histogram equalization).
+    levels     [low, high]; the data range. Required for 'equalize'.
+    histogram  :class:`Histogram <data_slicer.statistics.Histogram>` of the 
+               data. Required for 'equalize'.
+    gamma      float; exponent of a power-law that is applied afterwards.
+    vmax       float; relative maximum. Values above *vmax* are mapped to 
+               the top of the colormap.
+    n          int; number of values.
+    =========  =================================================================
+
+    **Returns**
+
+    ========  ==================================================================
+    transfer  1d array of length *n* with values in [0, 1].
+    ========  ==================================================================
+    """
+    t = (np.arange(n) + 0.5) / n
+    if mode == 'linear' :
+        transfer = t
+    elif mode == 'log' :
+        transfer = np.log10(1 + t*(10**LOG_DECADES - 1)) / LOG_DECADES
+    elif mode == 'equalize' :
+        if histogram is None or levels is None :
+            raise ValueError('Histogram equalization requires *histogram* '
+                             'and *levels*.')
+        low, high = levels
+        cdf = histogram.cdf(low + t*(high - low))
+        c0, c1 = histogram.cdf([low, high])
+        transfer = (cdf - c0) / max(c1 - c0, 1e-12)
+    else :
+        raise ValueError('Unknown display mode "{}". Use one of {}.'.format(
+                         mode, DISPLAY_MODES))
+    transfer = np.clip(transfer / vmax, 0, 1)
+    return transfer**gamma
+
+def make_lut(base_lut, transfer) :
+    """ Create a lookup table by sampling the lookup table *base_lut* at 
+    the positions *transfer* (values in [0, 1], as returned by 
+    :func:`transfer_function <data_slicer.cmaps.transfer_function>`). 
+    Changing the display of an image this way only requires rebuilding the 
+    (small) lookup table and not touching the data.
+    """
+    base_lut = np.asarray(base_lut)
+    indices = np.rint(transfer * (len(base_lut) - 1)).astype(int)
+    return base_lut[indices]
+
 def load_custom_cmap(filename) :
     """ Create a :class:`ds_cmap <data_slicer.cmaps.ds_cmap>` instance from 
     data stored in a file with three columns, red, green and blue - either in 
@@ -1,11 +1,14 @@
 
 import logging
 
+import numpy as np
 import pyqtgraph as pg
 from pyqtgraph import Qt as qt
 from pyqtgraph import QtGui, Point
 from pyqtgraph.functions import affineSlice
 
+from data_slicer.kernels import get_kernel
+
 logger = logging.getLogger('ds.'+__name__)
 
 class CustomizableLineSegmentROI(pg.LineSegmentROI) :
@@ -225,6 +228,67 @@ class Cutline(qt.QtCore.QObject) :
     def get_array_region(self, *args, **kwargs) :
         """ Wrapper for the underlying ROI's
         :meth:`~data_slicer.cutline.Cutline.roi.getArrayRegion`. 
+        Only the bounding box around the cutline is evaluated, which 
+        matters for array-likes that are not np.arrays (e.g. 
+        :class:`LazyArray <data_slicer.lazy.LazyArray>`), and the linear 
+        interpolation uses the 'interpolate_points' kernel (see 
+        :mod:`data_slicer.kernels`). If the plot displays its image 
+        resampled onto a uniform grid (because of non-uniform axes, see 
+        :meth:`ImagePlot.display_to_index 
+        <data_slicer.imageplot.ImagePlot.display_to_index>`), the cut is 
+        taken from the original data at the corresponding positions.
+        """
+        data = args[0] if args else kwargs.get('data')
+        if data is None :
+            return self.roi.getArrayRegion(*args, **kwargs)
+        return self._get_sampled_array_region(*args, **kwargs)
+
+    def get_coordinates(self, img) :
+        """ Return the (fractional) indices into the data shown by the 
+        ImageItem *img* of the points, one pixel apart, along the cutline 
+        as a list of two 1d arrays.
         """
-        return self.roi.getArrayRegion(*args, **kwargs)
- 
+        points = [Point(self.roi.mapToItem(img, h.pos())) 
+                  for h in self.roi.endpoints]
+        d = Point(points[1] - points[0])
+        n = int(d.length())
+        step = d.norm()
+        t = np.arange(n)
+        coords = []
+        for i in range(2) :
+            position = points[0][i] + t*step[i]
+            if hasattr(self.plot, 'display_to_index') :
+                position = self.plot.display_to_index(position, i)
+            coords.append(np.asarray(position, dtype=float))
+        return coords
+
+    def _get_sampled_array_region(self, data, img, axes=(0, 1), order=1, 
+                                  returnMappedCoords=False, **kwargs) :
+        """ Same as the underlying ROI's getArrayRegion, but only evaluate 
+        the part of *data* that is covered by the cutline and translate 
+        positions on the displayed image to indices into *data*.
+        """
+        coords = self.get_coordinates(img)
+        n = len(coords[0])
+        # Bounding box of the line, padded by one pixel for the interpolation
+        key = data.ndim*[slice(None)]
+        for i, ax in enumerate(axes) :
+            if n > 0 :
+                lower, upper = coords[i].min(), coords[i].max()
+            else :
+                lower, upper = 0, 0
+            start = min(max(0, int(np.floor(lower)) - 1), data.shape[ax] - 1)
+            stop = min(data.shape[ax], int(np.ceil(upper)) + 2)
+            key[ax] = slice(start, max(start+1, stop))
+        block = np.asarray(data[tuple(key)])
+        block = np.moveaxis(block, axes, (0, 1))
+        shifted = np.stack([coords[i] - key[ax].start 
+                            for i, ax in enumerate(axes)], axis=-1)
+        if order == 1 :
+            result = get_kernel('interpolate_points')(block, shifted)
+        else :
+            result = pg.functions.interpolateArray(block, shifted, 
+                                                   order=order)
+        if returnMappedCoords :
+            return result, np.array(coords)
+        return result
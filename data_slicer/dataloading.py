@@ -8,6 +8,8 @@ from warnings import catch_warnings
 
 import numpy as np
 
+from data_slicer import dtypes
+
 class Dataloader() :
     """ 
     Base dataloader class (interface) from which others inherit some 
@@ -151,7 +153,24 @@ class Dataloader_3dtxt(Dataloader) :
         D = Namespace(data=res, axes=[xaxis, yaxis, zaxis])
         return D
 
-registered_loaders = [Dataloader_Pickle, Dataloader_3dtxt]
+class Dataloader_Numpy(Dataloader) :
+    """ Confer documentation of 
+    :func:`~data_slicer.dataloading.Dataloader_Numpy.load_data()`. 
+    """
+    name = 'Numpy'
+
+    def load_data(self, filename) :
+        """ Load an array that has been saved with :func:`numpy.save` 
+        (``.npy``). The file is memory-mapped read-only, such that only the 
+        parts of the data that are accessed are read from disk.
+        """
+        if not str(filename).endswith('.npy') :
+            raise ValueError('Not a .npy file.')
+        data = np.load(filename, mmap_mode='r')
+        D = Namespace(data=data, axes=3*[None])
+        return D
+
+registered_loaders = [Dataloader_Numpy, Dataloader_Pickle, Dataloader_3dtxt]
 
 # Function to try all dataloaders in all_dls
 def load_data(filename, exclude=None, suppress_warnings=False) :
@@ -160,6 +179,8 @@ def load_data(filename, exclude=None, suppress_warnings=False) :
     great. If not, try with the next dataloader. 
     Collects and prints all raised exceptions in case that no dataloader 
     succeeded.
+    The data is converted to the storage dtype of the current 
+    :class:`DtypePolicy <data_slicer.dtypes.DtypePolicy>`, if one is set.
     """ 
     # Sanity check: does the given path even exist in the filesystem?
     if not os.path.exists(filename) :
@@ -202,6 +223,7 @@ def load_data(filename, exclude=None, suppress_warnings=False) :
             except KeyError :
                 pass
             
+            namespace.data = dtypes.policy.to_storage(namespace.data)
             return namespace
 
     # Reaching this point means something went wrong. Print all exceptions.
@@ -0,0 +1,180 @@
+"""
+Policy for the data types used to store, integrate and display data.
+
+Storing data with a smaller type (e.g. float32 instead of float64, or uint16
+for counts) cuts the memory usage by a factor of 2 to 4. Integrations are
+then carried out with a wider accumulation type, such that sums neither
+overflow nor lose precision. The policy is set once for the whole session
+with :func:`set_policy <data_slicer.dtypes.set_policy>`::
+
+    from data_slicer import dtypes
+    dtypes.set_policy(storage='float32')
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Approximate size of the blocks in which data is checked and converted
+BLOCK_BYTES = 2**26
+
+#_Classes_______________________________________________________________________
+
+class DtypePolicy() :
+    """
+    Collection of the data types to use at the different stages.
+
+    **Parameters**
+
+    ============  ==============================================================
+    storage       dtype or *None*; type in which loaded data is kept. *None*
+                  keeps the type of the data.
+    accumulation  dtype or 'auto'; type of the sums in integrations (slices,
+                  projections). 'auto' uses signed 64 bit integers for integer
+                  and boolean data (such that differences of sums do not wrap
+                  around) and at least 64 bit floats for floating point data.
+    float         dtype; smallest floating point type for the results of
+                  processing steps (e.g. normalization). Use float32 together
+                  with a float32 or 16 bit integer storage to keep processed
+                  data small.
+    display       dtype or *None*; type of the images that are passed to the
+                  plots. *None* passes them on unchanged.
+    ============  ==============================================================
+    """
+    def __init__(self, storage=None, accumulation='auto', float=np.float64,
+                 display=None) :
+        self.storage = None if storage is None else np.dtype(storage)
+        self.accumulation = accumulation if accumulation == 'auto' else \
+                            np.dtype(accumulation)
+        self.float = np.dtype(float)
+        self.display = None if display is None else np.dtype(display)
+
+    def __repr__(self) :
+        return ('<DtypePolicy storage={}, accumulation={}, float={}, '
+                'display={}>').format(self.storage, self.accumulation,
+                                      self.float, self.display)
+
+    def accumulation_dtype(self, dtype) :
+        """ Return the type in which sums over data of *dtype* are
+        accumulated.
+        """
+        dtype = np.dtype(dtype)
+        if self.accumulation != 'auto' :
+            return self.accumulation
+        if dtype.kind == 'u' and dtype.itemsize == 8 :
+            return dtype
+        elif dtype.kind in 'biu' :
+            return np.dtype(np.int64)
+        elif dtype.kind in 'fc' :
+            return np.result_type(dtype, np.float64)
+        return dtype
+
+    def float_dtype(self, dtype) :
+        """ Return the floating point type for processed data of *dtype*.
+        """
+        return np.result_type(dtype, self.float)
+
+    def to_storage(self, data) :
+        """
+        Convert the np.array *data* to the storage type. Data that is
+        already of that type (or any data if no storage type is set) is
+        returned unchanged. Other array-likes and memory-mapped files
+        (np.memmap) are not converted, as that would read them into memory.
+
+        Conversion to an integer type raises an :exc:`OverflowError` if
+        the values do not fit, and non-integer values are rounded. The
+        range is checked and the data converted in blocks along the first
+        dimension, such that the only array of the full size is the result.
+        """
+        if self.storage is None or not isinstance(data, np.ndarray) or \
+           isinstance(data, np.memmap) or data.dtype == self.storage :
+            return data
+        if self.storage.kind in 'iu' :
+            info = np.iinfo(self.storage)
+            check = self._check_integer
+        elif self.storage.kind == 'f' and data.dtype.kind == 'f' :
+            info = np.finfo(self.storage)
+            check = self._check_float
+        else :
+            info = check = None
+        blocks = list(_blocks(data))
+        if check is not None :
+            for block in blocks :
+                check(data[block], info)
+        logger.debug('Converting data from {} to {}.'.format(data.dtype,
+                                                             self.storage))
+        result = np.empty(data.shape, dtype=self.storage)
+        for block in blocks :
+            values = data[block]
+            if self.storage.kind in 'iu' and data.dtype.kind in 'fc' :
+                values = np.rint(values)
+            result[block] = values
+        return result
+
+    def _check_integer(self, block, info) :
+        """ Raise an error if *block* has values that do not fit into the 
+        integer type described by *info*.
+        """
+        if block.dtype.kind in 'fc' and not np.isfinite(block).all() :
+            raise ValueError('Data containing NaN or infinite values '
+                             'cannot be stored as {}.'.format(self.storage))
+        if block.size and (block.min() < info.min or block.max() > info.max) :
+            raise OverflowError(('Data range [{}, {}] does not fit into '
+                                 '{}.').format(block.min(), block.max(),
+                                               self.storage))
+
+    def _check_float(self, block, info) :
+        """ Raise an error if *block* has values that do not fit into the 
+        floating point type described by *info*.
+        """
+        with np.errstate(invalid='ignore') :
+            largest = np.nanmax(np.abs(block)) if block.size else 0
+        if largest > info.max :
+            raise OverflowError(('Data maximum {} does not fit into '
+                                 '{}.').format(largest, self.storage))
+
+    def to_display(self, image) :
+        """ Convert the 2d np.array *image* to the display type. If no 
+        display type is set, *image* is returned unchanged.
+        """
+        image = np.asarray(image)
+        if self.display is not None and image.dtype.kind in 'fiub' :
+            return image.astype(self.display, copy=False)
+        return image
+
+#_Functions_____________________________________________________________________
+
+# The policy used throughout data_slicer
+policy = DtypePolicy()
+
+def set_policy(**kwargs) :
+    """ Replace the current :data:`policy <data_slicer.dtypes.policy>` by
+    one with the given arguments (see :class:`DtypePolicy
+    <data_slicer.dtypes.DtypePolicy>`). Unspecified arguments are reset to
+    their defaults. Return the new policy.
+    """
+    global policy
+    policy = DtypePolicy(**kwargs)
+    return policy
+
+def get_policy() :
+    """ Return the current :class:`DtypePolicy
+    <data_slicer.dtypes.DtypePolicy>`. """
+    return policy
+
+def _blocks(data) :
+    """ Yield keys that divide the np.array *data* into blocks of about
+    :const:`BLOCK_BYTES <data_slicer.dtypes.BLOCK_BYTES>` along its first
+    dimension.
+    """
+    if data.ndim == 0 :
+        yield ()
+        return
+    n = data.shape[0]
+    bytes_per_index = max(1, data.nbytes // max(1, n))
+    step = max(1, BLOCK_BYTES // bytes_per_index)
+    for start in range(0, n, step) :
+        yield slice(start, min(start + step, n))
@@ -0,0 +1,239 @@
+"""
+Evaluation of arithmetic expressions given as strings, like ``'(a-b)/(a+b)'``,
+and datasets that are defined by such expressions over other datasets.
+
+Expressions are evaluated with `numexpr <https://github.com/pydata/numexpr>`_
+(which is multithreaded and avoids large temporaries) if it is installed.
+Otherwise, numpy is used on chunks of the data that are distributed over a
+pool of threads.
+"""
+import ast
+import logging
+from functools import lru_cache
+
+import numpy as np
+
+from data_slicer.lazy import LazyArray
+from data_slicer.utilities import map_chunks
+
+try :
+    import numexpr
+except ImportError :
+    numexpr = None
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Functions that can be used in expressions (all of them are understood by
+# numexpr as well)
+FUNCTIONS = {name: getattr(np, name) for name in
+             ('abs', 'sqrt', 'exp', 'log', 'log10', 'sin', 'cos', 'tan',
+              'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh', 'cosh',
+              'tanh', 'where')}
+
+# Syntax elements that are allowed in expressions
+ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare,
+                 ast.Call, ast.Name, ast.Load, ast.Constant,
+                 ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod,
+                 ast.USub, ast.UAdd, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+                 ast.Eq, ast.NotEq, ast.BitAnd, ast.BitOr, ast.Invert)
+
+# Approximate number of elements per chunk when evaluating with numpy
+CHUNK_SIZE = 2**20
+
+#_Classes_______________________________________________________________________
+
+class Expression() :
+    """
+    A parsed arithmetic expression. Only numbers, variable names, the
+    arithmetic, comparison and bitwise operators and the functions in
+    :const:`FUNCTIONS <data_slicer.expressions.FUNCTIONS>` are allowed.
+
+    **Attributes**
+
+    ======  ====================================================================
+    source  str; the expression.
+    names   tuple of str; the names of the variables, in order of appearance.
+    ======  ====================================================================
+    """
+    def __init__(self, source) :
+        self.source = source.strip()
+        try :
+            tree = ast.parse(self.source, mode='eval')
+        except SyntaxError as e :
+            raise ValueError('Invalid expression "{}": {}'.format(source, e))
+        names = dict()
+        for node in ast.walk(tree) :
+            if isinstance(node, (ast.BoolOp, ast.Not)) :
+                # These do not work elementwise on arrays
+                raise ValueError('"and", "or" and "not" are not allowed in '
+                                 'expressions. Use "&", "|" and "~" instead '
+                                 '(with parentheses around comparisons, '
+                                 'e.g. "(a > 0) & (b < 1)").')
+            if not isinstance(node, ALLOWED_NODES) :
+                raise ValueError('"{}" is not allowed in expressions.'.format(
+                                 type(node).__name__))
+            if isinstance(node, ast.Call) :
+                if not isinstance(node.func, ast.Name) or \
+                   node.func.id not in FUNCTIONS or node.keywords :
+                    raise ValueError('Unknown function in "{}". Allowed are: '
+                                     '{}.'.format(source,
+                                                  ', '.join(FUNCTIONS)))
+            elif isinstance(node, ast.Name) and node.id not in FUNCTIONS :
+                # ast.walk is breadth first, so keep the first position
+                position = (node.lineno, node.col_offset)
+                names[node.id] = min(names.get(node.id, position), position)
+        self.names = tuple(sorted(names, key=names.get))
+        self._code = compile(tree, '<expression>', 'eval')
+
+    def __repr__(self) :
+        return '<Expression "{}">'.format(self.source)
+
+    def __call__(self, variables) :
+        """ Evaluate the expression with numpy for the dict *variables*. """
+        namespace = dict(FUNCTIONS)
+        namespace.update(variables)
+        return eval(self._code, {'__builtins__': {}}, namespace)
+
+class ExpressionData(LazyArray) :
+    """
+    Dataset defined by an *expression* over other datasets, which is only
+    evaluated where it is accessed, e.g. for the displayed slices and cuts.
+    Call :meth:`compute <data_slicer.lazy.LazyArray.compute>` (or
+    ``np.asarray``) to materialize the whole dataset.
+
+    **Parameters**
+
+    ==========  ================================================================
+    expression  str or :class:`Expression
+                <data_slicer.expressions.Expression>`.
+    variables   dict; maps the names used in *expression* to array-likes
+                (np.arrays or :class:`LazyArrays <data_slicer.lazy.LazyArray>`)
+                or numbers. The arrays need to broadcast against each other.
+    n_workers   int; number of threads used for the evaluation.
+    ==========  ================================================================
+    """
+    def __init__(self, expression, variables, n_workers=None) :
+        self.expression = parse(expression)
+        _check_variables(self.expression, variables)
+        self.variables = {name: variables[name]
+                          for name in self.expression.names}
+        self.n_workers = n_workers
+        shapes = [v.shape for v in self.variables.values()
+                  if hasattr(v, 'shape')]
+        shape = np.broadcast_shapes(*shapes) if shapes else ()
+        if len(shape) == 0 :
+            raise ValueError('Expression "{}" does not involve any '
+                             'arrays.'.format(self.expression.source))
+        # Find the type of the result by evaluating a single element
+        single = self._evaluate(len(shape)*(slice(0, 1),), n_workers=1)
+        super().__init__(shape, single.dtype)
+
+    def _block(self, value, region) :
+        """ Return the part of *value* that is needed for *region*, taking
+        care of broadcast dimensions.
+        """
+        if not hasattr(value, 'shape') :
+            return value
+        region = region[len(region)-len(value.shape):]
+        region = tuple(r if n > 1 else slice(None)
+                       for r, n in zip(region, value.shape))
+        return np.asarray(value[region])
+
+    def _evaluate(self, region, n_workers) :
+        blocks = {name: self._block(value, region)
+                  for name, value in self.variables.items()}
+        return np.asarray(evaluate(self.expression, blocks,
+                                   n_workers=n_workers))
+
+    def _compute(self, region) :
+        result = self._evaluate(region, self.n_workers)
+        return np.broadcast_to(result, tuple(r.stop - r.start
+                                             for r in region))
+
+#_Functions_____________________________________________________________________
+
+@lru_cache(maxsize=128)
+def _parse(source) :
+    return Expression(source)
+
+def parse(expression) :
+    """ Return *expression* as an :class:`Expression
+    <data_slicer.expressions.Expression>`. Parsed strings are cached.
+    """
+    if isinstance(expression, Expression) :
+        return expression
+    return _parse(expression)
+
+def _check_variables(expression, variables) :
+    missing = [name for name in expression.names if name not in variables]
+    if missing :
+        raise NameError('Undefined variable(s) in "{}": {}'.format(
+                        expression.source, ', '.join(missing)))
+
+def evaluate(expression, variables, n_workers=None, chunk_size=CHUNK_SIZE) :
+    """
+    Evaluate *expression* for the np.arrays or numbers in the dict
+    *variables*, using all available threads (or *n_workers* threads).
+
+    **Parameters**
+
+    ==========  ================================================================
+    expression  str or :class:`Expression
+                <data_slicer.expressions.Expression>`.
+    variables   dict; maps names to np.arrays (which need to broadcast
+                against each other) or numbers.
+    n_workers   int; number of threads.
+    chunk_size  int; approximate number of elements that are evaluated at
+                once by each thread if numexpr is not available.
+    ==========  ================================================================
+
+    **Returns**
+
+    ======  ====================================================================
+    result  np.array; the value of the expression.
+    ======  ====================================================================
+    """
+    expression = parse(expression)
+    _check_variables(expression, variables)
+    arrays = {name: np.asarray(variables[name]) for name in expression.names}
+    if numexpr is not None :
+        if n_workers is None :
+            return numexpr.evaluate(expression.source, local_dict=arrays,
+                                    global_dict={})
+        # set_num_threads() changes a global setting: restore it afterwards
+        previous = numexpr.set_num_threads(n_workers)
+        try :
+            return numexpr.evaluate(expression.source, local_dict=arrays,
+                                    global_dict={})
+        finally :
+            numexpr.set_num_threads(previous)
+    shape = np.broadcast_shapes(*[a.shape for a in arrays.values()])
+    size = int(np.prod(shape))
+    if len(shape) == 0 or shape[0] < 2 or size <= chunk_size :
+        return np.asarray(expression(arrays))
+    # Bring all arrays to the same dimensionality and split them along the
+    # first dimension wherever they are not broadcast
+    arrays = {name: a.reshape((len(shape)-a.ndim)*(1,) + a.shape)
+              for name, a in arrays.items()}
+    per_index = max(1, size // shape[0])
+
+    def evaluate_chunk(chunk) :
+        blocks = {name: a[chunk] if a.shape[0] > 1 else a
+                  for name, a in arrays.items()}
+        return expression(blocks)
+
+    # The first chunk determines the type of the result
+    chunk_length = max(1, chunk_size // per_index)
+    first = np.asarray(evaluate_chunk(slice(0, chunk_length)))
+    result = np.empty(shape, dtype=first.dtype)
+    result[:chunk_length] = first
+
+    def process(chunk) :
+        chunk = slice(chunk.start + chunk_length, chunk.stop + chunk_length)
+        result[chunk] = evaluate_chunk(chunk)
+
+    map_chunks(process, shape[0] - chunk_length, chunk_size=chunk_length,
+               n_workers=n_workers)
+    return result
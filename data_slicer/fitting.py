@@ -0,0 +1,508 @@
+"""
+Fitting of a :class:`Model <data_slicer.model.Model>` to a large number of
+one dimensional spectra at once, e.g. a line shape to all MDCs or EDCs of a
+cut or of a whole data cube.
+
+The fits are done with a Levenberg-Marquardt algorithm that is vectorized
+over a batch of spectra: the model is evaluated for all spectra of a batch
+in one call, with the parameters as arrays of shape (n_spectra, 1) that
+broadcast against the axis. Models written with numpy functions or as
+expressions therefore need no changes. Every spectrum keeps its own damping
+and stops iterating once it has converged.
+
+Neighbouring spectra usually have similar parameters. The spectra are
+therefore fitted from coarse to fine: first every s-th spectrum, one after
+the other, starting from the initial guess and then from the result of the
+previous one. Then the spectra in between are fitted, each starting from
+the result of its already fitted neighbour, halving s on every level. The
+spectra of these levels are divided into batches which are fitted in
+parallel by a pool of threads (or processes)::
+
+    def lorentzian(x, *, x0=0, gamma=1, a=1) :
+        return a / (1 + ((x - x0)/gamma)**2)
+
+    result = fit(lorentzian, data, x=energies, axis=2,
+                 p0=dict(x0=0, gamma=0.1, a=1))
+    result['gamma']
+    mw = pit.MainWindow(data=result.as_cube())
+"""
+import logging
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from types import FunctionType
+
+import numpy as np
+
+from data_slicer.model import Model, evaluate_model
+from data_slicer.utilities import iter_chunks, map_chunks
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Number of spectra that are fitted together in one vectorized batch
+BATCH_SIZE = 1024
+
+# Number of spectra on the coarsest level, which start from the initial guess
+FIRST_LEVEL = 64
+
+MAX_ITER = 100
+
+# Relative decrease of the sum of squares below which a fit has converged
+TOL = 1e-8
+
+# Initial damping of the Levenberg-Marquardt steps and the damping above
+# which a fit is considered stuck in its minimum
+LAMBDA0 = 1e-3
+LAMBDA_MAX = 1e10
+
+# Relative step of the finite differences for the Jacobian
+EPS = 1e-6
+
+# Approximate size of the slabs in which array-likes other than np.arrays 
+# are read
+SLAB_BYTES = 2**26
+
+#_Functions_____________________________________________________________________
+
+def snake_order(shape) :
+    """ Return the flat indices of an array of *shape* in boustrophedon
+    order, i.e. such that successive indices are neighbours in the grid:
+    every other row is traversed backwards (and likewise in higher
+    dimensions).
+    """
+    coords = np.indices(shape).reshape(len(shape), -1)
+    digits = coords.copy()
+    for d in range(1, len(shape)) :
+        backwards = coords[:d].sum(axis=0) % 2 == 1
+        digits[d, backwards] = shape[d] - 1 - coords[d, backwards]
+    return np.lexsort(digits[::-1])
+
+def refinement_levels(shape, first=FIRST_LEVEL) :
+    """ Divide the grid of spectra of *shape* into the levels of the coarse
+    to fine fitting order. The first level consists of the grid points
+    whose coordinates are all multiples of a stride s. On every following
+    level, s is halved and the new grid points start from the nearest point
+    of the previous levels.
+
+    **Parameters**
+
+    =====  =====================================================================
+    shape  tuple of int; the shape of the grid of spectra.
+    first  int; approximate number of spectra on the first level.
+    =====  =====================================================================
+
+    **Returns**
+
+    ======  ====================================================================
+    levels  list of tuples (indices, sources) of flat int np.arrays; the
+            spectra of each level and, for all levels but the first, the
+            already fitted neighbour each of them starts from. On the first
+            level, *sources* is *None* and the spectra are in
+            :func:`snake_order <data_slicer.fitting.snake_order>`, such that
+            each of them is a neighbour of the previous one.
+    ======  ====================================================================
+    """
+    shape = tuple(shape)
+    def n_points(stride) :
+        return int(np.prod([-(-n // stride) for n in shape]))
+    stride = 1
+    while n_points(2*stride) >= first and 2*stride < max(shape) :
+        stride *= 2
+    coarse_shape = tuple(-(-n // stride) for n in shape)
+    coarse = np.unravel_index(snake_order(coarse_shape), coarse_shape)
+    indices = np.ravel_multi_index(tuple(c*stride for c in coarse), shape)
+    levels = [(indices, None)]
+    coords = np.indices(shape).reshape(len(shape), -1)
+    while stride > 1 :
+        stride //= 2
+        on_level = (coords % stride == 0).all(axis=0) & \
+                   ~(coords % (2*stride) == 0).all(axis=0)
+        indices = np.flatnonzero(on_level)
+        sources = coords[:, on_level] - coords[:, on_level] % (2*stride)
+        levels.append((indices, np.ravel_multi_index(tuple(sources), shape)))
+    return levels
+
+def _evaluate(function, x, params, names, fixed) :
+    """ Evaluate the model *function* at *x* for every row of *params*. """
+    kwargs = dict(fixed)
+    for k, name in enumerate(names) :
+        kwargs[name] = params[:, k:k+1]
+    return evaluate_model(function, [x[np.newaxis]], kwargs,
+                          (len(params), len(x)))
+
+def _jacobian(function, x, params, names, fixed, model, weights) :
+    """ Forward differences of the weighted model with respect to the
+    *params*, of shape (n_spectra, len(x), n_params).
+    """
+    steps = EPS * np.maximum(np.abs(params), 1)
+    jacobian = np.empty(params.shape[:1] + x.shape + params.shape[1:])
+    for k in range(params.shape[1]) :
+        shifted = params.copy()
+        shifted[:, k] += steps[:, k]
+        jacobian[..., k] = weights * (_evaluate(function, x, shifted, names,
+                                                fixed) - model) / \
+                           steps[:, k:k+1]
+    return jacobian
+
+def levenberg_marquardt(function, x, spectra, p0, names, fixed=dict(),
+                        max_iter=MAX_ITER, tol=TOL) :
+    """
+    Fit the model *function* to all *spectra* at once. Invalid values
+    (NaN) in the spectra are ignored.
+
+    **Parameters**
+
+    ========  ==================================================================
+    function  callable; the model, called as ``function(x, **parameters)``
+              with parameters of shape (n_spectra, 1).
+    x         1d np.array of length N; the axis of the spectra.
+    spectra   np.array of shape (n_spectra, N).
+    p0        np.array of shape (n_spectra, n_params); the initial guesses.
+    names     sequence of str; the names of the fitted parameters.
+    fixed     dict; further keyword arguments to *function*.
+    max_iter  int; maximum number of iterations.
+    tol       float; relative decrease of the sum of squares at which a fit
+              has converged.
+    ========  ==================================================================
+
+    **Returns**
+
+    =========  =================================================================
+    params     np.array of shape (n_spectra, n_params); the best parameters.
+    errors     np.array of shape (n_spectra, n_params); their standard
+               errors estimated from the Jacobian.
+    cost       np.array of shape (n_spectra,); the sums of squared residuals.
+    n_iter     int np.array of shape (n_spectra,); iterations per spectrum.
+    converged  bool np.array of shape (n_spectra,).
+    =========  =================================================================
+    """
+    x = np.asarray(x, dtype=float)
+    spectra = np.asarray(spectra, dtype=float)
+    params = np.array(p0, dtype=float)
+    n_spectra, n_params = params.shape
+    weights = np.isfinite(spectra).astype(float)
+    spectra = np.where(weights > 0, spectra, 0)
+
+    model = _evaluate(function, x, params, names, fixed)
+    residuals = weights * (spectra - model)
+    cost = (residuals**2).sum(axis=1)
+    damping = np.full(n_spectra, LAMBDA0)
+    n_iter = np.zeros(n_spectra, dtype=int)
+    converged = np.zeros(n_spectra, dtype=bool)
+    diagonal = np.arange(n_params)
+
+    for i in range(max_iter) :
+        active = np.flatnonzero(~converged)
+        if len(active) == 0 :
+            break
+        p = params[active]
+        w = weights[active]
+        jacobian = _jacobian(function, x, p, names, fixed, model[active], w)
+        jt = jacobian.transpose(0, 2, 1)
+        curvature = jt @ jacobian
+        gradient = (jt @ residuals[active][..., np.newaxis])[..., 0]
+        # Marquardt's scaling of the damping with the diagonal, which is
+        # replaced by 1 for parameters that have no effect
+        scale = curvature[:, diagonal, diagonal].copy()
+        scale[scale <= 0] = 1
+        damped = curvature.copy()
+        damped[:, diagonal, diagonal] += damping[active, np.newaxis] * scale
+        try :
+            step = np.linalg.solve(damped, gradient[..., np.newaxis])[..., 0]
+        except np.linalg.LinAlgError :
+            step = (np.linalg.pinv(damped) @
+                    gradient[..., np.newaxis])[..., 0]
+
+        trial = p + step
+        trial_model = _evaluate(function, x, trial, names, fixed)
+        trial_residuals = w * (spectra[active] - trial_model)
+        trial_cost = (trial_residuals**2).sum(axis=1)
+        n_iter[active] += 1
+
+        better = np.isfinite(trial_cost) & (trial_cost < cost[active])
+        accepted = active[better]
+        decrease = cost[accepted] - trial_cost[better]
+        params[accepted] = trial[better]
+        model[accepted] = trial_model[better]
+        residuals[accepted] = trial_residuals[better]
+        cost[accepted] = trial_cost[better]
+        damping[accepted] /= 10
+        damping[active[~better]] *= 10
+
+        done = np.zeros(len(active), dtype=bool)
+        done[better] = decrease <= tol * (cost[accepted] + tol)
+        # No further improvement possible even with tiny steps
+        done |= damping[active] > LAMBDA_MAX
+        converged[active[done]] = True
+
+    # Standard errors from the curvature at the final parameters
+    jacobian = _jacobian(function, x, params, names, fixed, model, weights)
+    curvature = jacobian.transpose(0, 2, 1) @ jacobian
+    dof = np.maximum(weights.sum(axis=1) - n_params, 1)
+    with np.errstate(invalid='ignore') :
+        covariance = np.linalg.pinv(curvature)
+        errors = np.sqrt(covariance[:, diagonal, diagonal] *
+                         (cost / dof)[:, np.newaxis])
+    return params, errors, cost, n_iter, converged
+
+def _fit_batch(function, x, spectra, p0, names, fixed, max_iter, tol) :
+    """ Worker: fit one batch (see :func:`levenberg_marquardt
+    <data_slicer.fitting.levenberg_marquardt>`). Defined at the top level
+    such that it can be sent to other processes.
+    """
+    return levenberg_marquardt(function, x, spectra, p0, names, fixed,
+                               max_iter=max_iter, tol=tol)
+
+def fit(model, data, x=None, axis=-1, p0=None, fixed=None,
+        batch_size=BATCH_SIZE, warm_start=True, max_iter=MAX_ITER, tol=TOL,
+        n_workers=None, processes=False) :
+    """
+    Fit *model* to all one dimensional spectra along *axis* of the N
+    dimensional array *data*.
+
+    **Parameters**
+
+    ==========  ================================================================
+    model       :class:`Model <data_slicer.model.Model>`, function or
+                expression with a single axis; the line shape.
+    data        array-like; N dimensional dataset.
+    x           1d array-like; values along *axis*. Defaults to the indices.
+    axis        int; the dimension along which the spectra run.
+    p0          dict; the fitted parameters and their initial values.
+    fixed       dict; further parameters of the model that are not fitted.
+    batch_size  int; number of spectra that are fitted together.
+    warm_start  bool; fit from coarse to fine, starting every spectrum but
+                the first from the result of a neighbour (see
+                :func:`refinement_levels
+                <data_slicer.fitting.refinement_levels>`). Otherwise, all
+                spectra start from *p0*.
+    max_iter    int; maximum number of iterations per spectrum.
+    tol         float; relative decrease of the sum of squares at which a
+                fit has converged.
+    n_workers   int; number of threads (or processes). Defaults to the
+                number of CPUs.
+    processes   bool; distribute the batches among processes instead of
+                threads, which helps for models written in pure python. The
+                model needs to be picklable, otherwise a ValueError is
+                raised.
+    ==========  ================================================================
+
+    Array-likes that are not np.arrays (e.g. a :class:`ChunkedArray
+    <data_slicer.chunked.ChunkedArray>`) are read and fitted in slabs of
+    about :const:`SLAB_BYTES <data_slicer.fitting.SLAB_BYTES>` along their
+    first dimension (other than *axis*), such that they never need to be
+    held in memory as a whole.
+
+    **Returns**
+
+    ======  ====================================================================
+    result  :class:`FitResult <data_slicer.fitting.FitResult>`
+    ======  ====================================================================
+    """
+    if not p0 :
+        raise ValueError('*p0* needs to specify at least one parameter.')
+    names = tuple(p0)
+    fixed = dict() if fixed is None else dict(fixed)
+    if isinstance(model, str) :
+        # All names in the expression but the axis are parameters
+        model = Model(model, parameters=dict(fixed, **p0))
+    elif isinstance(model, FunctionType) :
+        model = Model(model)
+    model._check_if_model_defined()
+    if model.n_args != 1 :
+        raise ValueError('Only models of a single axis can be fitted, but '
+                         'the model has {}.'.format(model.n_args))
+    if processes :
+        try :
+            pickle.dumps(model.model)
+        except Exception as e :
+            raise ValueError('Fitting in processes needs a picklable model '
+                             '(lambdas and nested functions are not). Use '
+                             'processes=False to fit in threads.') from e
+
+    kwargs = dict(x=x, axis=axis, fixed=fixed, batch_size=batch_size,
+                  warm_start=warm_start, max_iter=max_iter, tol=tol,
+                  n_workers=n_workers, processes=processes)
+    if not isinstance(data, np.ndarray) and len(data.shape) > 1 :
+        return _fit_slabs(model, data, p0, **kwargs)
+
+    moved = np.moveaxis(np.asarray(data), axis, -1)
+    outer_shape = moved.shape[:-1]
+    n = moved.shape[-1]
+    x = np.arange(n, dtype=float) if x is None else \
+        np.asarray(x, dtype=float)
+    if len(x) != n :
+        raise ValueError('*x* has length {}, but the spectra have {} '
+                         'points.'.format(len(x), n))
+    spectra = moved.reshape(-1, n)
+    n_spectra = len(spectra)
+    n_params = len(names)
+
+    params = np.empty((n_spectra, n_params))
+    errors = np.empty((n_spectra, n_params))
+    cost = np.empty(n_spectra)
+    n_iter = np.empty(n_spectra, dtype=int)
+    converged = np.empty(n_spectra, dtype=bool)
+    initial = np.array([p0[name] for name in names], dtype=float)
+
+    if warm_start :
+        levels = refinement_levels(outer_shape or (1,))
+    else :
+        levels = [(np.arange(n_spectra), None)]
+
+    executor = None
+    if processes :
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+    def store(batch, result) :
+        params[batch], errors[batch], cost[batch], n_iter[batch], \
+        converged[batch] = result
+
+    def usable(batch) :
+        """ Whether the fits of *batch* are good starting points. """
+        return converged[batch] & np.isfinite(params[batch]).all(axis=-1)
+
+    try :
+        for indices, sources in levels :
+            if sources is None and warm_start :
+                # Follow the coarse spectra one by one
+                start = initial
+                for index in indices :
+                    store([index], _fit_batch(model.model, x,
+                                              spectra[[index]],
+                                              start[np.newaxis], names,
+                                              fixed, max_iter, tol))
+                    if usable(index) :
+                        start = params[index]
+                continue
+            elif sources is None :
+                starts = np.broadcast_to(initial, (len(indices), n_params))
+            else :
+                # Neighbours whose fit failed are no good starting point
+                starts = params[sources]
+                starts[~usable(sources)] = initial
+            chunks = list(iter_chunks(len(indices), batch_size))
+            args = [(model.model, x, spectra[indices[chunk]],
+                     starts[chunk], names, fixed, max_iter, tol)
+                    for chunk in chunks]
+            if executor is not None :
+                results = list(executor.map(_fit_batch, *zip(*args)))
+            else :
+                results = map_chunks(lambda c : _fit_batch(*args[c.start]),
+                                     len(args), chunk_size=1,
+                                     n_workers=n_workers)
+            for chunk, result in zip(chunks, results) :
+                store(indices[chunk], result)
+    finally :
+        if executor is not None :
+            executor.shutdown()
+
+    logger.debug('fit(): {} of {} spectra converged in {} levels.'.format(
+                 converged.sum(), n_spectra, len(levels)))
+    return FitResult(names, params.reshape(outer_shape + (n_params,)),
+                     errors.reshape(outer_shape + (n_params,)),
+                     cost.reshape(outer_shape), n_iter.reshape(outer_shape),
+                     converged.reshape(outer_shape), model=model, x=x,
+                     axis=axis, fixed=fixed)
+
+def _fit_slabs(model, data, p0, axis=-1, **kwargs) :
+    """ Apply :func:`fit <data_slicer.fitting.fit>` to consecutive slabs of
+    the array-like *data* along its first dimension other than *axis*. The
+    first spectrum of every slab starts from the result of its neighbour in
+    the previous slab.
+    """
+    shape = data.shape
+    axis = axis % len(shape)
+    dim = 1 if axis == 0 else 0
+    n = shape[dim]
+    bytes_per_index = max(1, int(np.prod(shape)) // max(1, n) *
+                             np.dtype(data.dtype).itemsize)
+    results = []
+    start = dict(p0)
+    for chunk in iter_chunks(n, max(1, SLAB_BYTES // bytes_per_index)) :
+        key = len(shape)*[slice(None)]
+        key[dim] = chunk
+        result = fit(model, np.asarray(data[tuple(key)]), p0=start,
+                     axis=axis, **kwargs)
+        results.append(result)
+        # The result has the dimensions of the data without *axis*, so the 
+        # slabs run along its first dimension
+        last = (-1,) + (result.cost.ndim - 1)*(0,)
+        values = result.values[last]
+        if result.converged[last] and np.isfinite(values).all() :
+            start = dict(zip(result.names, values))
+
+    def join(name) :
+        return np.concatenate([getattr(r, name) for r in results])
+
+    return FitResult(results[0].names, join('values'), join('errors'),
+                     join('cost'), join('n_iter'), join('converged'),
+                     model=results[0].model, x=results[0].x, axis=axis,
+                     fixed=results[0].fixed)
+
+#_Classes_______________________________________________________________________
+
+class FitResult() :
+    """
+    Parameter maps of the fits of many spectra, as returned by :func:`fit
+    <data_slicer.fitting.fit>`. The maps have the shape of the data without
+    the fitted axis. Single parameters are accessed by name, e.g.
+    ``result['gamma']``.
+
+    **Attributes**
+
+    =========  =================================================================
+    names      tuple of str; the names of the fitted parameters.
+    values     np.array of shape (..., n_params); the best parameters.
+    errors     np.array of shape (..., n_params); their standard errors.
+    cost       np.array; the sums of squared residuals.
+    n_iter     int np.array; the number of iterations of every fit.
+    converged  bool np.array; whether the fits converged.
+    =========  =================================================================
+    """
+    def __init__(self, names, values, errors, cost, n_iter, converged,
+                 model=None, x=None, axis=-1, fixed=dict()) :
+        self.names = tuple(names)
+        self.values = values
+        self.errors = errors
+        self.cost = cost
+        self.n_iter = n_iter
+        self.converged = converged
+        self.model = model
+        self.x = x
+        self.axis = axis
+        self.fixed = fixed
+
+    def __repr__(self) :
+        return '<FitResult: {} of shape {}, {:.1%} converged>'.format(
+                ', '.join(self.names), self.cost.shape,
+                self.converged.mean() if self.converged.size else 0)
+
+    def __getitem__(self, name) :
+        return self.values[..., self.names.index(name)]
+
+    def get_error(self, name) :
+        """ Return the map of the standard errors of parameter *name*. """
+        return self.errors[..., self.names.index(name)]
+
+    def as_cube(self) :
+        """ Return the parameter maps stacked along the last dimension
+        (in the order of :attr:`names`) with at least three dimensions,
+        such that they can be opened in PIT.
+        """
+        cube = self.values
+        while cube.ndim < 3 :
+            cube = cube[..., np.newaxis, :]
+        return cube
+
+    def best_fit(self) :
+        """ Return the fitted model evaluated for every spectrum, in the
+        layout of the original data.
+        """
+        n_params = len(self.names)
+        params = self.values.reshape(-1, n_params)
+        curves = _evaluate(self.model.model, self.x, params, self.names,
+                           self.fixed)
+        curves = curves.reshape(self.cost.shape + (len(self.x),))
+        return np.moveaxis(curves, -1, self.axis)
+
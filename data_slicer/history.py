@@ -0,0 +1,233 @@
+"""
+Copy-on-write history of the processing steps applied to a dataset.
+
+The loaded data is kept read-only and every step produces a new state that
+shares as much memory as possible with the previous ones: lazy operations
+(transpositions, remapping, normalization, expressions, ...) are just views
+and local modifications (see :class:`PatchedArray
+<data_slicer.history.PatchedArray>`) only copy the chunks they touch. This
+allows undoing and redoing steps without ever holding the data twice.
+"""
+import logging
+
+import numpy as np
+
+from data_slicer.lazy import LazyArray, chunk_overlap, chunk_region, \
+                             chunks_in, normalize_key, region_shape
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Default length of the chunks of a PatchedArray along each dimension
+CHUNK_LENGTH = 64
+
+# Maximum number of states that are kept in a History
+MAX_STEPS = 100
+
+# Maximum number of full arrays (like the result of a background 
+# subtraction), apart from the initial data, that are kept in a History
+MAX_FULL_STATES = 5
+
+#_Classes_______________________________________________________________________
+
+class PatchedArray(LazyArray) :
+    """
+    Writable view of the read-only array-like *base*. Assignments
+    (``patched[key] = values``) copy only the chunks of shape *chunk_shape*
+    that they touch. Patched chunks are never modified in place, so that
+    :meth:`snapshot <data_slicer.history.PatchedArray.snapshot>` is cheap and
+    earlier snapshots stay valid.
+    """
+    def __init__(self, base, chunk_shape=None) :
+        self.base = base
+        if chunk_shape is None :
+            chunk_shape = len(base.shape)*(CHUNK_LENGTH,)
+        self.chunk_shape = tuple(int(n) for n in chunk_shape)
+        # Maps chunk indices (tuples) to np.arrays
+        self.patches = dict()
+        super().__init__(base.shape, base.dtype)
+
+    @property
+    def patched_bytes(self) :
+        """ Memory used by the patched chunks. """
+        return sum(patch.nbytes for patch in self.patches.values())
+
+    def _chunk_region(self, index) :
+        return chunk_region(index, self.chunk_shape, self.shape)
+
+    def _chunks_in(self, region) :
+        """ Yield the indices of all chunks that overlap with *region*. """
+        return chunks_in(region, self.chunk_shape)
+
+    def _overlap(self, region, index) :
+        """ Return the slices of the overlap between *region* and chunk
+        *index*, relative to the region and relative to the chunk.
+        """
+        return chunk_overlap(region, self._chunk_region(index))
+
+    def _compute(self, region) :
+        block = np.array(self.base[region], dtype=self.dtype)
+        if not self.patches or 0 in region_shape(region) :
+            return block
+        for index in self._chunks_in(region) :
+            patch = self.patches.get(index)
+            if patch is not None :
+                in_region, in_chunk = self._overlap(region, index)
+                block[in_region] = patch[in_chunk]
+        return block
+
+    def __setitem__(self, key, values) :
+        region, post = normalize_key(key, self.shape)
+        if 0 in region_shape(region) :
+            return
+        block = self._compute(region)
+        block[post] = values
+        for index in self._chunks_in(region) :
+            in_region, in_chunk = self._overlap(region, index)
+            old = self.patches.get(index)
+            # Copy on write: never modify a chunk that may be referenced by
+            # a snapshot
+            if old is None :
+                new = np.array(self.base[self._chunk_region(index)],
+                               dtype=self.dtype)
+            else :
+                new = old.copy()
+            new[in_chunk] = block[in_region]
+            self.patches[index] = new
+
+    def snapshot(self) :
+        """ Return the current state of the patches. """
+        return dict(self.patches)
+
+    def restore(self, snapshot) :
+        """ Return to the state of a previous :meth:`snapshot
+        <data_slicer.history.PatchedArray.snapshot>`.
+        """
+        self.patches = dict(snapshot)
+
+class History() :
+    """
+    Linear undo/redo history of states. A state is a dict (e.g. of data,
+    axes and further metadata) together with a label describing the step
+    that led to it. Recording a new state after undoing discards the
+    states that could have been redone. At most *max_steps* states are
+    kept, apart from the first one, which always stays available. Of the
+    states whose data is a np.array of its own (rather than a view or a
+    lazy operation), only the latest *max_full* are kept, such that the
+    history does not hold the data many times over.
+    """
+    def __init__(self, max_steps=MAX_STEPS, max_full=MAX_FULL_STATES) :
+        self.max_steps = max_steps
+        self.max_full = max_full
+        self.labels = []
+        self.states = []
+        self.position = -1
+
+    def __repr__(self) :
+        return '<History: {} of {} steps>'.format(self.position+1,
+                                                  len(self.states))
+
+    def __len__(self) :
+        return len(self.states)
+
+    @property
+    def current(self) :
+        """ The current state (or *None* if nothing was recorded yet). """
+        if self.position < 0 :
+            return None
+        return self.states[self.position]
+
+    @property
+    def can_undo(self) :
+        return self.position > 0
+
+    @property
+    def can_redo(self) :
+        return self.position < len(self.states) - 1
+
+    @property
+    def n_full(self) :
+        """ Number of distinct np.arrays, apart from the initial data, that
+        are held by the states.
+        """
+        if not self.states :
+            return 0
+        initial = owner(self.states[0].get('data'))
+        owners = set(id(owner(state.get('data'))) 
+                     for state in self.states[1:])
+        return len(owners - {id(None), id(initial)})
+
+    def record(self, label, **state) :
+        """ Add a new state, reached by the step *label*, after the current
+        one. Return the state.
+        """
+        del self.states[self.position+1:]
+        del self.labels[self.position+1:]
+        if 'data' in state :
+            state['data'] = freeze(state['data'])
+        self.states.append(state)
+        self.labels.append(label)
+        while len(self.states) > 2 and \
+              (len(self.states) > self.max_steps > 1 or
+               self.n_full > self.max_full) :
+            # Drop the oldest step but keep the initial state
+            del self.states[1]
+            del self.labels[1]
+        self.position = len(self.states) - 1
+        logger.debug('History: {}'.format(label))
+        return state
+
+    def update(self, **state) :
+        """ Change entries of the current state without adding a step,
+        e.g. to follow a change of the view that should not be undone on
+        its own. Return the state.
+        """
+        if self.current is None :
+            raise IndexError('No state to update.')
+        if 'data' in state :
+            state['data'] = freeze(state['data'])
+        self.current.update(state)
+        return self.current
+
+    def undo(self) :
+        """ Go back one step and return the state there. """
+        if not self.can_undo :
+            raise IndexError('Nothing to undo.')
+        self.position -= 1
+        return self.current
+
+    def redo(self) :
+        """ Go forward one step and return the state there. """
+        if not self.can_redo :
+            raise IndexError('Nothing to redo.')
+        self.position += 1
+        return self.current
+
+    def clear(self) :
+        """ Remove all states. """
+        self.labels = []
+        self.states = []
+        self.position = -1
+
+#_Functions_____________________________________________________________________
+
+def freeze(data) :
+    """ Return a read-only view of the np.array *data*, such that it can be
+    shared between states without being modified. Other array-likes are
+    returned unchanged.
+    """
+    if isinstance(data, np.ndarray) and data.flags.writeable :
+        data = data.view()
+        data.flags.writeable = False
+    return data
+
+def owner(data) :
+    """ Return the np.array that owns the memory of the np.array *data* (or
+    *None* for other array-likes).
+    """
+    if not isinstance(data, np.ndarray) :
+        return None
+    while isinstance(data.base, np.ndarray) :
+        data = data.base
+    return data
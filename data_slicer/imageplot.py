@@ -7,13 +7,17 @@ import pyqtgraph as pg
 from matplotlib.colors import ListedColormap
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
-from numpy import arange, array, clip, inf, linspace, ndarray
+from numpy import arange, array, asarray, clip, inf, linspace, ndarray
 from pyqtgraph import Qt as qt #import QtCore
 from pyqtgraph import PlotDataItem
 from pyqtgraph.graphicsItems.ImageItem import ImageItem
 from pyqtgraph.widgets import PlotWidget, GraphicsView
 
+from data_slicer import dtypes
 from data_slicer.dsviewbox import DSViewBox
+from data_slicer.playback import Player, PlayerControls
+from data_slicer.remapping import apply_index_maps, display_index_maps, \
+                                  fractional_index
 from data_slicer.utilities import get_lines, TracedVariable, indexof
 
 logger = logging.getLogger('ds.'+__name__)
@@ -335,6 +339,9 @@ class ImagePlot(pg.PlotWidget) :
         self.xscale = None
         self.yscale = None
         self.transform_factors = []
+        # Maps used to display data with non-uniform x or y scales on a 
+        # uniform grid (None for uniform scales)
+        self.index_maps = (None, None)
         self.transposed = TracedVariable(False, name='transposed')
         self.crosshair_cursor_visible = False
 
@@ -430,7 +437,9 @@ class ImagePlot(pg.PlotWidget) :
 
         ========  ==============================================================
         image     np.ndarray or pyqtgraph.ImageItem instance; the image to be
-                  displayed.
+                  displayed. Arrays are converted to the display dtype of 
+                  the current :class:`DtypePolicy 
+                  <data_slicer.dtypes.DtypePolicy>`, if one is set.
         emit      bool; whether or not to emit :signal:`sig_image_changed`
         (kw)args  positional and keyword arguments that are passed on to 
                   :class:`pyqtgraph.ImageItem`
@@ -439,6 +448,7 @@ class ImagePlot(pg.PlotWidget) :
         # Convert array to ImageItem
         if isinstance(image, ndarray) :
             if 0 not in image.shape :
+                image = dtypes.policy.to_display(image)
                 image_item = ImageItem(image, *args, **kwargs)
             else :
                 logger.debug(('<{}>.set_image(): image.shape is {}. Not '
@@ -498,7 +508,7 @@ class ImagePlot(pg.PlotWidget) :
         """
         # Sanity check
         if not force and self.image_item is not None and \
-        len(xscale) != self.image_item.image.shape[0] :
+        len(xscale) != self.image_data.shape[0] :
             raise TypeError('Shape of xscale does not match data dimensions.')
 
         self.xscale = xscale
@@ -514,7 +524,7 @@ class ImagePlot(pg.PlotWidget) :
         """
         # Sanity check
         if not force and self.image_item is not None and \
-        len(yscale) != self.image_item.image.shape[1] :
+        len(yscale) != self.image_data.shape[1] :
             raise TypeError('Shape of yscale does not match data dimensions.')
 
         self.yscale = yscale
@@ -535,9 +545,11 @@ class ImagePlot(pg.PlotWidget) :
         # Update the image
         if not self.transposed.get_value() :
             # Take care of the back-transposition here
-            self.set_image(self.image_item.image.T, lut=self.image_item.lut)
+            self.set_image(self.image_data.T, lut=self.image_item.lut, 
+                           levels=self.image_item.getLevels())
         else :
-            self.set_image(self.image_item, lut=self.image_item.lut)
+            self.set_image(self.image_data, lut=self.image_item.lut, 
+                           levels=self.image_item.getLevels())
 
     def set_xlabel(self, label) :
         """ Shorthand for setting this plot's x axis label. """
@@ -551,8 +563,12 @@ class ImagePlot(pg.PlotWidget) :
 
     def _set_axes_scales(self, emit=False) :
         """ Transform the image such that it matches the desired x and y 
-        scales.
+        scales. Non-uniform scales are handled by resampling the image onto 
+        a uniform grid with cached index maps (see 
+        :func:`display_index_maps 
+        <data_slicer.remapping.display_index_maps>`).
         """
+        self._update_index_maps()
         # Get image dimensions and requested origin (x0,y0) and top right 
         # corner (x1, y1)
         nx, ny = self.image_item.image.shape
@@ -579,21 +595,100 @@ class ImagePlot(pg.PlotWidget) :
             logger.info('<{}>Emitting sig_axes_changed.'.format(self.name))
             self.sig_axes_changed.emit()
 
+    def _update_index_maps(self) :
+        """ Look up the index maps for the current scales and resample the 
+        displayed image accordingly.
+        """
+        maps = (None, None)
+        if self.xscale is not None and self.yscale is not None and \
+           (len(self.xscale), len(self.yscale)) == self.image_data.shape :
+            maps = display_index_maps(self.xscale, self.yscale)
+        self.index_maps = maps
+        if self.has_index_maps :
+            image = apply_index_maps(self.image_data, maps)
+        elif self.image_item.image is not self.image_data :
+            image = self.image_data
+        else :
+            return
+        self.image_item.setImage(image, levels=self.image_item.getLevels())
+
+    @property
+    def has_index_maps(self) :
+        """ *True* if the displayed image is resampled because of 
+        non-uniform scales.
+        """
+        return any(m is not None for m in self.index_maps)
+
+    def display_to_index(self, position, dim) :
+        """ Convert a (fractional) *position* in the pixel coordinates of 
+        the displayed image along dimension *dim* (0 for horizontal, 1 for 
+        vertical) to the (fractional) index into *image_data*.
+        """
+        indices = self.index_maps[dim]
+        if indices is None :
+            return position
+        scale = [self.xscale, self.yscale][dim]
+        start, stop = [self.xlim, self.ylim][dim]
+        x = start + asarray(position) * (stop - start)/len(indices)
+        return fractional_index(scale, x)
+
+    def index_to_display(self, index, dim) :
+        """ Inverse of :meth:`display_to_index 
+        <data_slicer.imageplot.ImagePlot.display_to_index>` for the pixel 
+        centers: return the position of the center of the pixels at *index* 
+        along *dim* in the pixel coordinates of the displayed image.
+        """
+        indices = self.index_maps[dim]
+        if indices is None :
+            return asarray(index) + 0.5
+        scale = asarray([self.xscale, self.yscale][dim])
+        start, stop = [self.xlim, self.ylim][dim]
+        return (scale[index] - start) / (stop - start) * len(indices)
+
+    def get_pixel_positions(self, ix, iy) :
+        """ Convert indices into the (untransposed) image data to the data 
+        coordinates of the respective pixel centers, taking into account the 
+        current transformation of the image.
+
+        **Parameters**
+
+        ==  ====================================================================
+        ix  int or array of int; first indices of the pixels.
+        iy  int or array of int; second indices of the pixels.
+        ==  ====================================================================
+
+        **Returns**
+
+        =  =====================================================================
+        x  float or array; horizontal coordinates of the pixel centers.
+        y  float or array; vertical coordinates of the pixel centers.
+        =  =====================================================================
+        """
+        if self.transposed.get_value() :
+            ix, iy = iy, ix
+        ix = self.index_to_display(ix, 0)
+        iy = self.index_to_display(iy, 1)
+        t = self.image_item.transform()
+        x = t.m11()*ix + t.m21()*iy + t.dx()
+        y = t.m12()*ix + t.m22()*iy + t.dy()
+        return x, y
+
     def get_limits(self) :
         """ Return ``[[x_min, x_max], [y_min, y_max]]``. """
         # Default to current viewrange but try to get more accurate values if 
         # possible
-        if self.image_item is not None :
-            x, y = self.image_item.image.shape
+        if self.image_data is not None :
+            x, y = self.image_data.shape
         else :
             x, y = 1, 1
 
-        # Set the limits to image pixels if they are not defined
+        # Set the limits to image pixels if they are not defined. The shape 
+        # refers to the displayed (possibly transposed) image.
         if self.xlim is None :
-            self.set_xscale(arange(0, x))
+            self._set_xscale(arange(0, x))
         x_min, x_max = self.xlim
         if self.ylim is None :
-            self.set_yscale(arange(0, y))
+            self._set_yscale(arange(0, y))
         y_min, y_max = self.ylim
 
         logger.debug(('<{}>get_limits(): [[x_min, x_max], [y_min, y_max]] = '
@@ -859,6 +954,8 @@ class CursorPlot(pg.PlotWidget) :
 
         # Whether to allow changing the slider width with arrow keys
         self.change_width_enabled = False
+        # Animation of the slider position, see enable_playback()
+        self.player = None
 
         if orientation not in ['horizontal', 'vertical'] :
             raise ValueError('Only `horizontal` or `vertical` are allowed for '
@@ -946,6 +1043,21 @@ class CursorPlot(pg.PlotWidget) :
         self.pos = traced_variable
         self.pos.sig_value_changed.connect(self.set_position)
         self.pos.sig_allowed_values_changed.connect(self.on_allowed_values_change)
+        if self.player is not None :
+            self.player.stop()
+            self.player.traced_variable = traced_variable
+
+    def enable_playback(self, **kwargs) :
+        """ Add a play button to the top left corner that animates the 
+        slider position with a :class:`Player <data_slicer.playback.Player>` 
+        (stored as *self.player*). *kwargs* are passed on to the Player. 
+        """
+        if self.player is None :
+            self.player = Player(self.pos, **kwargs)
+            self.player_controls = PlayerControls(self.player, parent=self)
+            self.player_controls.move(0, 0)
+            self.player_controls.show()
+        return self.player
 
     def on_position_change(self) :
         """ Callback for the :signal:`sigDragged 
@@ -1091,6 +1203,8 @@ class CursorPlot(pg.PlotWidget) :
             self.increase_width(1)
         elif self.change_width_enabled and key == qt.QtCore.Qt.Key_Down :
             self.increase_width(-1)
+        elif self.player is not None and key == qt.QtCore.Qt.Key_Space :
+            self.player.toggle()
         else :
             event.ignore()
             return
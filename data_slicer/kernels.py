@@ -0,0 +1,348 @@
+"""
+Registry of the computational kernels of hot loops that do not vectorize
+well with numpy (line cut interpolation, background fitting, peak finding,
+texture colouring).
+
+Every kernel has a vectorized numpy implementation. If `numba
+<https://numba.pydata.org>`_ is installed, explicit loop versions are
+compiled with it and used instead. The loops release the GIL, so that they
+run in parallel when called from the thread pools of :func:`map_chunks
+<data_slicer.utilities.map_chunks>`. Callers always go through
+:func:`get_kernel <data_slicer.kernels.get_kernel>`::
+
+    interpolate = get_kernel('interpolate_points')
+    values = interpolate(block, points)
+
+The active backend is reported by :func:`backend_info
+<data_slicer.kernels.backend_info>` and can be changed with
+:func:`set_backend <data_slicer.kernels.set_backend>`.
+"""
+import logging
+from functools import partial
+
+import numpy as np
+
+try :
+    import numba
+except ImportError :
+    numba = None
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Known backends. 'python' runs the loop kernels without compiling them,
+# which is only useful for testing and debugging them.
+BACKENDS = ('numba', 'numpy', 'python')
+
+#_Registry______________________________________________________________________
+
+# Maps kernel names to dicts {backend: function}
+_kernels = dict()
+
+_backend = 'numba' if numba is not None else 'numpy'
+
+def register(name, backend='numpy') :
+    """ Decorator that registers a function as the implementation of the
+    kernel *name* for *backend*. The function is returned unchanged.
+    """
+    if backend not in BACKENDS :
+        raise ValueError('Unknown backend "{}". Use one of {}.'.format(
+                         backend, BACKENDS))
+    def decorator(function) :
+        _kernels.setdefault(name, dict())[backend] = function
+        return function
+    return decorator
+
+def get_kernel(name, backend=None) :
+    """ Return the implementation of the kernel *name* for *backend*
+    (default: the active backend). Falls back to the numpy implementation
+    if there is none for *backend*.
+    """
+    try :
+        implementations = _kernels[name]
+    except KeyError :
+        raise KeyError('Unknown kernel "{}". Registered kernels: {}.'.format(
+                       name, sorted(_kernels)))
+    if backend is None :
+        backend = _backend
+    return implementations.get(backend, implementations['numpy'])
+
+def get_backend() :
+    """ Return the name of the active backend. """
+    return _backend
+
+def set_backend(backend) :
+    """ Select the backend that :func:`get_kernel
+    <data_slicer.kernels.get_kernel>` uses by default.
+    """
+    global _backend
+    if backend not in BACKENDS :
+        raise ValueError('Unknown backend "{}". Use one of {}.'.format(
+                         backend, BACKENDS))
+    if backend == 'numba' and numba is None :
+        raise ImportError('The numba backend requires numba to be '
+                          'installed.')
+    _backend = backend
+    logger.info('Kernel backend: {}'.format(backend_info()))
+
+def backend_info() :
+    """ Return a short description of the active backend, e.g. for
+    reporting it at startup.
+    """
+    if _backend == 'numba' :
+        return 'numba {}'.format(numba.__version__)
+    elif numba is None :
+        return '{} (numba is not installed)'.format(_backend)
+    return _backend
+
+#_Numpy_kernels_________________________________________________________________
+
+@register('interpolate_points')
+def interpolate_points(block, points) :
+    """
+    Bilinear interpolation of *block* at *points*, like
+    :func:`pyqtgraph.functions.interpolateArray` with ``order=1``, but
+    without temporaries of four times the size of the result.
+
+    **Parameters**
+
+    ======  ====================================================================
+    block   np.array of shape (nx, ny, ...); the data.
+    points  np.array of shape (n, 2); fractional indices into the first two
+            dimensions of *block*.
+    ======  ====================================================================
+
+    **Returns**
+
+    ======  ====================================================================
+    result  float np.array of shape (n, ...); the interpolated values.
+            Points outside of *block* give 0.
+    ======  ====================================================================
+    """
+    block = np.asarray(block)
+    points = np.asarray(points, dtype=float)
+    nx, ny = block.shape[:2]
+    x, y = points[:,0], points[:,1]
+    inside = (x >= 0) & (x <= nx-1) & (y >= 0) & (y <= ny-1)
+    x = np.where(inside, x, 0)
+    y = np.where(inside, y, 0)
+    i0 = np.floor(x).astype(int)
+    j0 = np.floor(y).astype(int)
+    i1 = np.minimum(i0 + 1, nx - 1)
+    j1 = np.minimum(j0 + 1, ny - 1)
+    trailing = (1,) * (block.ndim - 2)
+    dx = (x - i0).reshape((-1,) + trailing)
+    dy = (y - j0).reshape((-1,) + trailing)
+    result = (1 - dy) * block[i0, j0]
+    result += dy * block[i0, j1]
+    result *= 1 - dx
+    upper = (1 - dy) * block[i1, j0]
+    upper += dy * block[i1, j1]
+    upper *= dx
+    result += upper
+    result[~inside] = 0
+    return result
+
+def _rgba_parameters(levels, lut) :
+    """ Return the offset and scale that map values to indices into *lut*
+    and *lut* as an array (a grey scale if *lut* is *None*).
+    """
+    if lut is None :
+        lut = np.repeat(np.arange(256, dtype=np.uint8)[:,None], 3, axis=1)
+    lut = np.asarray(lut, dtype=np.uint8)
+    low, high = float(levels[0]), float(levels[1])
+    if high == low :
+        high = np.nextafter(high, 2*high) if high != 0 else 1
+    return low, len(lut) / (high - low), lut
+
+@register('make_rgba')
+def make_rgba(image, levels, lut=None) :
+    """
+    Colour the 2d *image* with the lookup table *lut* (shape (n, 3) or (n,
+    4)), mapping the range *levels* onto it, like :func:`pyqtgraph.makeRGBA`.
+    NaNs are transparent. Return a uint8 array of shape ``image.shape +
+    (4,)`` in RGBA order.
+    """
+    low, scale, lut = _rgba_parameters(levels, lut)
+    image = np.asarray(image)
+    with np.errstate(invalid='ignore') :
+        indices = (image - low) * scale
+    nan = np.isnan(indices)
+    indices[nan] = 0
+    np.clip(indices, 0, len(lut) - 1, out=indices)
+    rgba = np.empty(image.shape + (4,), dtype=np.uint8)
+    rgba[...,:lut.shape[1]] = lut[indices.astype(np.intp)]
+    if lut.shape[1] == 3 :
+        rgba[...,3] = 255
+    rgba[nan] = 0
+    return rgba
+
+#_Loop_kernels__________________________________________________________________
+
+def _interpolate_points_loop(block, points, result) :
+    nx, ny, m = block.shape
+    for p in range(points.shape[0]) :
+        x = points[p, 0]
+        y = points[p, 1]
+        if not (x >= 0 and x <= nx-1 and y >= 0 and y <= ny-1) :
+            for k in range(m) :
+                result[p, k] = 0
+            continue
+        i0 = int(x)
+        j0 = int(y)
+        i1 = min(i0 + 1, nx - 1)
+        j1 = min(j0 + 1, ny - 1)
+        dx = x - i0
+        dy = y - j0
+        for k in range(m) :
+            result[p, k] = \
+                    (1 - dx) * ((1 - dy)*block[i0, j0, k] +
+                                dy*block[i0, j1, k]) + \
+                    dx * ((1 - dy)*block[i1, j0, k] + dy*block[i1, j1, k])
+
+def _interpolate_points(block, points, loop) :
+    block = np.asarray(block)
+    trailing = block.shape[2:]
+    m = int(np.prod(trailing))
+    points = np.asarray(points, dtype=float)
+    result = np.empty((len(points), m))
+    loop(block.reshape(block.shape[:2] + (m,)), points, result)
+    return result.reshape((len(points),) + trailing)
+
+def _make_rgba_loop(image, low, scale, lut, rgba) :
+    n, channels = lut.shape
+    for i in range(image.shape[0]) :
+        for j in range(image.shape[1]) :
+            value = image[i, j]
+            if value != value :
+                for k in range(4) :
+                    rgba[i, j, k] = 0
+                continue
+            index = (value - low) * scale
+            if index <= 0 :
+                index = 0
+            elif index >= n - 1 :
+                index = n - 1
+            for k in range(channels) :
+                rgba[i, j, k] = lut[int(index), k]
+            if channels == 3 :
+                rgba[i, j, 3] = 255
+
+def _make_rgba(image, levels, lut=None, loop=None) :
+    low, scale, lut = _rgba_parameters(levels, lut)
+    image = np.asarray(image)
+    rgba = np.empty(image.shape + (4,), dtype=np.uint8)
+    loop(image, low, scale, lut, rgba)
+    return rgba
+
+def _shirley_background_loop(spectra, n_edge, max_iter, tol, background) :
+    n_spectra, n = spectra.shape
+    n_edge = max(1, min(n_edge, n))
+    area = np.empty(n)
+    unconverged = 0
+    for s in range(n_spectra) :
+        start = 0.
+        end = 0.
+        for i in range(n_edge) :
+            start += spectra[s, i]
+            end += spectra[s, n-n_edge+i]
+        start /= n_edge
+        end /= n_edge
+        step = start - end
+        scale = abs(step)
+        if scale == 0 :
+            scale = 1.
+        for i in range(n) :
+            background[s, i] = end
+        converged = False
+        for iteration in range(max_iter) :
+            # Area from every channel to the end of the spectrum
+            total = 0.
+            for i in range(n-1, -1, -1) :
+                total += spectra[s, i] - background[s, i]
+                area[i] = total
+            if total == 0 :
+                total = 1.
+            change = 0.
+            for i in range(n) :
+                ratio = min(max(area[i] / total, 0.), 1.)
+                new = end + step * ratio
+                change = max(change, abs(new - background[s, i]))
+                background[s, i] = new
+            if not change > tol*scale :
+                converged = True
+                break
+        if not converged :
+            unconverged += 1
+    return unconverged
+
+def _shirley_background(spectra, n_edge=5, max_iter=50, tol=1e-6,
+                        loop=None) :
+    spectra = np.asarray(spectra, dtype=float)
+    background = np.empty(spectra.shape)
+    unconverged = loop(spectra, n_edge, max_iter, tol, background)
+    if unconverged :
+        logger.warning(('shirley_background(): {} spectra did not converge '
+                        'within {} iterations.').format(unconverged,
+                                                        max_iter))
+    return background
+
+def _walk_to_base_loop(spectra, rows, positions, heights, step,
+                       base_values, base_indices) :
+    n = spectra.shape[1]
+    for p in range(len(rows)) :
+        row = rows[p]
+        base_values[p] = heights[p]
+        base_indices[p] = positions[p]
+        j = positions[p] + step
+        while j >= 0 and j < n :
+            value = spectra[row, j]
+            if value > heights[p] :
+                break
+            if value < base_values[p] :
+                base_values[p] = value
+                base_indices[p] = j
+            j += step
+
+def _walk_to_base(spectra, rows, positions, heights, step, loop=None) :
+    base_values = heights.copy()
+    base_indices = positions.copy()
+    loop(spectra, rows, positions, heights, step, base_values, base_indices)
+    return base_values, base_indices
+
+def _interpolated_crossing_loop(spectra, rows, positions, references, bases,
+                                step, crossing) :
+    for p in range(len(rows)) :
+        row = rows[p]
+        j = positions[p]
+        while j != bases[p] and spectra[row, j] > references[p] :
+            j += step
+        crossing[p] = j
+        value = spectra[row, j]
+        if value < references[p] :
+            crossing[p] -= step * (references[p] - value) / \
+                           (spectra[row, j-step] - value)
+
+def _interpolated_crossing(spectra, rows, positions, references, bases,
+                           step, loop=None) :
+    crossing = np.empty(len(rows))
+    loop(spectra, rows, positions, references, bases, step, crossing)
+    return crossing
+
+def _register_loops(backend, compile) :
+    """ Register the loop kernels, compiled with *compile*, for *backend*.
+    """
+    for name, wrapper, loop in [
+        ('interpolate_points', _interpolate_points, _interpolate_points_loop),
+        ('make_rgba', _make_rgba, _make_rgba_loop),
+        ('shirley_background', _shirley_background,
+         _shirley_background_loop),
+        ('walk_to_base', _walk_to_base, _walk_to_base_loop),
+        ('interpolated_crossing', _interpolated_crossing,
+         _interpolated_crossing_loop)] :
+        register(name, backend)(partial(wrapper, loop=compile(loop)))
+
+_register_loops('python', lambda loop : loop)
+if numba is not None :
+    _register_loops('numba', numba.njit(cache=True, nogil=True))
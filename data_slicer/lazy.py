@@ -0,0 +1,338 @@
+"""
+Array-like objects whose values are only computed when (and where) they are
+accessed. They can be used in place of np.arrays as data in PIT: slices and
+cuts only evaluate the part of the data they need.
+"""
+import logging
+
+import numpy as np
+
+from data_slicer.utilities import map_chunks
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Approximate size (in bytes) of the blocks that are evaluated at once in
+# reductions over a whole LazyArray
+CHUNK_BYTES = 2**26
+
+#_Functions_____________________________________________________________________
+
+def normalize_key(key, shape) :
+    """
+    Split an indexing *key* for an array of the given *shape* into a region
+    of contiguous slices that covers everything the key selects, and a key
+    that has to be applied to that region afterwards to obtain the result
+    numpy would give for ``array[key]``.
+
+    **Parameters**
+
+    =====  =====================================================================
+    key    anything that can be used to index a np.array.
+    shape  tuple of int; shape of the indexed array.
+    =====  =====================================================================
+
+    **Returns**
+
+    ======  ====================================================================
+    region  tuple of slices with step 1, one per dimension.
+    post    tuple; key to apply to the block described by *region*.
+    ======  ====================================================================
+    """
+    if not isinstance(key, tuple) :
+        key = (key,)
+    # Expand the Ellipsis
+    n_ellipsis = sum(k is Ellipsis for k in key)
+    if n_ellipsis > 1 :
+        raise IndexError('An index can only have a single ellipsis (...).')
+    elif n_ellipsis == 1 :
+        i = [k is Ellipsis for k in key].index(True)
+        n_missing = len(shape) - len(key) + 1
+        key = key[:i] + n_missing*(slice(None),) + key[i+1:]
+    if len(key) > len(shape) :
+        raise IndexError('Too many indices for array of dimension '
+                         '{}.'.format(len(shape)))
+    key = key + (len(shape) - len(key))*(slice(None),)
+
+    region = []
+    post = []
+    for k, n in zip(key, shape) :
+        if isinstance(k, (int, np.integer)) :
+            k = int(k)
+            if k < 0 : k += n
+            if not 0 <= k < n :
+                raise IndexError('Index {} is out of bounds for axis with '
+                                 'size {}.'.format(k, n))
+            region.append(slice(k, k+1))
+            post.append(0)
+        elif isinstance(k, slice) :
+            start, stop, step = k.indices(n)
+            if step > 0 :
+                stop = max(start, stop)
+                region.append(slice(start, stop))
+                post.append(slice(None, None, step))
+            else :
+                lower = stop + 1
+                upper = max(lower, start + 1)
+                region.append(slice(lower, upper))
+                post.append(slice(upper-lower-1, None, step))
+        else :
+            # Advanced indexing: take the whole dimension
+            region.append(slice(0, n))
+            post.append(k)
+    return tuple(region), tuple(post)
+
+def region_shape(region) :
+    """ Return the shape of the block described by the step-1 slices in
+    *region*.
+    """
+    return tuple(s.stop - s.start for s in region)
+
+def chunk_region(index, chunk_shape, shape) :
+    """ Return the region (tuple of slices) of the chunk with the given 
+    *index* (tuple of int) in a grid of chunks of *chunk_shape* that covers 
+    an array of *shape*.
+    """
+    return tuple(slice(i*n, min((i+1)*n, size)) for i, n, size in
+                 zip(index, chunk_shape, shape))
+
+def chunks_in(region, chunk_shape) :
+    """ Yield the indices of all chunks of *chunk_shape* that overlap with 
+    the (non-empty) *region*.
+    """
+    ranges = [range(r.start // n, (r.stop - 1) // n + 1)
+              for r, n in zip(region, chunk_shape)]
+    for index in np.ndindex(*[len(r) for r in ranges]) :
+        yield tuple(r[i] for r, i in zip(ranges, index))
+
+def chunk_overlap(region, chunk) :
+    """ Return the slices of the overlap between *region* and the region 
+    *chunk*, relative to *region* and relative to *chunk*.
+    """
+    in_region = []
+    in_chunk = []
+    for r, c in zip(region, chunk) :
+        start, stop = max(r.start, c.start), min(r.stop, c.stop)
+        in_region.append(slice(start - r.start, stop - r.start))
+        in_chunk.append(slice(start - c.start, stop - c.start))
+    return tuple(in_region), tuple(in_chunk)
+
+def select(data, index) :
+    """ Return a view of *data* in which the last ``len(index)`` dimensions 
+    are fixed at the integers in *index*, without copying: np.arrays are 
+    indexed, other array-likes are wrapped in an :class:`IndexedArray 
+    <data_slicer.lazy.IndexedArray>`.
+    """
+    shape = data.shape[len(data.shape)-len(index):]
+    index = tuple(int(i) for i in index)
+    for i, n in zip(index, shape) :
+        if not -n <= i < n :
+            raise IndexError('Index {} is out of bounds for axis with '
+                             'size {}.'.format(i, n))
+    index = tuple(i % n for i, n in zip(index, shape))
+    if not index :
+        return data
+    if isinstance(data, np.ndarray) :
+        return data[(Ellipsis,) + index]
+    if isinstance(data, IndexedArray) :
+        # Collapse nested views
+        return IndexedArray(data.data, index + data.index)
+    return IndexedArray(data, index)
+
+def subarray(data, key) :
+    """ Return a view of the part of *data* selected by *key* (only the
+    bounding box of the selection is used, see :func:`normalize_key
+    <data_slicer.lazy.normalize_key>`) without copying: np.arrays are
+    sliced, other array-likes are wrapped in a :class:`SubArray
+    <data_slicer.lazy.SubArray>`.
+    """
+    region = normalize_key(key, data.shape)[0]
+    if isinstance(data, np.ndarray) :
+        return data[region]
+    if isinstance(data, SubArray) :
+        # Collapse nested views
+        region = tuple(slice(o.start + r.start, o.start + r.stop)
+                       for o, r in zip(data.region, region))
+        data = data.data
+    return SubArray(data, region)
+
+#_Classes_______________________________________________________________________
+
+class LazyArray() :
+    """
+    Base class for array-like objects that compute their values on demand.
+    Subclasses only need to set *shape* and *dtype* (by calling this
+    class's `__init__`) and implement :meth:`_compute
+    <data_slicer.lazy.LazyArray._compute>`.
+
+    Indexing a LazyArray returns a np.array containing just the requested
+    part. Reductions like :meth:`sum <data_slicer.lazy.LazyArray.sum>` are
+    evaluated in blocks, such that the whole array never has to be held in
+    memory.
+    """
+    def __init__(self, shape, dtype=float) :
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+
+    def __repr__(self) :
+        return '<{} shape={}, dtype={}>'.format(self.__class__.__name__,
+                                                self.shape, self.dtype)
+
+    def __len__(self) :
+        return self.shape[0]
+
+    @property
+    def ndim(self) :
+        return len(self.shape)
+
+    @property
+    def size(self) :
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) :
+        return self.size * self.dtype.itemsize
+
+    def _compute(self, region) :
+        """ Return a np.array with the values in *region*, a tuple of
+        slices with step 1 (one for each dimension). Has to be implemented
+        by subclasses.
+        """
+        raise NotImplementedError(('{} is an abstract base class. Use an '
+                                   'appropriate subclass instead.').format(
+                                   type(self)))
+
+    def __getitem__(self, key) :
+        region, post = normalize_key(key, self.shape)
+        block = np.asarray(self._compute(region))
+        return block[post]
+
+    def __array__(self, dtype=None, copy=None) :
+        result = self[...]
+        if dtype is not None :
+            result = result.astype(dtype, copy=False)
+        return result
+
+    def compute(self) :
+        """ Evaluate and return the full array. """
+        return self[...]
+
+    def transpose(self, *axes) :
+        """ Return a lazy view with permuted dimensions. Same call
+        signature as :meth:`np.ndarray.transpose`.
+        """
+        if len(axes) == 1 and axes[0] is not None and \
+           not isinstance(axes[0], (int, np.integer)) :
+            axes = axes[0]
+        if len(axes) == 0 or axes[0] is None :
+            axes = range(self.ndim)[::-1]
+        return TransposedArray(self, axes)
+
+    def _chunk_dim(self, reduced) :
+        """ Return the dimension along which to split the array for
+        blockwise processing: preferably the last dimension that is not
+        in *reduced*.
+        """
+        kept = [d for d in range(self.ndim) if d not in reduced]
+        return kept[-1] if kept else self.ndim-1
+
+    def reduce(self, ufunc, axis=None, dtype=None, n_workers=None) :
+        """ Apply the reduction of *ufunc* (e.g. ``np.add`` for a sum)
+        along *axis* in blocks of about :const:`CHUNK_BYTES
+        <data_slicer.lazy.CHUNK_BYTES>`, which are evaluated in a pool of
+        threads.
+        """
+        if axis is None :
+            axis = tuple(range(self.ndim))
+        elif isinstance(axis, (int, np.integer)) :
+            axis = (axis,)
+        axis = tuple(sorted(a % self.ndim for a in axis))
+        dim = self._chunk_dim(axis)
+        n = self.shape[dim]
+        bytes_per_index = max(1, self.nbytes // max(n, 1))
+        chunk_size = max(1, CHUNK_BYTES // bytes_per_index)
+        kwargs = {} if dtype is None else dict(dtype=dtype)
+
+        def reduce_block(chunk) :
+            key = self.ndim*[slice(None)]
+            key[dim] = chunk
+            return ufunc.reduce(self[tuple(key)], axis=axis, **kwargs)
+
+        parts = map_chunks(reduce_block, n, chunk_size=chunk_size,
+                           n_workers=n_workers)
+        if dim in axis :
+            return ufunc.reduce(np.stack(parts), axis=0, **kwargs)
+        else :
+            position = dim - sum(a < dim for a in axis)
+            return np.concatenate(parts, axis=position)
+
+    def sum(self, axis=None, dtype=None) :
+        """ Blockwise sum. See :meth:`np.ndarray.sum`. """
+        return self.reduce(np.add, axis=axis, dtype=dtype)
+
+    def min(self, axis=None) :
+        """ Blockwise minimum. See :meth:`np.ndarray.min`. """
+        return self.reduce(np.minimum, axis=axis)
+
+    def max(self, axis=None) :
+        """ Blockwise maximum. See :meth:`np.ndarray.max`. """
+        return self.reduce(np.maximum, axis=axis)
+
+class TransposedArray(LazyArray) :
+    """ A lazy view of another array-like with permuted dimensions, as
+    created by :meth:`LazyArray.transpose
+    <data_slicer.lazy.LazyArray.transpose>`.
+    """
+    def __init__(self, data, axes) :
+        self.data = data
+        self.axes = tuple(int(a) for a in axes)
+        if sorted(self.axes) != list(range(len(data.shape))) :
+            raise ValueError('*axes* {} do not match array of dimension '
+                             '{}.'.format(self.axes, len(data.shape)))
+        shape = [data.shape[a] for a in self.axes]
+        super().__init__(shape, data.dtype)
+
+    def _compute(self, region) :
+        # Translate the region back to the dimensions of the underlying data
+        source_region = self.ndim*[None]
+        for i, a in enumerate(self.axes) :
+            source_region[a] = region[i]
+        block = np.asarray(self.data[tuple(source_region)])
+        return block.transpose(self.axes)
+
+    def transpose(self, *axes) :
+        # Collapse nested transpositions into a single view
+        transposed = super().transpose(*axes)
+        combined = [self.axes[a] for a in transposed.axes]
+        return TransposedArray(self.data, combined)
+
+class SubArray(LazyArray) :
+    """ A lazy view of the part *region* (a tuple of slices with step 1,
+    see :func:`normalize_key <data_slicer.lazy.normalize_key>`) of another
+    array-like, as created by :func:`subarray <data_slicer.lazy.subarray>`.
+    """
+    def __init__(self, data, region) :
+        self.data = data
+        self.region = tuple(region)
+        super().__init__(region_shape(self.region), data.dtype)
+
+    def _compute(self, region) :
+        # Shift the region by the offset of this view
+        source_region = tuple(slice(o.start + r.start, o.start + r.stop)
+                              for o, r in zip(self.region, region))
+        return np.asarray(self.data[source_region])
+
+class IndexedArray(LazyArray) :
+    """ A lazy view of another array-like whose last ``len(index)`` 
+    dimensions are fixed at *index*, as created by :func:`select 
+    <data_slicer.lazy.select>`.
+    """
+    def __init__(self, data, index) :
+        self.data = data
+        self.index = tuple(index)
+        ndim = len(data.shape) - len(self.index)
+        super().__init__(data.shape[:ndim], data.dtype)
+
+    def _compute(self, region) :
+        return np.asarray(self.data[tuple(region) + self.index])
@@ -0,0 +1,288 @@
+"""
+Support for masked data, e.g. dead detector regions or NaN padding.
+
+Masked values are replaced by zeros once (see :func:`fill_invalid
+<data_slicer.masking.fill_invalid>`), such that slices and projections can
+use plain, fast sums. The number of valid values that entered each sum is
+obtained from prefix sums over the (compact) :class:`Mask
+<data_slicer.masking.Mask>`, which are computed only once per dimension.
+"""
+import logging
+
+import numpy as np
+
+from data_slicer import dtypes
+from data_slicer.lazy import CHUNK_BYTES, LazyArray, normalize_key, \
+                             region_shape
+from data_slicer.utilities import map_chunks
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Classes_______________________________________________________________________
+
+class Mask() :
+    """
+    Boolean mask of the valid entries of a dataset of shape *data_shape*.
+    *valid* can have length 1 along any dimension along which the mask does
+    not change (e.g. a detector mask of shape (nx, ny, 1) for a cube of shape
+    (nx, ny, nz)), which keeps it small. It is stored bit-packed.
+
+    **Parameters**
+
+    ==========  ================================================================
+    valid       bool array; *True* for valid entries. Needs to broadcast
+                against *data_shape*.
+    data_shape  tuple of int; shape of the masked data. Defaults to the shape
+                of *valid*.
+    ==========  ================================================================
+    """
+    def __init__(self, valid, data_shape=None) :
+        valid = np.asarray(valid, dtype=bool)
+        if data_shape is None :
+            data_shape = valid.shape
+        data_shape = tuple(int(n) for n in data_shape)
+        # Bring to the same dimensionality as the data
+        valid = valid.reshape((len(data_shape) - valid.ndim)*(1,) +
+                              valid.shape)
+        if any(m not in (1, n) for m, n in zip(valid.shape, data_shape)) :
+            raise ValueError('Mask of shape {} does not match data of shape '
+                             '{}.'.format(valid.shape, data_shape))
+        self.shape = valid.shape
+        self.data_shape = data_shape
+        self._packed = np.packbits(valid, axis=-1)
+        # Cache for the prefix sums along each dimension and the counts 
+        # over sets of dimensions
+        self._counts = {}
+
+    def __repr__(self) :
+        return '<Mask shape={} for data of shape {}>'.format(self.shape,
+                                                            self.data_shape)
+
+    @property
+    def nbytes(self) :
+        return self._packed.nbytes
+
+    def _mask_region(self, region) :
+        """ Translate a *region* of the data into one of the mask. """
+        return tuple(r if m > 1 else slice(None)
+                     for r, m in zip(region, self.shape))
+
+    def valid(self, key=None) :
+        """ Return the unpacked bool array of valid entries in the part of
+        the data selected by *key* (only slices and integers; dimensions
+        along which the mask is constant keep length 1).
+        """
+        if key is None :
+            key = ()
+        region, post = normalize_key(key, self.data_shape)
+        region = self._mask_region(region)
+        post = tuple(p if m > 1 or not isinstance(p, (int, np.integer))
+                     else 0 for p, m in zip(post, self.shape))
+        packed = self._packed[region[:-1]]
+        valid = np.unpackbits(packed, axis=-1,
+                              count=self.shape[-1]).astype(bool)
+        return valid[(Ellipsis, region[-1])][post]
+
+    def broadcast(self, dtype=bool) :
+        """ Return the mask as a read-only array of the full data shape
+        (without using additional memory for the broadcast dimensions).
+        """
+        return np.broadcast_to(self.valid().astype(dtype), self.data_shape)
+
+    def counts(self, dim) :
+        """ Return the prefix sums of the number of valid entries along
+        *dim*, with *dim* moved to the front: ``c[i]`` is the number of valid
+        entries before index *i* along *dim*. Computed once and cached as a
+        contiguous array, such that differences of two entries are fast.
+        If the mask is constant along *dim*, only ``c[0]`` and ``c[1]`` are
+        stored.
+        """
+        if dim not in self._counts :
+            valid = np.moveaxis(self.valid(), dim, 0)
+            if valid.shape[0] == 1 :
+                # The mask is constant along *dim*: only store the counts 
+                # for a single entry
+                counts = np.zeros((2,) + valid.shape[1:], dtype=np.int32)
+                counts[1] = valid[0]
+                self._counts[dim] = counts
+                return counts
+            counts = np.zeros((valid.shape[0]+1,) + valid.shape[1:],
+                              dtype=np.int32)
+            np.cumsum(valid, axis=0, dtype=np.int32, out=counts[1:])
+            self._counts[dim] = counts
+        return self._counts[dim]
+
+    def count(self, dim, start, stop) :
+        """ Return the number of valid entries between *start* and *stop*
+        along *dim*, for all other positions. The result has the shape of
+        the mask without dimension *dim*.
+        """
+        counts = self.counts(dim)
+        if self.shape[dim] == 1 :
+            # The mask is constant along *dim*: no need for prefix sums
+            return counts[1] * np.int32(stop - start)
+        return counts[stop] - counts[start]
+
+    def count_over(self, axes) :
+        """ Return the number of valid entries when summing over the
+        dimensions *axes* (int or tuple of int). Cached.
+        """
+        if isinstance(axes, (int, np.integer)) :
+            axes = (axes,)
+        axes = tuple(axes)
+        key = ('over', axes)
+        if key not in self._counts :
+            counts = self.valid().sum(axis=axes, dtype=np.int64)
+            # Dimensions along which the mask is constant contribute fully
+            for a in axes :
+                if self.shape[a] == 1 :
+                    counts *= self.data_shape[a]
+            self._counts[key] = counts
+        return self._counts[key]
+
+    def transpose(self, axes) :
+        """ Return the mask for the data transposed with *axes*. """
+        valid = self.valid().transpose(axes)
+        return Mask(valid, [self.data_shape[a] for a in axes])
+
+    def crop(self, key) :
+        """ Return the mask for the part of the data selected by *key* (see
+        :func:`subarray <data_slicer.lazy.subarray>`).
+        """
+        region = normalize_key(key, self.data_shape)[0]
+        return Mask(self.valid(region), region_shape(region))
+
+    def matches(self, shape) :
+        """ Return *True* if this mask can be used for data of *shape*. """
+        return tuple(shape) == self.data_shape
+
+class MaskedData(LazyArray) :
+    """ Lazy view of *data* in which the entries that are invalid according
+    to *mask* are replaced by *fill_value*.
+    """
+    def __init__(self, data, mask, fill_value=0) :
+        self.data = data
+        self.mask = mask
+        self.fill_value = fill_value
+        super().__init__(data.shape, data.dtype)
+
+    def _compute(self, region) :
+        block = np.asarray(self.data[region])
+        return np.where(self.mask.valid(region), block, self.fill_value)
+
+class MaskValues(LazyArray) :
+    """ Lazy array of the full data shape that contains the entries of
+    *mask* converted to *dtype* (i.e. 1 for valid and 0 for masked entries).
+    Only the requested parts of the mask are unpacked.
+    """
+    def __init__(self, mask, dtype=float) :
+        self.mask = mask
+        super().__init__(mask.data_shape, dtype)
+
+    def _compute(self, region) :
+        valid = np.broadcast_to(self.mask.valid(region), region_shape(region))
+        return valid.astype(self.dtype)
+
+#_Functions_____________________________________________________________________
+
+def mask_invalid(data, n_workers=None) :
+    """ Create a :class:`Mask <data_slicer.masking.Mask>` of the finite
+    entries of *data* (i.e. masking NaNs and infinities), processing the
+    data in chunks along its first dimension in a pool of threads.
+    """
+    shape = data.shape
+    valid = np.empty(shape, dtype=bool)
+    bytes_per_index = max(1, int(np.prod(shape[1:])) *
+                             np.dtype(data.dtype).itemsize)
+
+    def process(chunk) :
+        np.isfinite(np.asarray(data[chunk]), out=valid[chunk])
+
+    map_chunks(process, shape[0], chunk_size=max(1, CHUNK_BYTES //
+                                                    bytes_per_index),
+               n_workers=n_workers)
+    return Mask(valid)
+
+def has_invalid(data, n_workers=None) :
+    """ Return *True* if *data* contains any NaN or infinite entries. All
+    entries are checked, in chunks along the first dimension like in
+    :func:`mask_invalid <data_slicer.masking.mask_invalid>`, but without
+    building a mask.
+    """
+    shape = data.shape
+    bytes_per_index = max(1, int(np.prod(shape[1:])) *
+                             np.dtype(data.dtype).itemsize)
+
+    def process(chunk) :
+        return not np.isfinite(np.asarray(data[chunk])).all()
+
+    return any(map_chunks(process, shape[0],
+                          chunk_size=max(1, CHUNK_BYTES // bytes_per_index),
+                          n_workers=n_workers))
+
+def fill_invalid(data, mask, fill_value=0, in_place=False) :
+    """
+    Replace the entries of *data* that are invalid according to *mask* by
+    *fill_value*. Sums over the result are the sums over the valid entries.
+
+    **Parameters**
+
+    ==========  ================================================================
+    data        array-like; the data.
+    mask        :class:`Mask <data_slicer.masking.Mask>`.
+    fill_value  number; value to put at the masked positions.
+    in_place    bool; modify *data* (a np.array) directly. Otherwise, a copy
+                is returned for np.arrays and a :class:`MaskedData
+                <data_slicer.masking.MaskedData>` view for other array-likes.
+    ==========  ================================================================
+    """
+    if not isinstance(data, np.ndarray) :
+        return MaskedData(data, mask, fill_value=fill_value)
+    if not in_place :
+        data = data.copy()
+    np.copyto(data, fill_value, where=~mask.broadcast())
+    return data
+
+def _window(n, index, integrate) :
+    """ Return the clipped integration window (start, stop) around *index*.
+    """
+    return max(index - integrate, 0), min(index + integrate + 1, n)
+
+def masked_slice(data, mask, dim, index, integrate=0) :
+    """
+    Masked version of :func:`make_slice <data_slicer.utilities.make_slice>`.
+    *data* needs to be filled with zeros at masked positions (see
+    :func:`fill_invalid <data_slicer.masking.fill_invalid>`). The sums are
+    rescaled by the fraction of valid entries in the integration window,
+    such that masked regions do not appear darker. Positions without any
+    valid entry are NaN.
+    """
+    n = data.shape[dim]
+    start, stop = _window(n, index, integrate)
+    key = len(data.shape)*[slice(None)]
+    key[dim] = slice(start, stop)
+    sliced = np.asarray(data[tuple(key)]).sum(
+        dim, dtype=dtypes.policy.accumulation_dtype(data.dtype))
+    count = mask.count(dim, start, stop)
+    return _rescale(sliced, count, stop - start)
+
+def masked_sum(data, mask, axis) :
+    """ Masked version of ``data.sum(axis)`` for zero-filled *data*, rescaled
+    like in :func:`masked_slice <data_slicer.masking.masked_slice>`.
+    """
+    if isinstance(axis, (int, np.integer)) :
+        axis = (axis,)
+    axis = tuple(axis)
+    total = int(np.prod([data.shape[a] for a in axis]))
+    summed = data.sum(axis=axis, 
+                      dtype=dtypes.policy.accumulation_dtype(data.dtype))
+    return _rescale(summed, mask.count_over(axis), total)
+
+def _rescale(summed, count, total) :
+    """ Scale *summed* by *total*/*count* (broadcasting *count*). """
+    summed = np.asarray(summed, dtype=float)
+    count = np.broadcast_to(count, summed.shape)
+    with np.errstate(divide='ignore', invalid='ignore') :
+        result = summed * (total / count)
+    result[count == 0] = np.nan
+    return result
@@ -1,10 +1,161 @@
+import logging
+import pickle
+from concurrent.futures import ProcessPoolExecutor
 from inspect import signature
+from itertools import repeat
 from types import FunctionType
 
 import numpy as np
-from pyqtgraph import IsocurveItem
+from pyqtgraph import IsocurveItem, isocurve
+from pyqtgraph.Qt import QtGui
 
 import data_slicer.utilities as util
+from data_slicer.caching import CACHE_DIR, DiskCache, LRUCache, \
+                                function_token, hash_key
+from data_slicer.expressions import evaluate, parse
+
+logger = logging.getLogger('ds.'+__name__)
+
+# Approximate size in bytes of the pieces in which models are evaluated
+CHUNK_BYTES = 2**24
+
+# Number of isocurves that every Model keeps
+ISOCURVE_CACHE = 256
+
+# Caches for the results of model evaluations, shared by all Models. 
+# Increase CACHE_VERSION whenever the evaluation changes, to invalidate old 
+# files on disk
+CACHE_VERSION = 1
+CACHE_BYTES = 2**28
+memory_cache = LRUCache(max_bytes=CACHE_BYTES)
+disk_cache = DiskCache(CACHE_DIR / 'models', version=CACHE_VERSION)
+
+def set_cache_size(nbytes) :
+    """ Change the memory budget of the cache of model evaluations to 
+    *nbytes*. 
+    """
+    memory_cache.set_limits(max_bytes=nbytes)
+
+def model_token(model) :
+    """ Return a string that identifies the model function *model* (see 
+    :func:`function_token <data_slicer.caching.function_token>` and 
+    :attr:`ExpressionModel.token <data_slicer.model.ExpressionModel.token>`) 
+    or *None* if it cannot be identified. 
+    """
+    if isinstance(model, ExpressionModel) :
+        return model.token
+    return function_token(model)
+
+def grid_shape(lengths) :
+    """ Return the shape of ``np.meshgrid`` (with the default 'xy' 
+    indexing) of axes with the given *lengths*: the first two dimensions 
+    are swapped.
+    """
+    shape = list(lengths)
+    if len(shape) >= 2 :
+        shape[0], shape[1] = shape[1], shape[0]
+    return tuple(shape)
+
+def grid_dim(axis, n_axes) :
+    """ Return the dimension of the result of ``np.meshgrid`` of *n_axes* 
+    axes along which the axis number *axis* runs. 
+    """
+    if n_axes >= 2 and axis < 2 :
+        return 1 - axis
+    return axis
+
+def isocurve_path(data, level, row_major=True) :
+    """ Return a :class:`QPainterPath <pyqtgraph.Qt.QtGui.QPainterPath>` 
+    of the isocurve of the 2d *data* at *level*, in the same coordinates as 
+    :class:`IsocurveItem <pyqtgraph.graphicsItems.IsocurveItem>`. 
+    """
+    data = np.asarray(data)
+    if row_major :
+        data = data.T
+    path = QtGui.QPainterPath()
+    for line in isocurve(data, level, connected=True, extendToEdge=True) :
+        path.moveTo(*line[0])
+        for point in line[1:] :
+            path.lineTo(*point)
+    return path
+
+def evaluate_model(model, meshes, kwargs, shape) :
+    """ Evaluate *model* on the (possibly sparse) *meshes* and broadcast 
+    the result to *shape*, such that models which do not depend on all 
+    axes still give the full result.
+    """
+    result = np.asarray(model(*meshes, **kwargs))
+    if result.shape != shape :
+        result = np.broadcast_to(result, shape)
+    return result
+
+class ExpressionModel() :
+    """
+    Model function defined by an arithmetic expression string, like 
+    ``'a*x**2 + b*y - E'``. The expression is parsed once (see 
+    :class:`Expression <data_slicer.expressions.Expression>`) and evaluated 
+    with :func:`evaluate <data_slicer.expressions.evaluate>`, i.e. with 
+    numexpr (multithreaded and without temporaries) if it is installed.
+
+    **Parameters**
+
+    ==========  ================================================================
+    expression  str; the expression.
+    axis_names  sequence of str; the names in *expression* that are the axes, 
+                in the order of the model arguments. Defaults to all names 
+                that are not *parameters*, in order of appearance.
+    parameters  dict; default values of the parameters, i.e. of the names 
+                that are not axes.
+    n_workers   int; number of threads used for the evaluation.
+    ==========  ================================================================
+    """
+    def __init__(self, expression, axis_names=None, parameters=None, 
+                 n_workers=None) :
+        self.expression = parse(expression)
+        self.parameters = dict() if parameters is None else dict(parameters)
+        if axis_names is None :
+            axis_names = [name for name in self.expression.names 
+                          if name not in self.parameters]
+        self.axis_names = tuple(axis_names)
+        self.n_workers = n_workers
+        unknown = [name for name in self.expression.names 
+                   if name not in self.axis_names and 
+                   name not in self.parameters]
+        if unknown :
+            raise ValueError('The names {} in "{}" are neither axes nor '
+                             'parameters.'.format(unknown, 
+                                                  self.expression.source))
+
+    def __repr__(self) :
+        return '<ExpressionModel "{}">'.format(self.expression.source)
+
+    @property
+    def token(self) :
+        """ String that identifies the expression, the order of the axes 
+        and the default values of the parameters. 
+        """
+        return hash_key('expression', self.expression.source, 
+                        self.axis_names, sorted(self.parameters.items()))
+
+    def __reduce__(self) :
+        # The compiled expression cannot be pickled, so it is parsed again
+        return (ExpressionModel, (self.expression.source, self.axis_names, 
+                                  self.parameters, self.n_workers))
+
+    def __call__(self, *axes, **parameters) :
+        if len(axes) != len(self.axis_names) :
+            raise TypeError('Expected {} axes ({}), got {}.'.format(
+                            len(self.axis_names), 
+                            ', '.join(self.axis_names), len(axes)))
+        unknown = [name for name in parameters 
+                   if name not in self.parameters]
+        if unknown :
+            raise TypeError('Unknown parameter(s): {}.'.format(
+                            ', '.join(unknown)))
+        variables = dict(self.parameters)
+        variables.update(parameters)
+        variables.update(zip(self.axis_names, axes))
+        return evaluate(self.expression, variables, n_workers=self.n_workers)
 
 class ModelError(Exception) :
     """ Base class for :class:`Model <data_slicer.model.Model>` related 
@@ -30,24 +181,84 @@ class Model() :
     General object that allows calculating a model over some input axes. It 
     also provides functionalities to extract different slices from the 
     calculated data.
+
+    With *use_cache*, results are kept in memory (see :data:`memory_cache 
+    <data_slicer.model.memory_cache>`) and with *use_disk* also on disk, 
+    keyed by the model function (see :func:`model_token 
+    <data_slicer.model.model_token>`, which includes the values of the 
+    global variables it uses), the axes and the parameters. Models that 
+    depend on mutable objects are never cached. Cached results are 
+    read-only and shared between all callers.
+
+    The model is evaluated on sparse meshgrids, i.e. every axis is passed 
+    as an array that only extends along its own dimension and numpy's 
+    broadcasting creates the full result. Models that need the coordinates 
+    as full arrays (e.g. to index them with a mask of the full shape) 
+    require setting *sparse* to *False*. Models that are *pointwise*, i.e. 
+    whose value at every point only depends on the coordinates of that 
+    point, can be evaluated in pieces of about :const:`CHUNK_BYTES 
+    <data_slicer.model.CHUNK_BYTES>` along the longest axis, which keeps 
+    the temporaries of the model small. Other models (e.g. ones that 
+    normalize their result, take gradients or convolve along an axis) are 
+    always evaluated in one piece, as they would give a different result 
+    on every piece.
     """
     MIN_AXIS_LENGTH = 100
 
-    def __init__(self, model=None) :
+    def __init__(self, model=None, sparse=True, n_workers=None, 
+                 processes=False, axis_names=None, parameters=None, 
+                 pointwise=False, 
+                 use_cache=False, use_disk=False) :
         """ 
         **Parameters**
 
-        =====  =================================================================
-        model  callable; a python function representing the model.
-        =====  =================================================================
+        ==========  ============================================================
+        model       callable or str; a python function or an expression 
+                    representing the model.
+        sparse      bool; whether to pass sparse meshgrids to the model.
+        n_workers   int; number of threads (or processes) among which the 
+                    pieces of the evaluation are distributed. Defaults to the 
+                    number of CPUs.
+        processes   bool; distribute the pieces among processes instead of 
+                    threads. This helps for models written in pure python, 
+                    which hold the GIL, but the model needs to be picklable 
+                    (i.e. defined with ``def`` at the top level of a module).
+        pointwise   bool; whether the value at every point only depends on 
+                    the coordinates of that point (and the parameters). 
+                    Only then is the model evaluated in pieces, with 
+                    *n_workers* threads or *processes*. Expressions are 
+                    always pointwise.
+        axis_names  sequence of str; for expression models, see 
+                    :meth:`set_model <data_slicer.model.Model.set_model>`.
+        parameters  dict; for expression models, see :meth:`set_model 
+                    <data_slicer.model.Model.set_model>`.
+        use_cache   bool; whether to reuse earlier evaluations with the same 
+                    model, axes and parameters. The results are then 
+                    read-only.
+        use_disk    bool; whether to also store the evaluations on disk 
+                    (in :data:`disk_cache <data_slicer.model.disk_cache>`), 
+                    where they persist across sessions.
+        ==========  ============================================================
 
         .. seealso::
             :meth:`set_model <data_slicer.model.Model.set_model>`
         """
         self.data = None
+        # Values along the dimensions of the result of sweep()
+        self.sweep_axes = None
+        self.sparse = sparse
+        self.n_workers = n_workers
+        self.processes = processes
+        self.pointwise = pointwise
+        self.use_cache = use_cache
+        self.use_disk = use_disk
+        # Isocurves by (dim, value, level, parameters), see 
+        # get_isocurve_path()
+        self._isocurves = LRUCache(max_items=ISOCURVE_CACHE)
 
         if model is not None :
-            self.set_model(model)
+            self.set_model(model, axis_names=axis_names, 
+                           parameters=parameters)
         else :
             self.model = None
 
@@ -60,7 +271,7 @@ class Model() :
         inner = 'n_args={}, n_kwargs={}'.format(self.n_args, self.n_kwargs)
         return base.format(inner)
 
-    def set_model(self, model) :
+    def set_model(self, model, axis_names=None, parameters=None) :
         """ Specify the function that represents the model. This should be a 
         function with the call signature::
 
@@ -75,15 +286,41 @@ class Model() :
         Information about the number of arguments is obtained through 
         introspection.
 
+        Alternatively, the model can be given as an arithmetic expression, 
+        e.g.::
+
+            model.set_model('a*x**2 + b*y - E', axis_names=('x', 'y', 'E'),
+                            parameters=dict(a=1, b=0))
+
+        which is evaluated by an :class:`ExpressionModel 
+        <data_slicer.model.ExpressionModel>`. This is considerably faster 
+        than the equivalent python function if numexpr is installed.
+
         **Parameters**
 
-        =====  =================================================================
-        model  callable; a python function representing the model.
-        =====  =================================================================
+        ==========  ============================================================
+        model       callable or str; a python function or an expression 
+                    representing the model.
+        axis_names  sequence of str; the names of the axes in an expression 
+                    *model*, in order. Defaults to all names that are not 
+                    *parameters*, in order of appearance.
+        parameters  dict; the names of the parameters in an expression 
+                    *model* and their default values.
+        ==========  ============================================================
         """
+        if isinstance(model, str) :
+            model = ExpressionModel(model, axis_names=axis_names, 
+                                    parameters=parameters)
+        if isinstance(model, ExpressionModel) :
+            self.model = model
+            self.n_args = len(model.axis_names)
+            self.n_kwargs = len(model.parameters)
+            self.has_var_kwargs = False
+            self.axes = self.n_args * [None]
+            return
         # Check if a function was supplied
         if not isinstance(model, FunctionType) :
-            raise TypeError('*model* has to be a function.')
+            raise TypeError('*model* has to be a function or an expression.')
         self.model = model
 
         # Get information about the supplied function
@@ -175,6 +412,7 @@ class Model() :
             axis = np.linspace(axis[0], axis[-1], self.MIN_AXIS_LENGTH)
 
         self.axes[dim] = axis
+        self._isocurves.clear()
 
     def get_axes_dims(self) :
         """ Return the length of all axes that are defined. """
@@ -211,11 +449,261 @@ class Model() :
         else :
             self.set_axes(axes)
 
-        self.meshes = np.meshgrid(*self.axes)
-        data = self.model(*self.meshes, **kwargs)
+        self.meshes = np.meshgrid(*self.axes, sparse=self.sparse, 
+                                  copy=False)
+        data = self._evaluate(self.meshes, kwargs, self.axes)
         self.data = data
+        # Isocurves of the full data refer to the previous evaluation
+        self._isocurves.clear()
+        return data
+
+    def calculate_slice_data(self, dim, value, **kwargs) :
+        """
+        Evaluate the model only on the grid of all axes except the one at 
+        *dim*, which is fixed at *value*. E.g. for a model of (x, y, z), 
+        ``calculate_slice_data(2, z0)`` gives the same as the slice of 
+        :meth:`calculate_model_data 
+        <data_slicer.model.Model.calculate_model_data>` at ``z = z0``, 
+        without evaluating the model anywhere else.
+
+        **Parameters**
+
+        ======  ================================================================
+        dim     int; index of the axis to fix.
+        value   float; value of that axis.
+        kwargs  all keyword arguments are passed to the model function.
+        ======  ================================================================
+        """
+        self._check_if_model_defined()
+        self._check_if_axes_defined()
+        axes = list(self.axes)
+        axes[dim] = np.array([value])
+        meshes = np.meshgrid(*axes, sparse=self.sparse, copy=False)
+        data = self._evaluate(meshes, kwargs, axes)
+        return np.take(data, 0, axis=grid_dim(dim, len(axes)))
+
+    def sweep(self, param_grid, axes=None, **kwargs) :
+        """
+        Evaluate the model for every combination of the parameter values 
+        in *param_grid* in one pass: the parameters are passed as arrays 
+        along additional dimensions, which broadcast against the axes. 
+        Large results of pointwise models are evaluated in pieces like in 
+        :meth:`calculate_model_data 
+        <data_slicer.model.Model.calculate_model_data>`. Models that are 
+        not pointwise are evaluated once for every combination of the 
+        parameter values instead, as the parameter dimensions would 
+        otherwise enter e.g. their normalization.
+
+        The result has the shape of the model data followed by one 
+        dimension per swept parameter, such that it can be opened in PIT 
+        directly, with sliders for the parameters beyond the third 
+        dimension::
+
+            data = model.sweep(dict(E0=np.linspace(-1, 0, 11)))
+            mw = pit.MainWindow(data=data)
+            mw.data_handler.prepare_data(data, axes=model.sweep_axes)
+
+        **Parameters**
+
+        ==========  ============================================================
+        param_grid  dict; maps parameter names to 1d array-likes of their 
+                    values. The order of the entries is the order of the 
+                    additional dimensions.
+        axes        if specified, this is passed on to :meth:`set_axes 
+                    <data_slicer.model.Model.set_axes>`. Otherwise the 
+                    previously set axes will be used.
+        kwargs      further (fixed) keyword arguments to the model function.
+        ==========  ============================================================
+
+        **Returns**
+
+        ====  ==================================================================
+        data  np.array; the model data for all parameter values. The values 
+              along all its dimensions are stored in :attr:`sweep_axes`.
+        ====  ==================================================================
+        """
+        self._check_if_model_defined()
+        if axes is None :
+            self._check_if_axes_defined()
+        else :
+            self.set_axes(axes)
+        names = list(param_grid)
+        values = [np.asarray(param_grid[name]).ravel() for name in names]
+        n_params = len(names)
+        extra_shape = tuple(len(value) for value in values)
+
+        # The meshes extend along the axes, the parameters each along their 
+        # own dimension behind them
+        meshes = np.meshgrid(*self.axes, sparse=self.sparse, copy=False)
+        meshes = [mesh[(Ellipsis,) + n_params*(np.newaxis,)] 
+                  for mesh in meshes]
+        kwargs = dict(kwargs)
+        for k, (name, value) in enumerate(zip(names, values)) :
+            kwargs[name] = value.reshape((self.n_args + k)*(1,) + (-1,) + 
+                                         (n_params - k - 1)*(1,))
+        data = self._evaluate(meshes, kwargs, self.axes, extra_shape)
+
+        # Model axes in the order of the dimensions of the data
+        order = [grid_dim(dim, self.n_args) for dim in range(self.n_args)]
+        self.sweep_axes = [np.asarray(self.axes[order.index(dim)]) 
+                           for dim in range(self.n_args)] + values
+        return data
+
+    def _evaluate(self, meshes, kwargs, axes, extra_shape=()) :
+        """ Return the model evaluated on *meshes* of the *axes* (see 
+        :meth:`_compute <data_slicer.model.Model._compute>`) from the cache, 
+        computing and storing it if necessary. Cached results are 
+        read-only, such that they can be handed out without copying.
+        """
+        key = self._cache_key(kwargs, axes, extra_shape)
+        if key is None :
+            return self._compute(meshes, kwargs, axes, extra_shape)
+        data = memory_cache.get(key)
+        if data is None and self.use_disk :
+            arrays = disk_cache.get(key)
+            if arrays is not None :
+                data = arrays['data']
+                data.setflags(write=False)
+                self._remember(key, data)
+        if data is not None :
+            logger.debug('Using cached model evaluation.')
+            return data
+        data = self._compute(meshes, kwargs, axes, extra_shape)
+        data.setflags(write=False)
+        if self.use_disk :
+            disk_cache.put(key, dict(data=data))
+        self._remember(key, data)
+        return data
+
+    def _cache_key(self, kwargs, axes, extra_shape) :
+        """ Return the key of an evaluation in the caches, or *None* if 
+        it should not be cached. 
+        """
+        if not (self.use_cache or self.use_disk) :
+            return None
+        token = model_token(self.model)
+        if token is None :
+            return None
+        return hash_key(token, [np.asarray(axis) for axis in axes], 
+                        sorted(kwargs.items()), tuple(extra_shape))
+
+    def _remember(self, key, data) :
+        """ Keep *data* in memory, unless it is too large. """
+        limit = memory_cache.max_bytes
+        if self.use_cache and (limit is None or data.nbytes <= limit) :
+            memory_cache.put(key, data)
+
+    def _compute(self, meshes, kwargs, axes, extra_shape=()) :
+        """ Evaluate the model on *meshes* of the *axes*. Pointwise 
+        models are evaluated in pieces along the longest dimension (see 
+        :data:`CHUNK_BYTES <data_slicer.model.CHUNK_BYTES>`). If parameters 
+        are given as arrays that extend along further dimensions of 
+        *extra_shape* (see :meth:`sweep <data_slicer.model.Model.sweep>`), 
+        those dimensions can be divided as well.
+        """
+        lengths = [len(axis) for axis in axes]
+        shape = grid_shape(lengths) + tuple(extra_shape)
+        pointwise = self.pointwise or isinstance(self.model, ExpressionModel)
+        if not pointwise and extra_shape :
+            return self._compute_each(meshes, kwargs, shape, extra_shape)
+        if len(shape) == 0 or not pointwise :
+            return np.array(evaluate_model(self.model, meshes, kwargs, 
+                                           shape))
+        dim = int(np.argmax(shape))
+        n = shape[dim]
+        # Assume double precision results
+        bytes_per_index = 8 * int(np.prod(shape)) // max(1, n)
+        chunk_size = max(1, CHUNK_BYTES // max(1, bytes_per_index))
+        if chunk_size >= n :
+            return np.array(evaluate_model(self.model, meshes, kwargs, 
+                                           shape))
+
+        chunks = list(util.iter_chunks(n, chunk_size))
+        def key(chunk) :
+            return dim*(slice(None),) + (chunk,)
+
+        def cut(value, chunk) :
+            # Sparse meshes of the other axes (and parameters of other 
+            # dimensions) have length 1 along *dim*
+            if isinstance(value, np.ndarray) and \
+               value.ndim == len(shape) and value.shape[dim] == n :
+                return value[key(chunk)]
+            return value
+
+        def piece(chunk) :
+            """ The meshes, parameters and shape of the result of one 
+            *chunk*. 
+            """
+            chunk_meshes = [cut(mesh, chunk) for mesh in meshes]
+            chunk_kwargs = {name: cut(value, chunk) 
+                            for name, value in kwargs.items()}
+            chunk_shape = shape[:dim] + (chunk.stop - chunk.start,) + \
+                          shape[dim+1:]
+            return chunk_meshes, chunk_kwargs, chunk_shape
+
+        # The first piece tells us the dtype of the result
+        first = evaluate_model(self.model, *piece(chunks[0]))
+        data = np.empty(shape, dtype=first.dtype)
+        data[key(chunks[0])] = first
+        chunks = chunks[1:]
+
+        if self.processes and self._is_picklable() :
+            pieces = [piece(chunk) for chunk in chunks]
+            with ProcessPoolExecutor(max_workers=self.n_workers) as executor :
+                results = executor.map(evaluate_model, repeat(self.model), 
+                                       *zip(*pieces))
+                for chunk, result in zip(chunks, results) :
+                    data[key(chunk)] = result
+            return data
+
+        def process(i) :
+            for chunk in chunks[i] :
+                data[key(chunk)] = evaluate_model(self.model, *piece(chunk))
+        # Expressions are evaluated by all threads piece after piece
+        n_workers = 1 if isinstance(self.model, ExpressionModel) \
+                    else self.n_workers
+        util.map_chunks(process, len(chunks), chunk_size=1, 
+                        n_workers=n_workers)
         return data
 
+    def _compute_each(self, meshes, kwargs, shape, extra_shape) :
+        """ Evaluate a model that is not pointwise separately for every 
+        combination of the parameters that extend along the dimensions of 
+        *extra_shape*. 
+        """
+        n_axes = len(shape) - len(extra_shape)
+        base_shape = shape[:n_axes]
+        # Drop the dimensions of the parameters from the meshes
+        meshes = [mesh[(Ellipsis,) + len(extra_shape)*(0,)] 
+                  for mesh in meshes]
+        swept = [name for name, value in kwargs.items() 
+                 if isinstance(value, np.ndarray) and 
+                 value.ndim == len(shape)]
+        data = None
+        for index in np.ndindex(*extra_shape) :
+            values = dict(kwargs)
+            for name in swept :
+                value = kwargs[name]
+                values[name] = value[n_axes*(0,) + 
+                                     tuple(i if m > 1 else 0 for i, m in 
+                                           zip(index, value.shape[n_axes:]))]
+            result = evaluate_model(self.model, meshes, values, base_shape)
+            if data is None :
+                data = np.empty(shape, dtype=result.dtype)
+            data[(Ellipsis,) + index] = result
+        return np.empty(shape) if data is None else data
+
+    def _is_picklable(self) :
+        """ Check whether the model can be sent to other processes. """
+        try :
+            pickle.dumps(self.model)
+        except Exception :
+            logger.warning('The model cannot be pickled (lambdas and nested '
+                           'functions cannot), using threads instead of '
+                           'processes.')
+            return False
+        return True
+
     def make_slice(self, dim, index, integrate=0, silent=False) :
         """ Return a slice out of the model data. If the data has not yet 
         been calculated, try to do it first.
@@ -266,6 +754,34 @@ class Model() :
             self.calculate_model_data()
         return IsocurveItem(data=self.data, level=level, pen=pen, **kwargs)
 
+    def get_isocurve_path(self, level, dim=None, value=None, **kwargs) :
+        """
+        Return the isocurve at *level* as a :class:`QPainterPath 
+        <pyqtgraph.Qt.QtGui.QPainterPath>` (in row-major order, see 
+        :func:`isocurve_path <data_slicer.model.isocurve_path>`). For 3D 
+        models, the isocurve of the slice at *value* along the axis *dim* 
+        is computed (see :meth:`calculate_slice_data 
+        <data_slicer.model.Model.calculate_slice_data>`), for 2D models that 
+        of the model data. The paths are cached for every combination of 
+        slice, *level* and model parameters *kwargs*, until the axes change.
+        """
+        self._check_if_model_defined()
+        key = (dim, value, level, hash_key(sorted(kwargs.items())))
+        path = self._isocurves.get(key)
+        if path is None :
+            if dim is None :
+                if self.data is None :
+                    self.calculate_model_data(**kwargs)
+                data = self.data
+            else :
+                data = self.calculate_slice_data(dim, value, **kwargs)
+            if data.ndim != 2 :
+                raise ModelError('Isocurves need 2D data, but the data has '
+                                 'shape {}.'.format(data.shape))
+            path = isocurve_path(data, level)
+            self._isocurves.put(key, path)
+        return path
+
     def get_values_around(self, value, eps) :
         """ 
         .. warning::
@@ -273,7 +789,8 @@ class Model() :
         """
         mask = np.where(np.abs(self.data - value) < eps)
         points = self.data[mask]
-        return [mesh[mask] for mesh in self.meshes], points
+        return [np.broadcast_to(mesh, self.data.shape)[mask] 
+                for mesh in self.meshes], points
 
 # Testing
 if __name__ == '__main__' :
@@ -0,0 +1,286 @@
+"""
+Vectorized detection of peaks in a large number of one dimensional spectra
+at once, e.g. all EDCs or MDCs of a cut or of a whole data cube.
+The walks from the peaks to their bases are compiled with numba if it is
+installed (see :mod:`data_slicer.kernels`).
+"""
+import logging
+
+import numpy as np
+
+from data_slicer.kernels import get_kernel, register
+from data_slicer.utilities import map_chunks
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Default number of spectra that are processed together
+CHUNK_SIZE = 4096
+
+#_Functions_____________________________________________________________________
+
+def peak_dtype(n_coords) :
+    """ Return the structured dtype in which peaks are stored.
+
+    **Parameters**
+
+    ========  ==================================================================
+    n_coords  int; number of indices needed to identify a spectrum, i.e. the
+              dimensionality of the data minus one.
+    ========  ==================================================================
+
+    **Returns**
+
+    =====  =====================================================================
+    dtype  np.dtype with the fields *coords* (indices of the spectrum),
+           *position* (index of the peak in the spectrum), *height*,
+           *prominence* and *width* (in channels, measured at
+           *rel_height* of the prominence).
+    =====  =====================================================================
+    """
+    return np.dtype([('coords', np.int32, (n_coords,)),
+                     ('position', np.int32),
+                     ('height', np.float32),
+                     ('prominence', np.float32),
+                     ('width', np.float32)])
+
+def _in_range(values, limits) :
+    """ Return a boolean mask of the *values* that lie within *limits*.
+    *limits* can be *None* (no restriction), a single number (lower bound) or
+    a tuple (lower, upper) where either bound may be *None*.
+    """
+    mask = np.ones(values.shape, dtype=bool)
+    if limits is None :
+        return mask
+    try :
+        lower, upper = limits
+    except TypeError :
+        lower, upper = limits, None
+    if lower is not None :
+        mask &= values >= lower
+    if upper is not None :
+        mask &= values <= upper
+    return mask
+
+def local_maxima(spectra) :
+    """ Find the local maxima in all rows of the 2d array *spectra* at once.
+    Flat peaks (plateaus) are reported at their middle (rounded down). NaNs
+    are never considered to be peaks.
+
+    **Parameters**
+
+    =======  ===================================================================
+    spectra  2d np.array of shape (n_spectra, n); one spectrum per row.
+    =======  ===================================================================
+
+    **Returns**
+
+    =========  =================================================================
+    rows       1d int array; row index of each found maximum.
+    positions  1d int array; column index of each found maximum.
+    =========  =================================================================
+    """
+    n = spectra.shape[1]
+    if n < 3 :
+        empty = np.array([], dtype=int)
+        return empty, empty
+    # For every element, find the last index of the run of equal values it
+    # belongs to
+    change = np.empty(spectra.shape, dtype=bool)
+    change[:,:-1] = spectra[:,1:] != spectra[:,:-1]
+    change[:,-1] = True
+    run_end = np.where(change, np.arange(n), n-1)
+    run_end = np.minimum.accumulate(run_end[:,::-1], axis=1)[:,::-1]
+
+    # A peak starts where the spectrum rises and ends where it falls again
+    rising = np.zeros(spectra.shape, dtype=bool)
+    rising[:,1:] = spectra[:,1:] > spectra[:,:-1]
+    rows, starts = np.nonzero(rising)
+    ends = run_end[rows, starts]
+    valid = ends < n-1
+    rows, starts, ends = rows[valid], starts[valid], ends[valid]
+    falling = spectra[rows, ends+1] < spectra[rows, starts]
+    rows, starts, ends = rows[falling], starts[falling], ends[falling]
+    return rows, (starts + ends)//2
+
+@register('walk_to_base')
+def _walk_to_base(spectra, rows, positions, heights, step) :
+    """ Starting at *positions*, walk along all spectra simultaneously in
+    direction *step* (+1 or -1) until a value higher than the respective
+    peak's height or the edge of the spectrum is reached.
+    Return the minimum encountered on the way and its index.
+    Peaks that have reached their end are dropped from the computation, so
+    the cost of each step is proportional to the number of peaks that are
+    still active.
+    """
+    n = spectra.shape[1]
+    base_values = heights.copy()
+    base_indices = positions.copy()
+    j = positions + step
+    active = np.nonzero((j >= 0) & (j < n))[0]
+    while active.size :
+        ja = j[active]
+        values = spectra[rows[active], ja]
+        higher = values > heights[active]
+        lower = (values < base_values[active]) & ~higher
+        base_values[active[lower]] = values[lower]
+        base_indices[active[lower]] = ja[lower]
+        ja = ja + step
+        j[active] = ja
+        active = active[~higher & (ja >= 0) & (ja < n)]
+    return base_values, base_indices
+
+@register('interpolated_crossing')
+def _interpolated_crossing(spectra, rows, positions, references, bases,
+                           step) :
+    """ Walk from *positions* in direction *step* until the spectra drop
+    below *references* (or *bases* are reached) and return the linearly
+    interpolated (fractional) index of the crossing.
+    """
+    j = positions.copy()
+    active = np.arange(len(j))
+    while active.size :
+        ja = j[active]
+        more = (ja != bases[active]) & \
+               (spectra[rows[active], ja] > references[active])
+        active = active[more]
+        j[active] += step
+    crossing = j.astype(float)
+    values = spectra[rows, j]
+    below = values < references
+    neighbours = spectra[rows[below], j[below]-step]
+    crossing[below] -= step * (references[below] - values[below]) / \
+                       (neighbours - values[below])
+    return crossing
+
+def find_peaks_in_spectra(spectra, height=None, prominence=None, width=None,
+                          rel_height=0.5) :
+    """ Vectorized backend of :func:`find_peaks
+    <data_slicer.peaks.find_peaks>` that works on a 2d array with one
+    spectrum per row. See there for the meaning of the arguments.
+
+    **Returns**
+
+    ===========  ===============================================================
+    rows         1d int array; row index of each peak.
+    positions    1d int array; column index of each peak.
+    heights      1d array; value of the spectrum at the peak.
+    prominences  1d array; prominence of each peak.
+    widths       1d array; width of each peak at *rel_height*.
+    ===========  ===============================================================
+    """
+    rows, positions = local_maxima(spectra)
+    heights = spectra[rows, positions]
+    keep = _in_range(heights, height)
+    rows, positions, heights = rows[keep], positions[keep], heights[keep]
+
+    # Prominence: height above the higher of the two bases
+    walk_to_base = get_kernel('walk_to_base')
+    left_min, left_base = walk_to_base(spectra, rows, positions, heights, -1)
+    right_min, right_base = walk_to_base(spectra, rows, positions, heights, 1)
+    prominences = heights - np.maximum(left_min, right_min)
+    keep = _in_range(prominences, prominence)
+    rows, positions, heights, prominences = \
+            rows[keep], positions[keep], heights[keep], prominences[keep]
+    left_base, right_base = left_base[keep], right_base[keep]
+
+    # Width at the given relative height of the prominence
+    references = heights - rel_height*prominences
+    interpolated_crossing = get_kernel('interpolated_crossing')
+    left = interpolated_crossing(spectra, rows, positions, references,
+                                 left_base, -1)
+    right = interpolated_crossing(spectra, rows, positions, references,
+                                  right_base, 1)
+    widths = right - left
+    keep = _in_range(widths, width)
+    return rows[keep], positions[keep], heights[keep], prominences[keep], \
+           widths[keep]
+
+def find_peaks(data, axis=-1, height=None, prominence=None, width=None,
+               rel_height=0.5, chunk_size=CHUNK_SIZE, n_workers=None) :
+    """
+    Find the peaks in all one dimensional spectra along *axis* of the N
+    dimensional array *data*. The detection is vectorized over all spectra
+    and the spectra are processed in chunks which are distributed over a
+    pool of threads. Only one chunk at a time is read from lazy data. The definitions of *prominence* and *width* follow
+    :func:`scipy.signal.find_peaks`.
+
+    **Parameters**
+
+    ==========  ================================================================
+    data        array-like; N dimensional dataset.
+    axis        int; the dimension along which the spectra run.
+    height      number or tuple (min, max); required height of the peaks.
+    prominence  number or tuple (min, max); required prominence of the peaks.
+    width       number or tuple (min, max); required width (in channels) of
+                the peaks.
+    rel_height  float; relative height (with respect to the prominence) at
+                which the width is measured.
+    chunk_size  int; approximate number of spectra that are processed at once.
+                Limits the amount of temporary memory.
+    n_workers   int; number of threads. Defaults to the number of CPUs.
+    ==========  ================================================================
+
+    **Returns**
+
+    =====  =====================================================================
+    peaks  structured np.array of dtype :func:`peak_dtype(N-1)
+           <data_slicer.peaks.peak_dtype>`; one entry per found peak, sorted
+           by the coordinates of the spectra.
+    =====  =====================================================================
+    """
+    ndim = len(data.shape)
+    axis = axis % ndim
+    # Bring the spectrum axis to the end without reading the data (works 
+    # for lazy arrays as well)
+    order = [d for d in range(ndim) if d != axis] + [axis]
+    moved = data.transpose(order)
+    n_coords = ndim - 1
+    dtype = peak_dtype(n_coords)
+    # Treat a single spectrum like a set of one spectrum
+    if n_coords == 0 :
+        moved = np.asarray(moved)[np.newaxis]
+    outer_shape = moved.shape[:-1]
+    n = moved.shape[-1]
+    if 0 in moved.shape :
+        return np.empty(0, dtype=dtype)
+
+    # Chunks are taken along the first outer dimension, such that only one
+    # chunk at a time has to be copied into a contiguous block
+    per_index = int(np.prod(outer_shape[1:]))
+
+    def process(chunk) :
+        spectra = np.asarray(moved[chunk], dtype=float).reshape(-1, n)
+        rows, positions, heights, prominences, widths = \
+                find_peaks_in_spectra(spectra, height=height,
+                                      prominence=prominence, width=width,
+                                      rel_height=rel_height)
+        result = np.empty(len(rows), dtype=dtype)
+        if n_coords > 0 :
+            flat = rows + chunk.start*per_index
+            result['coords'] = np.stack(np.unravel_index(flat, outer_shape),
+                                        axis=-1)
+        result['position'] = positions
+        result['height'] = heights
+        result['prominence'] = prominences
+        result['width'] = widths
+        return result
+
+    chunk_length = max(1, chunk_size // per_index)
+    results = map_chunks(process, outer_shape[0], chunk_size=chunk_length,
+                         n_workers=n_workers)
+    peaks = np.concatenate(results)
+    logger.debug('find_peaks(): found {} peaks in {} spectra.'.format(
+                 len(peaks), outer_shape[0]*per_index))
+    return peaks
+
+def peak_indices(peaks, axis) :
+    """ Return the full N dimensional indices of all *peaks* as an array of
+    shape (n_peaks, N), i.e. insert the peak positions into the coordinates
+    at dimension *axis*.
+    """
+    coords = peaks['coords']
+    if axis < 0 :
+        axis += coords.shape[1] + 1
+    return np.insert(coords, axis, peaks['position'], axis=1)
@@ -5,6 +5,7 @@ distribution curves and other convenient features.
 
 import argparse
 import importlib
+import itertools
 import logging
 import pathlib
 import pickle
@@ -22,10 +23,26 @@ from qtconsole.rich_jupyter_widget import RichJupyterWidget
 from qtconsole.inprocess import QtInProcessKernelManager
 
 import data_slicer.dataloading as dl
-from data_slicer.cmaps import convert_ds_to_matplotlib, load_cmap
+from data_slicer import dtypes, kernels
+from data_slicer.caching import LRUCache
+from data_slicer.chunked import ChunkedArray, as_chunked
+from data_slicer.cmaps import DISPLAY_MODES, convert_ds_to_matplotlib, \
+                               load_cmap, make_lut, transfer_function
 from data_slicer.cutline import Cutline
+from data_slicer.expressions import ExpressionData
+from data_slicer.fitting import fit
+from data_slicer.history import History, PatchedArray, freeze
+from data_slicer.lazy import normalize_key, region_shape, select, subarray
 from data_slicer.imageplot import *
-from data_slicer.model import Model
+from data_slicer.masking import Mask, MaskedData, MaskValues, \
+                                has_invalid, mask_invalid, masked_slice, \
+                                masked_sum
+from data_slicer.model import Model, evaluate_model, isocurve_path
+from data_slicer.peaks import find_peaks, peak_indices
+from data_slicer.prefetch import SlicePrefetcher
+from data_slicer.processing import normalize, subtract_background
+from data_slicer.remapping import RotatedData, remap, rotate
+from data_slicer.statistics import get_histogram, new_token
 from data_slicer.utilities import CACHED_CMAPS_FILENAME, CONFIG_DIR, \
                                   make_slice, plot_cuts, TracedVariable
 
@@ -69,11 +86,37 @@ SAMPLE_DATA_FILE = data_path + 'pit.p'
 plugin_path = pathlib.Path.home() / CONFIG_DIR / 'plugins/'
 sys.path.append(str(plugin_path))
 
-# Number of dimensions to handle
+# Number of dimensions that are displayed (further dimensions are navigated 
+# with a slider each)
 NDIM = 3
+# Number of sub-cubes of N dimensional data whose projections are cached
+OUTER_VIEWS = 16
+# History steps after which the displayed data is the loaded data (or a 
+# view of it) and steps that do not change whether it is processed
+UNPROCESSED_STEPS = ('load', 'reset_data')
+VIEW_STEPS = ('roll_axes',)
 # What axes look like if they have not been initialized
 EMPTY_AXES = np.array(3*[None])
 
+def make_axes_array(axes) :
+    """ Pack the list of 1d-arrays (or *None*) *axes* into a np.array of 
+    dtype object. Unlike ``np.array(axes)`` this also works if the axes have 
+    different lengths.
+    """
+    result = np.empty(len(axes), dtype=object)
+    for i, axis in enumerate(axes) :
+        result[i] = axis
+    return result
+
+def _remove_item(item) :
+    """ Remove the QGraphicsItem *item* (if any) from its scene. """
+    try :
+        if item is not None and item.scene() is not None :
+            item.scene().removeItem(item)
+    except RuntimeError :
+        # The item has already been deleted together with its parent
+        pass
+
 # +-----------------------+ #
 # | Main class definition | # ==================================================
 # +-----------------------+ #
@@ -95,10 +138,52 @@ class PITDataHandler() :
         self.displayed_axes = (0,1)
         # Index along the z axis at which to produce a slice
         self.z = TracedVariable(0, name='z')
+        # Model shown on top of the data and its isocurves in the main and 
+        # cut plots, see overlay_model()
+        self.model = None
+        self.iso = None
+        self.model_cut = None
+        self._model_cut_path = None
+        # Windows that show the parameter maps of fit_model()
+        self.fit_windows = []
         ## Number of slices to integrate along z
         #integrate_z = TracedVariable(value=0, name='integrate_z')
         # How often we have rolled the axes from the original setup
         self._roll_state = 0
+        # Number that changes whenever the data changes. Used to identify 
+        # cached results that depend on the data.
+        self._generations = itertools.count(1)
+        self.generation = 0
+        # Identifies this handler in the histogram cache
+        self._token = new_token()
+        # The full (N dimensional) dataset, the axes of its dimensions 
+        # beyond the first three and the indices along them of the 
+        # displayed sub-cube (see set_outer_index())
+        self.full_data = None
+        self.outer_axes = []
+        self.outer_index = ()
+        # TracedVariables of the outer indices, one per outer dimension
+        self.outer = []
+        # Generation, mask and data of the recently displayed sub-cubes
+        self._views = LRUCache(max_items=OUTER_VIEWS)
+        # Integrated intensities by generation
+        self._integrated_cache = LRUCache(max_items=OUTER_VIEWS)
+        # Whether the outer TracedVariables are being synchronized
+        self._syncing_outer = False
+        # Cache of the slices along z which computes the next slices in the 
+        # background while stepping through z
+        self.prefetcher = SlicePrefetcher()
+        # Number of slices that are summed up in the main image
+        self.n_integrated = 1
+        # Parameters of the background subtraction that is previewed (or 
+        # None), see preview_background()
+        self.background_preview = None
+        # Mask of the valid entries of the data (or None), see set_mask()
+        self.mask = None
+        # Named datasets that can be used in expressions, see define()
+        self.datasets = dict()
+        # States of the data after each processing step, see undo()
+        self.history = History()
 
     def get_config_dir(self) :
         """ Return the path to the configuration directory on this system. """
@@ -110,14 +195,21 @@ class PITDataHandler() :
         """
         return self.data.get_value()
 
-    def set_data(self, data=None, axes=None) :
+    def set_data(self, data=None, axes=None, label='set_data') :
         """ Convenience `setter` method. Allows writing ``self.set_data(d)`` 
         instead of ``self.data.set_value(d)``. 
         Additionally allows setting new *axes*. If *axes* is ``None``, the axes
         are reset to pixels.
+        The new state is recorded in :attr:`history` under *label*, such 
+        that it can be undone (see :func:`undo 
+        <data_slicer.pit.PITDataHandler.undo>`). np.arrays are stored as 
+        read-only views: modify the data through :func:`set_region 
+        <data_slicer.pit.PITDataHandler.set_region>`. Other array-likes 
+        (e.g. dask arrays) are wrapped in a :class:`ChunkedArray 
+        <data_slicer.chunked.ChunkedArray>`.
         """
         if data is not None :
-            self.data.set_value(data)
+            self.data.set_value(freeze(as_chunked(data)))
         if axes is not None :
             self.axes = axes
             self.main_window.set_axes()
@@ -126,6 +218,73 @@ class PITDataHandler() :
         # Call on_z_dim_change here because it was not executed with the 
         # proper axes on the data change before
         self.on_z_dim_change()
+        self._record(label)
+
+    @property
+    def original_data(self) :
+        """ The data as it was loaded (read-only). """
+        return self.history.states[0]['data']
+
+    @property
+    def original_axes(self) :
+        return self.history.states[0]['axes']
+
+    def _state(self) :
+        """ Return the dict describing the current state of the data. """
+        data = self.get_data()
+        state = dict(data=data, axes=copy(self.axes), mask=self.mask, 
+                     roll_state=self._roll_state, 
+                     outer_index=self.outer_index)
+        if isinstance(data, PatchedArray) :
+            state['patches'] = data.snapshot()
+        return state
+
+    def _record(self, label) :
+        """ Add the current state to the history. """
+        current = self.history.current
+        if label in UNPROCESSED_STEPS :
+            processed = False
+        elif label in VIEW_STEPS and current is not None :
+            processed = current['processed']
+        else :
+            processed = True
+        self.history.record(label, processed=processed, **self._state())
+
+    @property
+    def processed(self) :
+        """ *True* if processing steps have been applied to the displayed 
+        data (see :attr:`history`).
+        """
+        current = self.history.current
+        return current is not None and current['processed']
+
+    def _restore(self, state) :
+        """ Display the data of a *state* from the history. """
+        data = state['data']
+        if 'patches' in state :
+            data.restore(state['patches'])
+        self.mask = state['mask']
+        self._roll_state = state['roll_state']
+        self.outer_index = state['outer_index']
+        self._sync_outer()
+        self.data.set_value(data)
+        self.axes = copy(state['axes'])
+        self.main_window.set_axes()
+        self.on_z_dim_change()
+
+    def undo(self) :
+        """ Revert the last processing step. The previous states are kept 
+        without copying the data: lazy steps are views and local 
+        modifications only store the modified chunks (see 
+        :mod:`data_slicer.history`).
+        """
+        logger.debug('undo()')
+        self._restore(self.history.undo())
+
+    def redo(self) :
+        """ Repeat the last step that was undone. """
+        logger.debug('redo()')
+        self._restore(self.history.redo())
 
     def prepare_data(self, data, axes=3*[None]) :
         """ Load the specified data and prepare the corresponding z range. 
@@ -134,35 +293,175 @@ class PITDataHandler() :
         **Parameters**
 
         ====  ==================================================================
-        data  3d array; the data to display
-        axes  len(3) list or array of 1d-arrays or None; the units along the 
-              x, y and z axes respectively. If any of those is *None*, pixels 
-              are used.
+        data  array of 3 or more dimensions; the data to display. np.arrays 
+              are converted to the storage dtype of the current 
+              :class:`DtypePolicy <data_slicer.dtypes.DtypePolicy>`, if one 
+              is set. Memory-mapped files and other array-likes (e.g. 
+              dask arrays or h5py datasets) are read in chunks on demand 
+              (see :class:`ChunkedArray 
+              <data_slicer.chunked.ChunkedArray>`). Of data with more than 
+              three dimensions, the first three are displayed and the 
+              others get a slider each (see :func:`set_outer_index 
+              <data_slicer.pit.PITDataHandler.set_outer_index>`).
+        axes  list or array of 1d-arrays or None; the units along the 
+              dimensions of the data (x, y, z, ...). If any of those is 
+              *None*, pixels are used.
         ====  ==================================================================
         """
         logger.debug('prepare_data()')
 
-        self.data = TracedVariable(data, name='data')
+        data = as_chunked(dtypes.policy.to_storage(data))
+        if len(data.shape) < NDIM :
+            raise ValueError('Data of shape {} has less than {} '
+                             'dimensions.'.format(data.shape, NDIM))
         if axes is None :
-            self.axes = np.array(3*[None])
-        else :
-            self.axes = np.array(axes)
-
-        # Retain a copy of the original data and axes so that we can reset later
-        # NOTE: this effectively doubles the used memory!
-        self.original_data = copy(self.data.get_value())
-        self.original_axes = copy(self.axes)
+            axes = []
+        axes = list(axes) + (len(data.shape) - len(axes))*[None]
+        self.full_data = freeze(data)
+        self.outer_axes = [np.arange(n) if axis is None else np.asarray(axis) 
+                           for n, axis in zip(data.shape[NDIM:], 
+                                              axes[NDIM:])]
+        self.outer_index = tuple(0 for axis in self.outer_axes)
+        self._roll_state = 0
+        self._views.clear()
+        self._integrated_cache.clear()
+        self.prefetcher.invalidate()
+        self.outer = []
+        for i, axis in enumerate(self.outer_axes) :
+            outer = TracedVariable(0, name='outer {}'.format(i))
+            outer.set_allowed_values(range(len(axis)))
+            outer.sig_value_changed.connect(self.on_outer_change)
+            self.outer.append(outer)
+
+        # The data is kept read-only, such that the history can refer to it 
+        # instead of keeping a copy for reset_data(). Only a view of the 
+        # displayed sub-cube of N dimensional data is used.
+        view = self._get_view(self.outer_index)
+        self.generation = view['generation']
+        self.mask = view['mask']
+        self.data = TracedVariable(view['data'], name='data')
+        self.axes = make_axes_array(axes[:NDIM])
 
         self.prepare_axes()
+        self.history.clear()
+        self._record('load')
         self.on_z_dim_change()
+        self.main_window.update_lut()
         
         # Connect signal handling so changes in data are immediately reflected
         self.z.sig_value_changed.connect( \
             lambda : self.main_window.update_main_plot(emit=False))
         self.data.sig_value_changed.connect(self.on_data_change)
+        self.data.sig_region_changed.connect(self.on_region_change)
 
         self.main_window.update_main_plot()
         self.main_window.set_axes()
+        self.main_window.set_outer_sliders()
+
+    def _get_view(self, index) :
+        """ Return the cached dict(generation, data, mask) of the 
+        sub-cube at the outer *index* in the current roll state, creating 
+        it if necessary. The data is a view of :attr:`full_data`.
+        """
+        key = (index, self._roll_state)
+        view = self._views.get(key)
+        if view is not None :
+            return view
+        data = select(self.full_data, index)
+        if self._roll_state :
+            data = data.transpose(np.roll([0, 1, 2], -self._roll_state))
+        view = dict(generation=next(self._generations), data=data, 
+                    mask=None)
+        # Mask NaNs automatically. Finding them needs a pass over all of 
+        # the data, which is skipped for out-of-core data. The masked 
+        # entries are replaced on access instead of copying the data.
+        if not isinstance(self.full_data, ChunkedArray) and \
+           has_invalid(data) :
+            logger.info('Masking invalid values (NaN or inf) in the data.')
+            view['mask'] = mask_invalid(data)
+            view['data'] = MaskedData(data, view['mask'])
+        self._views.put(key, view)
+        return view
+
+    def set_outer_index(self, index) :
+        """
+        Display the sub-cube of N dimensional data at *index* along the 
+        dimensions beyond the first three. The sub-cube is a view of the 
+        full data, not a copy. The colour levels and integrated intensities 
+        of the last :const:`OUTER_VIEWS <data_slicer.pit.OUTER_VIEWS>` 
+        sub-cubes are kept, so switching back and forth between them is 
+        cheap. Changing the sub-cube is navigation and does not add a 
+        step to the :attr:`history`; the recorded states remember their 
+        sub-cube and return to it when they are restored.
+
+        Processing steps (like :func:`normalize 
+        <data_slicer.pit.PITDataHandler.normalize>`) only apply to the 
+        displayed sub-cube. While processed data is shown, switching is 
+        refused with a warning (and playback of the outer sliders stops): 
+        undo the steps or call :func:`reset_data 
+        <data_slicer.pit.PITDataHandler.reset_data>` first.
+
+        **Parameters**
+
+        =====  =================================================================
+        index  tuple of int; one index per dimension beyond the third.
+        =====  =================================================================
+        """
+        index = tuple(int(i) for i in index)
+        if len(index) != len(self.outer_axes) :
+            raise ValueError('Need {} indices, got {}.'.format(
+                             len(self.outer_axes), len(index)))
+        index = tuple(i % len(axis) if -len(axis) <= i < len(axis) else None 
+                      for i, axis in zip(index, self.outer_axes))
+        if None in index :
+            raise IndexError('Outer index out of range.')
+        if index == self.outer_index :
+            return
+        if self.processed :
+            logger.warning('Processing steps only apply to the displayed '
+                           'sub-cube. Undo them or reset the data before '
+                           'switching to another one.')
+            for plot in self.main_window.outer_plots :
+                if plot.player is not None :
+                    plot.player.stop()
+            self._sync_outer()
+            return
+        logger.debug('set_outer_index({})'.format(index))
+        self.outer_index = index
+        self._sync_outer()
+        view = self._get_view(index)
+        self.mask = view['mask']
+        self.data.blockSignals(True)
+        self.data.set_value(view['data'])
+        self.data.blockSignals(False)
+        # Processing steps may have changed the axes
+        axes = make_axes_array(np.roll(self.original_axes, -self._roll_state))
+        changed = any(not np.array_equal(a, b) 
+                      for a, b in zip(axes, self.axes))
+        self.axes = axes
+        if changed :
+            self.main_window.set_axes()
+        self.generation = view['generation']
+        self._redraw_data()
+        # Navigation is not a processing step: only the current state 
+        # follows it
+        self.history.update(**self._state())
+
+    def on_outer_change(self) :
+        """ Called when one of the outer sliders has been moved. """
+        if self._syncing_outer :
+            return
+        self.set_outer_index([outer.get_value() for outer in self.outer])
+
+    def _sync_outer(self) :
+        """ Move the outer sliders to :attr:`outer_index`. """
+        self._syncing_outer = True
+        try :
+            for outer, i in zip(self.outer, self.outer_index) :
+                if outer.get_value() != i :
+                    outer.set_value(i)
+        finally :
+            self._syncing_outer = False
 
     def load(self, filename) :
         """ Alias to :func:`open <data_slicer.pit.PITDataHandler.open>`. """ 
@@ -228,11 +527,13 @@ class PITDataHandler() :
         just loaded from file.
         """
         logger.debug('reset_data()')
-        self.set_data(copy(self.original_data))
-        self.axes = copy(self.original_axes)
-        self.prepare_axes()
-        # Roll back to the view we had before reset_data was called
-        self._roll_axes(self._roll_state, update=False)
+        # Keep the view (roll state and outer index) we had before 
+        # reset_data was called
+        view = self._get_view(self.outer_index)
+        self.mask = view['mask']
+        self.set_data(view['data'], 
+                      axes=np.roll(self.original_axes, -self._roll_state), 
+                      label='reset_data')
 
     def prepare_axes(self) :
         """ Create a list containing the three original x-, y- and z-axes 
@@ -247,11 +548,115 @@ class PITDataHandler() :
     def on_data_change(self) :
         """ Update self.main_window.image_data and replot. """
         logger.debug('on_data_change()')
+        self.generation = next(self._generations)
+        self._redraw_data()
+
+    def _redraw_data(self) :
+        """ Redraw everything that depends on the data. """
+        if self.mask is not None and \
+           not self.mask.matches(self.get_data().shape) :
+            logger.info('Removing mask that does not match the new data.')
+            self.mask = None
+        self.main_window.update_lut()
         self.update_image_data()
         self.main_window.redraw_plots()
         # Also need to recalculate the intensity plot
         self.on_z_dim_change()
 
+    def set_region(self, key, values) :
+        """
+        Set ``data[key] = values`` and update only what depends on the 
+        modified region: the integrated intensity is patched with the 
+        change of the sums over the region and the main image is only 
+        redrawn if the region overlaps with the displayed slices. The 
+        colour levels are not recomputed; call :func:`on_data_change 
+        <data_slicer.pit.PITDataHandler.on_data_change>` for a full update.
+
+        The data itself is not modified: it is wrapped in a 
+        :class:`PatchedArray <data_slicer.history.PatchedArray>` that only 
+        copies the modified chunks, so the change can be undone.
+
+        **Parameters**
+
+        ======  ================================================================
+        key     index into the data, e.g. ``np.s_[:, :, 10:20]``.
+        values  np.array or number that can be assigned to ``data[key]``.
+        ======  ================================================================
+        """
+        data = self.get_data()
+        if not isinstance(data, PatchedArray) :
+            data = PatchedArray(data)
+            # The values do not change, so nothing needs to be updated
+            self.data.blockSignals(True)
+            self.data.set_value(data)
+            self.data.blockSignals(False)
+        region, post = normalize_key(key, data.shape)
+        block = data[region]
+        accumulation = dtypes.policy.accumulation_dtype(data.dtype)
+        before = block.sum(axis=(0, 1), dtype=accumulation)
+        block[post] = values
+        if self.mask is not None :
+            # Masked entries have to stay zero
+            np.copyto(block, 0, where=~self.mask.valid(region))
+        data[region] = block
+        self._record('set_region')
+        self._update_region(region, 
+                            delta=block.sum(axis=(0, 1), dtype=accumulation) 
+                                  - before)
+
+    def on_region_change(self, region) :
+        """ Called when the data has been modified in place within *region* 
+        (see :func:`TracedVariable.notify_region_changed 
+        <data_slicer.utilities.TracedVariable.notify_region_changed>`). 
+        Recompute the integrated intensity only for the affected slices and 
+        redraw as in :func:`set_region 
+        <data_slicer.pit.PITDataHandler.set_region>`.
+        """
+        logger.debug('on_region_change()')
+        region = normalize_key(region, self.get_data().shape)[0]
+        self._update_region(region)
+
+    def _update_region(self, region, delta=None) :
+        """ Update the integrated intensity in the z range of *region* 
+        (either by adding the change of the sums, *delta*, or by 
+        recomputing it) and redraw the plots that show the region.
+        """
+        data = self.get_data()
+        # The slices are cached by generation, which does not change here
+        self.prefetcher.invalidate()
+        zs = region[2]
+        if delta is None :
+            sums = np.asarray(data[:,:,zs]).sum(
+                axis=(0, 1), dtype=dtypes.policy.accumulation_dtype(data.dtype))
+        else :
+            sums = delta
+        if self.mask is not None :
+            # Rescale by the number of valid entries, like masked_sum()
+            count = np.broadcast_to(self.mask.count_over((0, 1)), 
+                                    data.shape[2:])[zs]
+            with np.errstate(divide='ignore', invalid='ignore') :
+                sums = np.where(count > 0, 
+                                sums * (data.shape[0]*data.shape[1]/count),
+                                np.nan)
+        if delta is None :
+            self.integrated[zs] = sums
+        else :
+            self.integrated[zs] += sums
+        try :
+            self.main_window.integrated_plot.listDataItems()[0].setData(
+                self.integrated)
+        except IndexError :
+            pass
+
+        # Only redraw the main image if the modified slices are shown
+        z = self.z.get_value()
+        half_width = \
+        int(self.main_window.integrated_plot.slider_width.get_value()/2)
+        if zs.start <= z + half_width and z - half_width < zs.stop :
+            self.main_window.update_main_plot()
+        # The cut runs through all slices
+        self.main_window.update_cut()
+
     def on_z_dim_change(self) :
         """ Called when either completely new data is loaded or the dimension 
         from which we look at the data changed (e.g. through :func:`roll_axes 
@@ -285,7 +690,84 @@ class PITDataHandler() :
         ip.set_secondary_axis(zmin, zmax)
 
     def calculate_integrated_intensity(self) :
-        self.integrated = self.get_data().sum(0).sum(0)
+        integrated = self._integrated_cache.get(self.generation)
+        if integrated is None :
+            data = self.get_data()
+            if self.mask is None :
+                integrated = data.sum(axis=(0, 1), 
+                    dtype=dtypes.policy.accumulation_dtype(data.dtype))
+            else :
+                integrated = masked_sum(data, self.mask, (0, 1))
+            self._integrated_cache.put(self.generation, integrated)
+        # set_region() modifies self.integrated in place
+        self.integrated = integrated.copy()
+
+    def get_histogram(self) :
+        """ Return the :class:`Histogram 
+        <data_slicer.statistics.Histogram>` of the whole dataset (excluding 
+        masked values). It is computed once per change of the data and 
+        cached.
+        """
+        data = self.get_data()
+        if self.mask is not None :
+            data = MaskedData(data, self.mask, fill_value=np.nan)
+        return get_histogram(data, key=('pit', self._token, self.generation))
+
+    def set_mask(self, mask=None) :
+        """
+        Exclude the entries of the data that are invalid according to 
+        *mask* from all slices, cuts and profiles. Masked entries are 
+        replaced by zeros when they are accessed (see :class:`MaskedData 
+        <data_slicer.masking.MaskedData>`), such that integrations remain 
+        plain sums without copying the data. The sums 
+        are then rescaled by the fraction of valid entries that went into 
+        them (using prefix sums over the mask), so masked regions do not 
+        appear darker. Points without any valid entry are shown as NaN.
+
+        **Parameters**
+
+        ====  ==================================================================
+        mask  :class:`Mask <data_slicer.masking.Mask>`, bool array that 
+              broadcasts against the data (*True* for valid entries, e.g. 
+              of shape (nx, ny, 1) to mask detector pixels) or *None*. 
+              *None* masks all NaN and infinite values.
+        ====  ==================================================================
+
+        .. seealso::
+            :mod:`data_slicer.masking`
+        """
+        logger.debug('set_mask()')
+        data = self.get_data()
+        if mask is None :
+            mask = mask_invalid(data)
+        elif not isinstance(mask, Mask) :
+            mask = Mask(mask, data.shape)
+        self.mask = mask
+        self.set_data(MaskedData(data, mask), axes=self.axes, 
+                      label='set_mask')
+
+    def clear_mask(self) :
+        """ Stop excluding masked entries. Note that these entries remain 
+        zero until the data is reset with :func:`reset_data 
+        <data_slicer.pit.PITDataHandler.reset_data>` (or this step is 
+        undone).
+        """
+        self.mask = None
+        self.on_data_change()
+        self._record('clear_mask')
+
+    def get_levels(self, lower=None, upper=None, integrated=False) :
+        """ Return robust colour levels [low, high] for images of the 
+        data, based on the percentiles *lower* and *upper* of the whole 
+        dataset (see :meth:`Histogram.levels 
+        <data_slicer.statistics.Histogram.levels>`). If *integrated* is 
+        *True*, the levels are scaled to the number of slices that are 
+        summed up in the main image.
+        """
+        levels = self.get_histogram().levels(lower, upper)
+        if integrated :
+            levels = [self.n_integrated*level for level in levels]
+        return levels
 
     def update_image_data(self) :
         """ Get the right (possibly integrated) slice out of *self.data*, 
@@ -299,9 +781,17 @@ class PITDataHandler() :
         int(self.main_window.integrated_plot.slider_width.get_value()/2)
         data = self.get_data()
         try :
-            self.main_window.image_data = make_slice(data, dim=2, index=z, 
-                                                     integrate=integrate_z, 
-                                                     silent=True) 
+            # The slice is usually precomputed when stepping through z
+            image = self.prefetcher.get_slice(data, z, integrate=integrate_z, 
+                                              mask=self.mask, 
+                                              key=self.generation)
+            self.main_window.image_data = image
+            self.n_integrated = min(z + integrate_z + 1, data.shape[2]) - \
+                                max(z - integrate_z, 0)
+            preview = self.background_preview
+            if preview is not None and preview['axis'] in (0, 1) :
+                self.main_window.image_data = subtract_background(
+                    self.main_window.image_data, **preview)
         except IndexError :
             logger.debug(('update_image_data(): z index {} out of range for '
                           'data of length {}.').format(
@@ -328,9 +818,16 @@ class PITDataHandler() :
         """
         logger.debug('roll_axes()')
         data = self.get_data()
-        res = np.roll([0, 1, 2], i)
+        # Equivalent to moving dimensions [0, 1, 2] to np.roll([0, 1, 2], i) 
+        # but also works for lazy array-likes
         self.axes = np.roll(self.axes, -i)
-        self.set_data(np.moveaxis(data, [0, 1, 2], res), axes=self.axes)
+        order = np.roll([0, 1, 2], -i)
+        if self.mask is not None :
+            self.mask = self.mask.transpose(order)
+        if update :
+            self._roll_state = (self._roll_state + i) % NDIM
+        self.set_data(data.transpose(order), axes=self.axes, 
+                      label='roll_axes')
         # Setting the data triggers a call to self.redraw_plots()
         self.on_z_dim_change()
         # Reset cut_plot's axes
@@ -338,8 +835,254 @@ class PITDataHandler() :
 #        cp.xlim = None
 #        cp.ylim = None
         self.main_window.set_axes()
-        if update :
-            self._roll_state = (self._roll_state + i) % NDIM
+
+    def remap(self, target_axes, mapping=None, key=None, fill_value=0) :
+        """
+        Resample the current data from its x and y axes onto the grid given 
+        by *target_axes*, e.g. to convert from angles to momenta. The 
+        result is lazy: only the slices and cuts that are displayed get 
+        computed. The underlying sparse interpolation matrix is cached in 
+        memory and on disk, so remapping further datasets with the same 
+        geometry is cheap.
+
+        **Parameters**
+
+        ===========  ===========================================================
+        target_axes  tuple of two 1d arrays (u, v); the new x and y axes.
+        mapping      callable or *None*; function ``mapping(U, V) -> (X, Y)`` 
+                     that returns the current x and y coordinates 
+                     corresponding to the new coordinates *U* and *V*. If 
+                     *None*, the data is simply regridded.
+        key          any object with a stable ``repr``; identifies 
+                     *mapping* in the cache. See 
+                     :func:`get_interpolation_matrix 
+                     <data_slicer.remapping.get_interpolation_matrix>`.
+        fill_value   number; value for points outside the original data.
+        ===========  ===========================================================
+
+        .. seealso::
+            :mod:`data_slicer.remapping`
+        """
+        logger.debug('remap()')
+        source_axes = self.axes[:2]
+        remapped = remap(self.get_data(), source_axes, target_axes, 
+                         mapping=mapping, key=key, fill_value=fill_value)
+        axes = make_axes_array([np.asarray(target_axes[0]), 
+                                np.asarray(target_axes[1]), self.axes[2]])
+        # The mask refers to the grid before remapping
+        self.mask = None
+        self.set_data(remapped, axes=axes, label='remap')
+
+    def rotate(self, alpha, center=None, fill_value=0) :
+        """
+        Rotate the data (not just its display) by *alpha* degrees 
+        counterclockwise in the x-y plane, such that slices, cuts and 
+        profiles follow the rotated data. Like :func:`remap 
+        <data_slicer.pit.PITDataHandler.remap>`, the rotation is evaluated 
+        lazily and its interpolation weights are cached per angle.
+        Consecutive rotations around the same center are combined into a 
+        single one, so that the data does not get blurred by repeated 
+        interpolation.
+
+        **Parameters**
+
+        ==========  ============================================================
+        alpha       float; rotation angle in degrees.
+        center      tuple (x0, y0) or *None*; point (in axes coordinates) 
+                    around which to rotate. Defaults to the center of the 
+                    data.
+        fill_value  number; value for regions rotated in from outside the 
+                    data.
+        ==========  ============================================================
+
+        .. seealso::
+            :func:`data_slicer.remapping.rotate`
+        """
+        logger.debug('rotate()')
+        data = self.get_data()
+        axes = tuple(np.asarray(a, dtype=float) for a in self.axes[:2])
+        if isinstance(data, RotatedData) and \
+           all(np.array_equal(a, b) for a, b in zip(axes, data.axes)) and \
+           (center is None or tuple(center) == data.center) :
+            alpha += data.alpha
+            center = data.center
+            data = data.data
+        rotated = rotate(data, axes, alpha, center=center, 
+                         fill_value=fill_value)
+        # The mask refers to the unrotated grid
+        self.mask = None
+        self.set_data(rotated, axes=self.axes, label='rotate')
+
+    def normalize(self, mode='max', axis=2, region=None) :
+        """
+        Normalize every spectrum of the data, e.g. every EDC (``axis=2``) or 
+        every MDC along x (``axis=0``). Only one small array of factors is 
+        computed and applied lazily to the displayed slices and cuts, such 
+        that the history does not need to keep a normalized copy of the 
+        data.
+
+        **Parameters**
+
+        ======  ================================================================
+        mode    str; 'max', 'area' or 'region'. See 
+                :func:`normalization_factors 
+                <data_slicer.processing.normalization_factors>`.
+        axis    int or tuple of int; dimension(s) along which the spectra 
+                run.
+        region  tuple (start, stop); index range along *axis* to use as 
+                reference in 'region' mode.
+        ======  ================================================================
+        """
+        logger.debug('normalize()')
+        data = normalize(self.get_data(), axis=axis, mode=mode, region=region)
+        self.set_data(data, axes=self.axes, label='normalize')
+
+    def subtract_background(self, mode='shirley', axis=2, **kwargs) :
+        """
+        Subtract the background from every spectrum along *axis* of the 
+        data. All spectra are processed at once in vectorized chunks that 
+        are distributed over a pool of threads.
+
+        **Parameters**
+
+        ========  ==============================================================
+        mode      str; 'constant', 'linear' or 'shirley'. See 
+                  :func:`background_of_spectra 
+                  <data_slicer.processing.background_of_spectra>`.
+        axis      int; dimension along which the spectra run.
+        (kwargs)  further arguments to :func:`subtract_background 
+                  <data_slicer.processing.subtract_background>`, e.g. 
+                  *n_edge* or *region*.
+        ========  ==============================================================
+
+        .. seealso::
+            :meth:`preview_background 
+            <data_slicer.pit.PITDataHandler.preview_background>`
+        """
+        logger.debug('subtract_background()')
+        self.background_preview = None
+        data = subtract_background(self.get_data(), axis=axis, mode=mode, 
+                                   **kwargs)
+        self.set_data(data, axes=self.axes, label='subtract_background')
+
+    def preview_background(self, mode='shirley', axis=2, **kwargs) :
+        """ Show the effect of :meth:`subtract_background 
+        <data_slicer.pit.PITDataHandler.subtract_background>` without 
+        applying it to the whole dataset. The background is only computed 
+        for the displayed images: the main plot if *axis* is 0 or 1, the cut 
+        plot if *axis* is 2. The preview follows changes of the slice until 
+        it is removed with :meth:`clear_background_preview 
+        <data_slicer.pit.PITDataHandler.clear_background_preview>`.
+        """
+        self.background_preview = dict(kwargs, mode=mode, axis=axis)
+        self.update_image_data()
+        self.main_window.redraw_plots()
+
+    def clear_background_preview(self) :
+        """ Remove the preview created by :meth:`preview_background 
+        <data_slicer.pit.PITDataHandler.preview_background>`. """
+        self.background_preview = None
+        self.update_image_data()
+        self.main_window.redraw_plots()
+
+    def crop(self, xlim=None, ylim=None, zlim=None) :
+        """
+        Restrict the data to a sub-cube. The cropped data is a view of the 
+        current data (no values are copied), the axes are sliced 
+        accordingly and the crop can be undone like any other step.
+
+        **Parameters**
+
+        ====  ==================================================================
+        xlim  tuple (start, stop) of int or *None*; index range along x. 
+              *None* keeps the whole range.
+        ylim  same along y.
+        zlim  same along z.
+        ====  ==================================================================
+
+        .. seealso::
+            :func:`MainWindow.select_crop 
+            <data_slicer.pit.MainWindow.select_crop>`
+        """
+        logger.debug('crop()')
+        data = self.get_data()
+        key = tuple(slice(None) if lim is None else slice(*lim) 
+                    for lim in (xlim, ylim, zlim))
+        region = normalize_key(key, data.shape)[0]
+        if 0 in region_shape(region) :
+            raise ValueError('Cannot crop to an empty region.')
+        axes = make_axes_array([None if axis is None else 
+                                np.asarray(axis)[r] 
+                                for axis, r in zip(self.axes, region)])
+        if self.mask is not None :
+            self.mask = self.mask.crop(region)
+        self.set_data(subarray(data, region), axes=axes, label='crop')
+
+    def add_dataset(self, name, data=None) :
+        """ Register *data* (an array-like of the same shape as the 
+        current data, or by default the current data itself) under *name*, 
+        such that it can be used in expressions of :func:`define 
+        <data_slicer.pit.PITDataHandler.define>`.
+        """
+        if not name.isidentifier() :
+            raise ValueError('"{}" is not a valid dataset name.'.format(name))
+        self.datasets[name] = self.get_data() if data is None else data
+
+    def define(self, name, expression, show=True) :
+        """
+        Define a virtual dataset *name* through an arithmetic *expression* 
+        over the datasets registered with :func:`add_dataset 
+        <data_slicer.pit.PITDataHandler.add_dataset>` (or defined before), 
+        e.g. ``pit.define('asym', '(a-b)/(a+b)')``. Nothing is computed 
+        up front: only the displayed slices and cuts are evaluated (in 
+        parallel). Use :func:`materialize 
+        <data_slicer.pit.PITDataHandler.materialize>` to compute the whole 
+        dataset.
+
+        **Parameters**
+
+        ==========  ============================================================
+        name        str; name of the new dataset.
+        expression  str; see :class:`Expression 
+                    <data_slicer.expressions.Expression>` for the allowed 
+                    syntax.
+        show        bool; whether to display the new dataset.
+        ==========  ============================================================
+
+        **Returns**
+
+        ====  ==================================================================
+        data  :class:`ExpressionData <data_slicer.expressions.ExpressionData>`.
+        ====  ==================================================================
+        """
+        data = ExpressionData(expression, self.datasets)
+        self.add_dataset(name, data)
+        if show :
+            self.show_dataset(name)
+        return data
+
+    def show_dataset(self, name) :
+        """ Display the registered dataset *name*. The current axes are 
+        kept if the shapes agree. 
+        """
+        data = self.datasets[name]
+        if tuple(data.shape) == tuple(self.get_data().shape) :
+            axes = self.axes
+        else :
+            axes = make_axes_array([np.arange(n) for n in data.shape])
+        self.set_data(data, axes=axes, label='show_dataset')
+
+    def materialize(self, name) :
+        """ Compute the whole (virtual) dataset *name* and store the result 
+        in its place. If it is currently displayed, the display switches to 
+        the computed data.
+        """
+        data = self.datasets[name]
+        computed = np.asarray(data)
+        self.datasets[name] = computed
+        if self.get_data() is data :
+            self.set_data(computed, axes=self.axes, label='materialize')
+        return computed
 
     def lineplot(self, plot='main', dim=0, ax=None, n=10, offset=0.2, lw=0.5, 
                  color='k', label_fmt='{:.2f}', n_ticks=5, **getlines_kwargs) :
@@ -452,91 +1195,361 @@ class PITDataHandler() :
                   cmap=cmap, vmax=vmax, gamma=gamma, max_ppf=max_ppf, 
                   max_nfigs=max_nfigs)
 
-    def overlay_model(self, model) :
+    def overlay_model(self, model, level=None, pen=None, **kwargs) :
         """ Display a model over the data. *model* should be function of two 
-        variables, namely the currently displayed x- and y-axes.
+        variables, namely the currently displayed x- and y-axes, or of 
+        three, the x-, y- and z-axes. 
+        Isocurves of 2D models are drawn at the level of the current z 
+        index. 3D models are only evaluated on the grid of the displayed 
+        slice (and along the cut) and their isocurve is drawn at *level*. 
+        The isocurves are cached, such that going back and forth in z only 
+        computes them once.
 
         **Parameters**
 
-        =====  =================================================================
-        model  callable or :class:`Model <data_slicer.model.Model>`;
-        =====  =================================================================
+        ======  ================================================================
+        model   callable, str (see :meth:`Model.set_model 
+                <data_slicer.model.Model.set_model>`) or :class:`Model 
+                <data_slicer.model.Model>`;
+        level   float; value of the isocurves of 3D models (default 0) or 
+                *None* to use the z index for 2D models.
+        pen     arguments for the visual properties of the isocurves. Can be 
+                anything which is valid for :func:`mkPen <pyqtgraph.mkPen>`.
+        kwargs  parameters that are passed on to the model function.
+        ======  ================================================================
 
         .. seealso::
             :class:`Model <data_slicer.model.Model>`
         """
-        if isinstance(model, FunctionType) :
+        if isinstance(model, (FunctionType, str)) :
             model = Model(model)
         elif not isinstance(model, Model) :
-            raise ValueError('*model* has to be a function or a '
-                             'data_slicer.Model instance')
+            raise ValueError('*model* has to be a function, an expression or '
+                             'a data_slicer.Model instance')
+        if model.n_args not in (2, 3) :
+            raise ValueError('Only models of 2 or 3 axes can be overlaid, '
+                             'got {}.'.format(model.n_args))
         # Remove the old model
         self.remove_model()
 
-        # Calculate model data in the required range and get an isocurve
         self.model = model
+        self.model_level = 0 if level is None and model.n_args == 3 \
+                           else level
+        self.model_kwargs = kwargs
+        self.model_pen = pg.mkPen(dict(color='r', width=2) if pen is None 
+                                  else pen)
         # Bypass the minimum axes size limitation
         self.model.MIN_AXIS_LENGTH = 0
         model_axes = [self.axes[i] for i in self.displayed_axes]
         # Invert order for transposed view
         if self.main_window.main_plot.transposed.get_value() :
-            self.model.set_axes(model_axes[::-1])
+            model_axes = model_axes[::-1]
+        if model.n_args == 3 :
+            # 3D models are only evaluated where they are shown
+            model_axes.append(self.axes[2])
+            self.model.set_axes(model_axes)
         else :
             self.model.set_axes(model_axes)
+            self.model.calculate_model_data(**kwargs)
         self._update_isocurve()
         self._update_model_cut()
 
-        # Connect signal handling
+        # Connect signal handling. The isocurves are drawn on the images, 
+        # which are replaced when they are redrawn.
         self.z.sig_value_changed.connect(self._update_isocurve)
         self.main_window.cutline.sig_region_changed.connect(self._update_model_cut)
+        self.main_window.main_plot.sig_image_changed.connect(
+            self._update_isocurve)
+        self.main_window.cut_plot.sig_image_changed.connect(
+            self._draw_model_cut)
 
     def remove_model(self) :
         """ Remove the current model's visible and invisible parts. """
-        # Remove the visible items from the plots
-        try :
-            self.main_window.main_plot.removeItem(self.iso)
-            self.iso = None
-            self.model = None
-        except AttributeError :
+        if self.model is None :
             logger.debug('remove_model(): no model to remove found.')
             return
+        # Remove the visible items from the plots
+        _remove_item(self.iso)
+        self._remove_model_cut()
+        self.iso = None
+        self.model = None
         # Remove signal handling
         try :
             self.z.sig_value_changed.disconnect(self._update_isocurve)
         except TypeError as e :
             logger.debug(e)
-        try :
-            self.main_window.cutline.sig_region_changed.disconnect(
-                self._update_model_cut)
-        except TypeError as e :
-            logger.debug(e)
+        for signal, slot in [
+            (self.main_window.cutline.sig_region_changed, 
+             self._update_model_cut), 
+            (self.main_window.main_plot.sig_image_changed, 
+             self._update_isocurve), 
+            (self.main_window.cut_plot.sig_image_changed, 
+             self._draw_model_cut)] :
+            try :
+                signal.disconnect(slot)
+            except TypeError as e :
+                logger.debug(e)
 
         # Redraw clean plots
         self.main_window.redraw_plots()
 
     def _update_isocurve(self) :
-        try :
-            self.iso = self.model.get_isocurve(self.z.get_value(), 
-                                               axisOrder='row-major')
-        except AttributeError :
+        if self.model is None :
             logger.debug('_update_isocurve(): no model found.')
             return
-        # Make sure the isocurveItem is above the plot and add it to the main 
-        # plot
-        self.iso.setZValue(10)
-        self.iso.setParentItem(self.main_window.main_plot.image_item)
+        z = self.z.get_value()
+        if self.model.n_args == 2 :
+            level = z if self.model_level is None else self.model_level
+            path = self.model.get_isocurve_path(level, **self.model_kwargs)
+        else :
+            path = self.model.get_isocurve_path(self.model_level, dim=2, 
+                                                value=self.axes[2][z], 
+                                                **self.model_kwargs)
+        self.iso = self._draw_path(self.iso, path, 
+                                   self.main_window.main_plot.image_item)
 
     def _update_model_cut(self) :
+        if self.model is None :
+            logger.debug('_update_model_cut(): no model found.')
+            return
+        self._remove_model_cut()
+        mw = self.main_window
+        if self.model.n_args == 2 :
+            model_cut = mw.cutline.get_array_region(self.model.data.T, 
+                                                    mw.main_plot.image_item,
+                                                    self.displayed_axes)
+            self.model_cut = mw.cut_plot.plot(model_cut, pen=self.model_pen)
+            return
+        # Evaluate the 3D model only at the points of the cut
+        coords = mw.cutline.get_coordinates(mw.main_plot.image_item)
+        x, y, z = [np.asarray(axis, dtype=float) for axis in self.model.axes]
+        x = np.interp(coords[0], np.arange(len(x)), x)
+        y = np.interp(coords[1], np.arange(len(y)), y)
+        model_cut = evaluate_model(self.model.model, 
+                                   [x[:,None], y[:,None], z[None,:]], 
+                                   self.model_kwargs, (len(x), len(z)))
+        self._model_cut_path = isocurve_path(model_cut, self.model_level, 
+                                             row_major=False)
+        self._draw_model_cut()
+
+    def _draw_model_cut(self) :
+        """ (Re)draw the isocurve of a 3D model along the cut. """
+        if self.model is None or self.model.n_args != 3 or \
+           self._model_cut_path is None :
+            return
+        self.model_cut = self._draw_path(self.model_cut, 
+                                         self._model_cut_path, 
+                                         self.main_window.cut_plot.image_item)
+
+    def _draw_path(self, item, path, image_item) :
+        """ Show the QPainterPath *path* on top of *image_item*. Reuse 
+        the QGraphicsPathItem *item* if it is still shown there and return 
+        the item that shows the path.
+        """
         try :
-            model_cut = self.main_window.cutline.get_array_region(
-                            self.model.data.T,
-                            self.main_window.main_plot.image_item,
-                            self.displayed_axes)
+            if item is not None and item.parentItem() is image_item :
+                item.setPath(path)
+                return item
+        except RuntimeError :
+            # Deleted together with the image it was drawn on
+            item = None
+        _remove_item(item)
+        item = QtWidgets.QGraphicsPathItem(path)
+        item.setPen(self.model_pen)
+        item.setZValue(10)
+        item.setParentItem(image_item)
+        return item
+
+    def _remove_model_cut(self) :
+        if isinstance(self.model_cut, QtWidgets.QGraphicsPathItem) :
+            _remove_item(self.model_cut)
+        elif self.model_cut is not None :
+            self.main_window.cut_plot.removeItem(self.model_cut)
+        self.model_cut = None
+        self._model_cut_path = None
+
+    def find_peaks(self, source='data', axis=None, overlay=True, **kwargs) :
+        """ Detect the peaks in all spectra of the selected *source* at once 
+        and optionally show them on top of the respective plot.
+        This wraps :func:`find_peaks <data_slicer.peaks.find_peaks>`, where 
+        more options are explained.
+
+        **Parameters**
+
+        =======  ===============================================================
+        source   str; one of ``'data'`` (the whole cube), ``'main'`` (the slice 
+                 in the main plot) or ``'cut'`` (the data in the cut plot).
+        axis     int; dimension along which the spectra run. Defaults to the z 
+                 dimension (2) for *data* and to the second dimension (1) 
+                 for *main* and *cut*.
+        overlay  bool; whether to display the found peaks with 
+                 :meth:`overlay_peaks 
+                 <data_slicer.pit.PITDataHandler.overlay_peaks>`.
+        kwargs   further keyword arguments are passed on to 
+                 :func:`find_peaks <data_slicer.peaks.find_peaks>`.
+        =======  ===============================================================
+
+        **Returns**
+
+        =====  =================================================================
+        peaks  structured np.array; see :func:`peak_dtype 
+               <data_slicer.peaks.peak_dtype>`.
+        =====  =================================================================
+        """
+        if source == 'data' :
+            data = self.get_data()
+            default_axis = 2
+        elif source == 'main' :
+            data = self.main_window.image_data
+            default_axis = 1
+        elif source == 'cut' :
+            data = self.cut_data
+            default_axis = 1
+        else :
+            raise ValueError('*source* should be one of ("data", "main", '
+                             '"cut").')
+        if axis is None :
+            axis = default_axis
+        peaks = find_peaks(data, axis=axis, **kwargs)
+        if overlay :
+            self.overlay_peaks(peaks, source=source, axis=axis)
+        return peaks
+
+    def fit_model(self, model, p0, source='data', axis=None, x=None, 
+                  show=False, **kwargs) :
+        """ Fit *model* to all spectra of the selected *source* at once. 
+        This wraps :func:`fit <data_slicer.fitting.fit>`, where more 
+        options are explained. Masked entries of the data are ignored.
+
+        **Parameters**
+
+        ======  ================================================================
+        model   :class:`Model <data_slicer.model.Model>`, function or 
+                expression with a single axis; the line shape.
+        p0      dict; the fitted parameters and their initial values.
+        source  str; one of ``'data'`` (the whole cube), ``'main'`` (the 
+                slice in the main plot) or ``'cut'`` (the data in the cut 
+                plot).
+        axis    int; dimension along which the spectra run. Defaults to the 
+                z dimension (2) for *data* and to the second dimension (1) 
+                for *main* and *cut*.
+        x       1d array-like; values along *axis*. Defaults to the 
+                respective axis of the data, or to pixels.
+        show    bool; whether to open the parameter maps in a new PIT window 
+                (see :meth:`FitResult.as_cube 
+                <data_slicer.fitting.FitResult.as_cube>`).
+        kwargs  further keyword arguments are passed on to :func:`fit 
+                <data_slicer.fitting.fit>`.
+        ======  ================================================================
+
+        **Returns**
+
+        ======  ================================================================
+        result  :class:`FitResult <data_slicer.fitting.FitResult>`
+        ======  ================================================================
+        """
+        if source == 'data' :
+            data = self.get_data()
+            if self.mask is not None :
+                data = MaskedData(data, self.mask, fill_value=np.nan)
+            default_axis = 2
+        elif source == 'main' :
+            data = self.main_window.image_data
+            default_axis = 1
+        elif source == 'cut' :
+            data = self.cut_data
+            default_axis = 1
+        else :
+            raise ValueError('*source* should be one of ("data", "main", '
+                             '"cut").')
+        if axis is None :
+            axis = default_axis
+        if x is None :
+            # The second dimension of the cut runs along z
+            dim = 2 if source == 'cut' and axis == 1 else axis
+            n = np.shape(data)[axis]
+            if source != 'cut' or axis == 1 :
+                x = self.axes[dim]
+            if x is None or len(x) != n :
+                x = np.arange(n)
+        result = fit(model, data, x=x, axis=axis, p0=p0, **kwargs)
+        if show :
+            window = MainWindow(data=result.as_cube())
+            window.setWindowTitle('{} - fit: {}'.format(
+                                  self.main_window.title, 
+                                  ', '.join(result.names)))
+            window.show()
+            self.fit_windows.append(window)
+        return result
+
+    def overlay_peaks(self, peaks, source='data', axis=2, size=5, 
+                      brush=(255, 0, 0, 200)) :
+        """ Display the result of :meth:`find_peaks 
+        <data_slicer.pit.PITDataHandler.find_peaks>` as markers. Peaks found 
+        in the cut are shown in the cut plot. Peaks found in the main slice 
+        or the whole cube are shown in the main plot, where in the latter 
+        case only the peaks that fall into the current z integration range 
+        are displayed (i.e. a band map at the current z).
+
+        **Parameters**
+
+        ======  ================================================================
+        peaks   structured np.array; peaks as returned by :func:`find_peaks 
+                <data_slicer.peaks.find_peaks>`.
+        source  str; one of ``'data'``, ``'main'`` or ``'cut'``; where the 
+                peaks were found.
+        axis    int; dimension along which the peaks were searched.
+        size    int; size of the markers in pixels.
+        brush   any argument accepted by :func:`mkBrush <pyqtgraph.mkBrush>`; 
+                fill of the markers.
+        ======  ================================================================
+        """
+        self.remove_peaks()
+        self.peaks = peaks
+        self._peak_indices = peak_indices(peaks, axis)
+        self._peaks_source = source
+        if source == 'cut' :
+            plot = self.main_window.cut_plot
+        else :
+            plot = self.main_window.main_plot
+        self.peaks_item = pg.ScatterPlotItem(size=size, pen=None, brush=brush)
+        self.peaks_item.setZValue(10)
+        self._peaks_plot = plot
+        plot.addItem(self.peaks_item)
+        self._update_peaks_overlay()
+
+        if source == 'data' :
+            self.z.sig_value_changed.connect(self._update_peaks_overlay)
+
+    def remove_peaks(self) :
+        """ Remove the markers created by :meth:`overlay_peaks 
+        <data_slicer.pit.PITDataHandler.overlay_peaks>`.
+        """
+        try :
+            self._peaks_plot.removeItem(self.peaks_item)
         except AttributeError :
-            logger.debug('_update_model_cut(): model or data not found.')
+            logger.debug('remove_peaks(): no peaks to remove found.')
             return
-        self.model_cut = self.main_window.cut_plot.plot(model_cut, 
-                                                        pen=self.iso.pen)
+        del self.peaks_item
+        try :
+            self.z.sig_value_changed.disconnect(self._update_peaks_overlay)
+        except TypeError as e :
+            logger.debug(e)
+
+    def _update_peaks_overlay(self) :
+        """ Place the peak markers at the pixel centers of the peaks, 
+        selecting the ones in the current integration range along z if 
+        necessary.
+        """
+        indices = self._peak_indices
+        if self._peaks_source == 'data' :
+            z = self.z.get_value()
+            integrate_z = \
+            int(self.main_window.integrated_plot.slider_width.get_value()/2)
+            indices = indices[np.abs(indices[:,2] - z) <= integrate_z]
+        x, y = self._peaks_plot.get_pixel_positions(indices[:,0], 
+                                                     indices[:,1])
+        self.peaks_item.setData(x=x, y=y)
 
 class MainWindow(QtWidgets.QMainWindow) :
     """ The main window of PIT. Defines the basic GUI layouts and 
@@ -557,9 +1570,18 @@ class MainWindow(QtWidgets.QMainWindow) :
         self.gamma = 1
         # Relative colormap maximum
         self.vmax = 1
+        # How data values are mapped to colors, one of cmaps.DISPLAY_MODES
+        self.display_mode = 'linear'
 
         # Need to store original transformation information for `rotate()`
         self._transform_factors = []
+        # Rectangle for the selection of a region in select_crop()
+        self.crop_roi = None
+        # Sliders of the dimensions beyond the third, see set_outer_sliders()
+        self.outer_plots = []
+
+        # Report whether the hot loops run compiled
+        logger.info('Kernel backend: {}'.format(kernels.backend_info()))
 
         self.data_handler = PITDataHandler(self)
 
@@ -630,6 +1652,7 @@ class MainWindow(QtWidgets.QMainWindow) :
         ip = CursorPlot(name='z selector')
         ip.register_traced_variable(self.data_handler.z)
         ip.change_width_enabled = True
+        ip.enable_playback()
         ip.slider_width.sig_value_changed.connect( \
             lambda : self.update_main_plot(emit=False))
         self.integrated_plot = ip
@@ -707,6 +1730,9 @@ class MainWindow(QtWidgets.QMainWindow) :
 
         nrows = 4*sd
         ncols = 5*sd
+        # Sliders for N dimensional data go below
+        self._n_rows = nrows
+        self._n_cols = ncols
         # Need to manually set all row- and columnspans as well as min-sizes
         for i in range(nrows) :
             l.setRowMinimumHeight(i, 50)
@@ -715,6 +1741,29 @@ class MainWindow(QtWidgets.QMainWindow) :
             l.setColumnMinimumWidth(i, 50)
             l.setColumnStretch(i, 1)
 
+    def set_outer_sliders(self) :
+        """ Create one slider below the other plots for every dimension of 
+        the data beyond the third (see :func:`PITDataHandler.set_outer_index 
+        <data_slicer.pit.PITDataHandler.set_outer_index>`).
+        """
+        for plot in self.outer_plots :
+            self.layout.removeWidget(plot)
+            plot.deleteLater()
+        self.outer_plots = []
+        dh = self.data_handler
+        for i, (outer, axis) in enumerate(zip(dh.outer, dh.outer_axes)) :
+            plot = CursorPlot(name='outer {}'.format(i), 
+                              orientation='vertical')
+            plot.register_traced_variable(outer)
+            plot.plotItem.vb.setMenuEnabled(False)
+            plot.on_allowed_values_change()
+            plot.set_secondary_axis(axis[0], axis[-1])
+            plot.enable_playback(fps=5)
+            row = self._n_rows + i
+            self.layout.addWidget(plot, row, 0, 1, self._n_cols)
+            self.layout.setRowMinimumHeight(row, 50)
+            self.outer_plots.append(plot)
+
     def _autoload_plugins(self) :
         """ Load all the plugins specified in the config file 
         ``CONF_DIR/plugins/autoload.txt``.
@@ -911,9 +1960,48 @@ class MainWindow(QtWidgets.QMainWindow) :
         """ Recalculate the lookup table and redraw the plots such that the 
         changes are immediately reflected.
         """
-        self.lut = self.cmap.getLookupTable()
+        self.update_lut()
         self.redraw_plots()
 
+    def update_lut(self) :
+        """ Build the lookup table from the colormap, the current display 
+        mode, *gamma* and *vmax*. This does not touch the data: the 
+        histogram needed for the 'equalize' mode is computed once per data 
+        change and cached (see :meth:`PITDataHandler.get_histogram 
+        <data_slicer.pit.PITDataHandler.get_histogram>`).
+        """
+        base_lut = self.cmap.getLookupTable()
+        dh = self.data_handler
+        mode = self.display_mode
+        histogram, levels = None, None
+        if dh.data is not None :
+            histogram = dh.get_histogram()
+            levels = dh.get_levels()
+        elif mode == 'equalize' :
+            # No data to equalize yet
+            mode = 'linear'
+        transfer = transfer_function(mode, levels=levels, 
+                                     histogram=histogram, gamma=self.gamma, 
+                                     vmax=self.vmax)
+        self.lut = make_lut(base_lut, transfer)
+
+    def set_display_mode(self, mode='linear') :
+        """ Change how data values are mapped to colors.
+
+        **Parameters**
+
+        ====  ==================================================================
+        mode  str; one of 'linear', 'log' (logarithmic) or 'equalize' 
+              (histogram equalization). See :func:`transfer_function 
+              <data_slicer.cmaps.transfer_function>`.
+        ====  ==================================================================
+        """
+        if mode not in DISPLAY_MODES :
+            raise ValueError('Unknown display mode "{}". Use one of '
+                             '{}.'.format(mode, DISPLAY_MODES))
+        self.display_mode = mode
+        self.cmap_changed()
+
     def transpose(self) :
         """ Transpose the main_plot, i.e. swap out its x- and y-axes. This 
         wraps the main_plot's :meth:`transpose 
@@ -921,9 +2009,63 @@ class MainWindow(QtWidgets.QMainWindow) :
         """
         self.main_plot.transpose()
 
-    def rotate(self, alpha=0) :
-        """ Rotate the main image by the given angle *alpha* (in degrees). """
-        self.main_plot.rotate(alpha)
+    def rotate(self, alpha=0, data=False) :
+        """ Rotate the main image by the given angle *alpha* (in degrees). 
+        By default, only the display is rotated. If *data* is *True*, rotate 
+        the data itself instead (see :func:`PITDataHandler.rotate 
+        <data_slicer.pit.PITDataHandler.rotate>`), such that cuts and 
+        profiles follow the rotation.
+        """
+        if data :
+            self.data_handler.rotate(alpha)
+        else :
+            self.main_plot.rotate(alpha)
+
+    def select_crop(self) :
+        """ Show a rectangle in the main plot which can be dragged and 
+        resized to select the region for :func:`crop 
+        <data_slicer.pit.MainWindow.crop>`.
+        """
+        if self.crop_roi is not None :
+            self.main_plot.removeItem(self.crop_roi)
+        [[x0, x1], [y0, y1]] = self.main_plot.getViewBox().viewRange()
+        self.crop_roi = pg.RectROI([x0 + (x1-x0)/4, y0 + (y1-y0)/4], 
+                                   [(x1-x0)/2, (y1-y0)/2], pen='y')
+        self.main_plot.addItem(self.crop_roi)
+
+    def get_crop_limits(self) :
+        """ Return the index ranges [(x_start, x_stop), (y_start, y_stop)] 
+        of the data covered by the rectangle of :func:`select_crop 
+        <data_slicer.pit.MainWindow.select_crop>`.
+        """
+        image = self.main_plot.image_item
+        rect = self.crop_roi.mapRectToItem(image, 
+                                           self.crop_roi.boundingRect())
+        limits = []
+        for dim, (lower, upper) in enumerate([(rect.left(), rect.right()), 
+                                              (rect.top(), rect.bottom())]) :
+            lower, upper = sorted([lower, upper])
+            start, stop = self.main_plot.display_to_index(
+                np.array([lower, upper]), dim)
+            # Ranges beyond the data are clipped by crop()
+            limits.append((max(0, int(np.floor(start))), 
+                           max(0, int(np.ceil(stop)))))
+        if self.main_plot.transposed.get_value() :
+            limits = limits[::-1]
+        return limits
+
+    def crop(self, zlim=None) :
+        """ Crop the data to the region selected with :func:`select_crop 
+        <data_slicer.pit.MainWindow.select_crop>` (if any) and the index 
+        range *zlim* along z. See :func:`PITDataHandler.crop 
+        <data_slicer.pit.PITDataHandler.crop>`.
+        """
+        xlim = ylim = None
+        if self.crop_roi is not None :
+            xlim, ylim = self.get_crop_limits()
+            self.main_plot.removeItem(self.crop_roi)
+            self.crop_roi = None
+        self.data_handler.crop(xlim, ylim, zlim)
 
     def keyPressEvent(self, event) :
         """ Define all responses to keyboard presses. 
@@ -934,6 +2076,8 @@ class MainWindow(QtWidgets.QMainWindow) :
         ===     ================================================================
         r       Flip orientation of cutline. Also useful to bring it back to 
                 visibility.
+        space   Start or stop playing through z (see 
+                :mod:`data_slicer.playback`).
         ===     ================================================================
         """
         key = event.key()
@@ -945,6 +2089,8 @@ class MainWindow(QtWidgets.QMainWindow) :
         # Flip Cutline on *R* key
         if key == QtCore.Qt.Key_R :
             self.cutline.flip_orientation()
+        elif key == QtCore.Qt.Key_Space :
+            self.integrated_plot.player.toggle()
         else :
             event.ignore()
             return
@@ -974,6 +2120,11 @@ class MainWindow(QtWidgets.QMainWindow) :
         self._transform_factors = []
         if image is None :
             image = self.image_data
+        # Use the precomputed levels for slices of the data to avoid 
+        # scanning the image
+        if image is self.image_data and 'levels' not in kwargs and \
+           self.data_handler.background_preview is None :
+            kwargs['levels'] = self.data_handler.get_levels(integrated=True)
         self.main_plot.set_image(image, *args, lut=self.lut, **kwargs)
 
     def update_cut(self) :
@@ -990,12 +2141,28 @@ class MainWindow(QtWidgets.QMainWindow) :
             cut = self.cutline.get_array_region(data, 
                                                 self.main_plot.image_item,
                                                 axes=axes)
+            mask = self.data_handler.mask
+            if mask is not None :
+                # Interpolating the mask gives the weight of valid entries 
+                # at every point of the cut
+                weights = self.cutline.get_array_region(
+                    MaskValues(mask), self.main_plot.image_item, axes=axes)
+                with np.errstate(divide='ignore', invalid='ignore') :
+                    cut = np.where(weights > 1e-6, cut / weights, np.nan)
         except Exception as e :
             logger.error(e)
             return
 
+        # Use the precomputed levels unless a preview changes the values
+        preview = self.data_handler.background_preview
+        kwargs = dict(lut=self.lut)
+        if preview is not None and preview['axis'] == 2 :
+            cut = subtract_background(cut, **dict(preview, axis=-1))
+        else :
+            kwargs['levels'] = self.data_handler.get_levels()
+
         self.data_handler.cut_data = cut
-        self.cut_plot.set_image(cut, lut=self.lut)
+        self.cut_plot.set_image(cut, **kwargs)
 
     def on_cutline_initialized(self) :
         """ Need to reconnect the signal to the cut_plot. And directly update 
@@ -1057,7 +2224,7 @@ class MainWindow(QtWidgets.QMainWindow) :
         """ Recalculate the lookup table and redraw the plots such that the 
         changes are immediately reflected.
         """
-        self.lut = self.cmap.getLookupTable()
+        self.update_lut()
         self.redraw_plots()
 
 # Set up argument parsing
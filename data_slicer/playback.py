@@ -0,0 +1,301 @@
+"""
+Animation of a :class:`TracedVariable <data_slicer.utilities.TracedVariable>`
+through its allowed values, e.g. to play through the slices of a cube.
+
+A :class:`Player <data_slicer.playback.Player>` advances the variable at a
+target frame rate. Frames are scheduled by the clock: if displaying a frame
+takes longer than a frame period, the following frames are skipped instead
+of falling behind. The achieved frame rate is reported through
+:attr:`Player.sig_fps_changed <data_slicer.playback.Player.sig_fps_changed>`.
+In PIT, the z selector (and every slider of further dimensions) has a play
+button, and the space bar starts and stops playing through z::
+
+    player = mw.integrated_plot.player
+    player.set_fps(50)
+    player.set_mode('pingpong')
+    player.set_range(100, 300)
+    player.play()
+"""
+import logging
+import time
+from collections import deque
+
+from pyqtgraph import Qt as qt
+
+from data_slicer.utilities import indexof
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+DEFAULT_FPS = 25
+
+# How the player continues at the end of its range
+MODES = ('loop', 'pingpong', 'once')
+
+# Time in seconds over which the achieved frame rate is averaged
+FPS_WINDOW = 1.
+
+#_Functions_____________________________________________________________________
+
+def advance(index, n, start, stop, direction=1, mode='loop') :
+    """
+    Move *n* steps from *index* in *direction* within the index range
+    ``[start, stop]`` (both inclusive).
+
+    **Parameters**
+
+    =========  =================================================================
+    index      int; current index.
+    n          int; number of steps.
+    start      int; first index of the range.
+    stop       int; last index of the range.
+    direction  int, 1 or -1; current direction.
+    mode       str; one of :const:`MODES <data_slicer.playback.MODES>`:
+               'loop' jumps back to *start* after *stop*, 'pingpong' reverses
+               the direction at either end and 'once' stops at the end.
+    =========  =================================================================
+
+    **Returns**
+
+    =========  =================================================================
+    index      int; the new index.
+    direction  int; the new direction.
+    finished   bool; whether the end was reached in 'once' mode.
+    =========  =================================================================
+    """
+    if mode not in MODES :
+        raise ValueError('Unknown mode "{}". Use one of {}.'.format(mode,
+                                                                    MODES))
+    length = stop - start + 1
+    # Indices outside of the range (e.g. after changing it) start over
+    if not start <= index <= stop :
+        return (start if direction > 0 else stop), direction, False
+    if length <= 1 :
+        return start, direction, mode == 'once'
+    position = index - start + n*direction
+    if mode == 'loop' :
+        return start + position % length, direction, False
+    elif mode == 'once' :
+        if 0 <= position < length :
+            return start + position, direction, False
+        return (stop if direction > 0 else start), direction, True
+    # Ping-pong: unfold the back and forth movement into a period of
+    # 2*(length-1) steps
+    period = 2*(length - 1)
+    position %= period
+    if position < length :
+        # Moving in the original direction
+        return start + position, direction, False
+    return start + period - position, -direction, False
+
+#_Classes_______________________________________________________________________
+
+class Player(qt.QtCore.QObject) :
+    """
+    Animate the :class:`TracedVariable
+    <data_slicer.utilities.TracedVariable>` *traced_variable* by stepping
+    through its allowed values at *fps* frames per second.
+
+    **Attributes**
+
+    =================  =========================================================
+    sig_fps_changed    :class:`Signal <pyqtgraph.Qt.QtCore.Signal>`; emitted
+                       with the achieved frame rate after every frame.
+    sig_state_changed  :class:`Signal <pyqtgraph.Qt.QtCore.Signal>`; emitted
+                       with *True* when playing starts and *False* when it
+                       stops.
+    fps                float; target frame rate.
+    mode               str; one of :const:`MODES <data_slicer.playback.MODES>`.
+    value_range        tuple of two values or *None*; limits of the values
+                       to play through. *None* plays through all of them.
+    achieved_fps       float; frame rate over the last :const:`FPS_WINDOW
+                       <data_slicer.playback.FPS_WINDOW>` seconds.
+    dropped            int; number of frames skipped since playing started.
+    =================  =========================================================
+    """
+    sig_fps_changed = qt.QtCore.Signal(float)
+    sig_state_changed = qt.QtCore.Signal(bool)
+
+    def __init__(self, traced_variable, fps=DEFAULT_FPS, mode='loop') :
+        super().__init__()
+        self.traced_variable = traced_variable
+        self.fps = float(fps)
+        self.set_mode(mode)
+        self.value_range = None
+        self.achieved_fps = 0.
+        self.dropped = 0
+        self._direction = 1
+        self._times = deque()
+        self.timer = qt.QtCore.QTimer()
+        self.timer.setTimerType(qt.QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.on_timeout)
+
+    def __repr__(self) :
+        return '<Player({}, {} fps, {})>'.format(self.traced_variable.name,
+                                                 self.fps, self.mode)
+
+    @property
+    def is_playing(self) :
+        return self.timer.isActive()
+
+    def set_fps(self, fps) :
+        """ Change the target frame rate. """
+        if fps <= 0 :
+            raise ValueError('fps needs to be positive.')
+        self.fps = float(fps)
+        if self.is_playing :
+            # Restart the schedule at the new rate
+            self.play()
+
+    def set_mode(self, mode) :
+        """ Set what happens at the end of the range, see :func:`advance
+        <data_slicer.playback.advance>`.
+        """
+        if mode not in MODES :
+            raise ValueError('Unknown mode "{}". Use one of {}.'.format(
+                             mode, MODES))
+        self.mode = mode
+
+    def set_range(self, start=None, stop=None) :
+        """ Only play through the values from *start* to *stop* (both
+        inclusive). Without arguments, all values are played through.
+        """
+        if start is None and stop is None :
+            self.value_range = None
+        else :
+            self.value_range = (start, stop)
+
+    def get_index_range(self) :
+        """ Return the range of indices into the allowed values of the
+        traced variable to play through.
+        """
+        values = self.traced_variable.allowed_values
+        n = len(values)
+        if self.value_range is None :
+            return 0, n - 1
+        start, stop = self.value_range
+        first = 0 if start is None else indexof(start, values)
+        last = n - 1 if stop is None else indexof(stop, values)
+        return int(min(first, last)), int(max(first, last))
+
+    def play(self) :
+        """ Start playing from the current value. """
+        if self.traced_variable.allowed_values is None :
+            logger.warning('Cannot play {} without allowed values.'.format(
+                           self.traced_variable.name))
+            return
+        was_playing = self.is_playing
+        self._t0 = time.perf_counter()
+        self._frame = 0
+        self.dropped = 0
+        self._times.clear()
+        # Check the clock twice per frame, so frames are at most half a
+        # period late
+        self.timer.start(max(1, int(500 / self.fps)))
+        if not was_playing :
+            self.sig_state_changed.emit(True)
+
+    def stop(self) :
+        """ Stop playing. """
+        if self.is_playing :
+            self.timer.stop()
+            self.sig_state_changed.emit(False)
+
+    def toggle(self) :
+        """ Start playing if stopped and stop if playing. """
+        if self.is_playing :
+            self.stop()
+        else :
+            self.play()
+
+    def on_timeout(self) :
+        """ Show the frame that is due according to the clock, skipping the
+        ones that could not be shown in time.
+        """
+        now = time.perf_counter()
+        due = int((now - self._t0) * self.fps)
+        n = due - self._frame
+        if n <= 0 :
+            return
+        self._frame = due
+        self.dropped += n - 1
+        self.step(n)
+        self._update_fps(time.perf_counter())
+
+    def step(self, n=1) :
+        """ Advance the traced variable by *n* steps. """
+        values = self.traced_variable.allowed_values
+        if values is None or len(values) == 0 :
+            self.stop()
+            return
+        start, stop = self.get_index_range()
+        index = indexof(self.traced_variable.get_value(), values)
+        index, self._direction, finished = advance(
+            int(index), n, start, stop, self._direction, self.mode)
+        self.traced_variable.set_value(values[index])
+        if finished :
+            self.stop()
+
+    def _update_fps(self, now) :
+        times = self._times
+        times.append(now)
+        while now - times[0] > FPS_WINDOW :
+            times.popleft()
+        if len(times) > 1 :
+            self.achieved_fps = (len(times) - 1) / (times[-1] - times[0])
+        self.sig_fps_changed.emit(self.achieved_fps)
+
+class PlayerControls(qt.QtWidgets.QWidget) :
+    """
+    Small overlay with a play/pause button and a label showing the achieved
+    frame rate of *player*. The button's menu selects the target frame
+    rate and the mode.
+    """
+    fps_choices = (5, 10, 25, 50, 100)
+
+    def __init__(self, player, parent=None) :
+        super().__init__(parent)
+        self.player = player
+        layout = qt.QtWidgets.QHBoxLayout()
+        layout.setContentsMargins(2, 2, 2, 2)
+        self.setLayout(layout)
+
+        self.button = qt.QtWidgets.QToolButton()
+        self.button.setAutoRaise(True)
+        self.button.setPopupMode(qt.QtWidgets.QToolButton.MenuButtonPopup)
+        self.button.clicked.connect(player.toggle)
+        layout.addWidget(self.button)
+        self.label = qt.QtWidgets.QLabel()
+        layout.addWidget(self.label)
+
+        menu = qt.QtWidgets.QMenu(self.button)
+        for group, choices, current, setter in [
+            ('fps', self.fps_choices, player.fps, player.set_fps),
+            ('mode', MODES, player.mode, player.set_mode)] :
+            actions = qt.QtWidgets.QActionGroup(menu) \
+                      if hasattr(qt.QtWidgets, 'QActionGroup') \
+                      else qt.QtGui.QActionGroup(menu)
+            for choice in choices :
+                text = '{} fps'.format(choice) if group == 'fps' else choice
+                action = menu.addAction(text)
+                action.setCheckable(True)
+                action.setChecked(choice == current)
+                action.triggered.connect(
+                    lambda checked, c=choice, s=setter : s(c))
+                actions.addAction(action)
+            menu.addSeparator()
+        self.button.setMenu(menu)
+
+        player.sig_state_changed.connect(self.on_state_change)
+        player.sig_fps_changed.connect(self.on_fps_change)
+        self.on_state_change(False)
+
+    def on_state_change(self, playing) :
+        self.button.setText('❚❚' if playing else '▶')
+        self.button.setToolTip('Pause' if playing else 'Play')
+        if not playing :
+            self.label.setText('')
+
+    def on_fps_change(self, fps) :
+        self.label.setText('{:.1f} fps'.format(fps))
@@ -0,0 +1,217 @@
+"""
+Predictive computation of the slices that are about to be displayed.
+
+A :class:`SlicePrefetcher <data_slicer.prefetch.SlicePrefetcher>` keeps the
+(possibly integrated and masked) slices of a dataset along z in a memory
+limited cache. Whenever a slice is requested, it looks at the direction and
+speed of the recent requests and computes the slices that are likely to
+follow in a background thread. When stepping through z with the arrow keys
+or during playback, the slices are then usually ready before they are
+needed and only have to be drawn::
+
+    prefetcher = SlicePrefetcher()
+    image = prefetcher.get_slice(data, z=10, key=generation)
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from data_slicer.caching import LRUCache
+from data_slicer.masking import masked_slice
+from data_slicer.utilities import make_slice
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Memory budget of the slice cache of every SlicePrefetcher
+CACHE_BYTES = 2**28
+
+# Maximum number of slices that are computed ahead
+MAX_AHEAD = 8
+
+# Time in seconds for which slices are computed ahead at the current speed
+LOOKAHEAD = 0.5
+
+# Steps along z that are larger than this are considered jumps, after which
+# nothing is prefetched
+MAX_STEP = 8
+
+#_Functions_____________________________________________________________________
+
+def compute_slice(data, z, integrate=0, mask=None) :
+    """ Return the slice of *data* at *z* along its last dimension,
+    integrated over +- *integrate* slices and rescaled according to *mask*
+    (see :func:`masked_slice <data_slicer.masking.masked_slice>`) if one is
+    given.
+    """
+    dim = len(data.shape) - 1
+    if mask is None :
+        return make_slice(data, dim=dim, index=z, integrate=integrate,
+                          silent=True)
+    return masked_slice(data, mask, dim=dim, index=z, integrate=integrate)
+
+#_Classes_______________________________________________________________________
+
+class SlicePrefetcher() :
+    """
+    Cache of slices along the last dimension of a dataset that computes the
+    slices ahead of the current one in a worker thread.
+
+    **Parameters**
+
+    =========  =================================================================
+    cache      :class:`LRUCache <data_slicer.caching.LRUCache>`; where the
+               slices are stored. Defaults to a new cache limited to
+               :const:`CACHE_BYTES <data_slicer.prefetch.CACHE_BYTES>`.
+    max_ahead  int; maximum number of slices that are computed ahead.
+    lookahead  float; time in seconds for which slices are computed ahead
+               at the current speed of the requests.
+    =========  =================================================================
+    """
+    def __init__(self, cache=None, max_ahead=MAX_AHEAD, lookahead=LOOKAHEAD) :
+        self.cache = LRUCache(max_bytes=CACHE_BYTES) if cache is None \
+                     else cache
+        self.max_ahead = max_ahead
+        self.lookahead = lookahead
+        # Slices that are being computed in the worker, keyed like the cache
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # Last requested z, the time of that request and the smoothed
+        # number of steps per second
+        self._last = None
+        self._speed = 0.
+
+    def __repr__(self) :
+        return '<SlicePrefetcher: {} slices cached, {} pending>'.format(
+                len(self.cache), len(self._pending))
+
+    def get_slice(self, data, z, integrate=0, mask=None, key=None) :
+        """
+        Return the slice of *data* at *z* (see :func:`compute_slice
+        <data_slicer.prefetch.compute_slice>`) from the cache, computing
+        it if necessary, and start computing the slices that are expected
+        to be requested next.
+
+        **Parameters**
+
+        =========  =============================================================
+        data       array-like; the data, sliced along its last dimension.
+        z          int; index of the slice.
+        integrate  int; number of slices to integrate over on either side.
+        mask       :class:`Mask <data_slicer.masking.Mask>` or *None*.
+        key        hashable; identifies the state of *data* and *mask*
+                   (e.g. a counter that changes with the data). If *None*,
+                   nothing is cached or prefetched.
+        =========  =============================================================
+        """
+        if key is None :
+            return compute_slice(data, z, integrate, mask)
+        z = int(z)
+        image = self._lookup((key, z, integrate))
+        if image is None :
+            image = compute_slice(data, z, integrate, mask)
+            self.cache.put((key, z, integrate), image)
+        self._prefetch(self._predict(z, data.shape[-1]), data, integrate,
+                       mask, key)
+        return image
+
+    def _lookup(self, cache_key) :
+        """ Return the cached slice, waiting for it if it is being computed.
+        """
+        image = self.cache.get(cache_key)
+        if image is not None :
+            return image
+        with self._lock :
+            future = self._pending.get(cache_key)
+        if future is not None and not future.cancelled() :
+            try :
+                return future.result()
+            except Exception :
+                pass
+        return None
+
+    def _predict(self, z, n) :
+        """ Update the estimate of the direction and speed of the requests
+        with a request of *z* and return the indices that will probably be
+        requested next (within ``[0, n)``).
+        """
+        now = time.perf_counter()
+        last = self._last
+        self._last = (z, now)
+        if last is None :
+            return []
+        step = z - last[0]
+        dt = now - last[1]
+        if step == 0 or abs(step) > MAX_STEP or dt <= 0 :
+            self._speed = 0.
+            return []
+        # Smooth the speed, as the requests arrive irregularly
+        speed = abs(step) / dt
+        self._speed = speed if not self._speed else \
+                      0.5*self._speed + 0.5*speed
+        n_ahead = int(np.clip(np.ceil(self._speed*self.lookahead /
+                                      abs(step)), 1, self.max_ahead))
+        targets = [z + k*step for k in range(1, n_ahead+1)]
+        return [target for target in targets if 0 <= target < n]
+
+    def _prefetch(self, targets, data, integrate, mask, key) :
+        """ Compute the slices at *targets* in the worker thread, in order,
+        and cancel the pending computations of other slices.
+        """
+        keys = [(key, z, integrate) for z in targets]
+        with self._lock :
+            for cache_key in list(self._pending) :
+                if cache_key not in keys :
+                    self._pending.pop(cache_key).cancel()
+            for cache_key, z in zip(keys, targets) :
+                if cache_key in self._pending or cache_key in self.cache :
+                    continue
+                future = self._executor.submit(self._compute, cache_key,
+                                               data, z, integrate, mask)
+                self._pending[cache_key] = future
+
+    def _compute(self, cache_key, data, z, integrate, mask) :
+        """ Worker: compute a slice and move it to the cache. """
+        try :
+            image = compute_slice(data, z, integrate, mask)
+            self.cache.put(cache_key, image)
+            return image
+        except Exception as e :
+            logger.debug('Prefetching slice {} failed: {}'.format(z, e))
+            raise
+        finally :
+            with self._lock :
+                self._pending.pop(cache_key, None)
+
+    def wait(self) :
+        """ Block until all pending slices have been computed. """
+        with self._lock :
+            futures = list(self._pending.values())
+        self._wait_for(futures)
+
+    def _wait_for(self, futures) :
+        for future in futures :
+            if future.cancelled() :
+                continue
+            try :
+                future.result()
+            except Exception :
+                pass
+
+    def invalidate(self) :
+        """ Discard all cached and pending slices, e.g. after the data has
+        been modified in place.
+        """
+        with self._lock :
+            futures = list(self._pending.values())
+            self._pending.clear()
+        for future in futures :
+            future.cancel()
+        # A running computation might still store its (outdated) slice
+        self._wait_for(futures)
+        self.cache.clear()
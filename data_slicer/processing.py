@@ -0,0 +1,310 @@
+"""
+Preprocessing steps that are applied to every spectrum of a dataset, like
+normalization and background subtraction. They are vectorized over all
+spectra and work on np.arrays as well as on :class:`LazyArrays
+<data_slicer.lazy.LazyArray>`.
+"""
+import logging
+
+import numpy as np
+
+from data_slicer import dtypes
+from data_slicer.kernels import get_kernel, register
+from data_slicer.lazy import LazyArray
+from data_slicer.utilities import map_chunks
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+NORMALIZATION_MODES = ('max', 'area', 'region')
+BACKGROUND_MODES = ('constant', 'linear', 'shirley')
+
+# Default number of spectra that are processed together in 
+# subtract_background()
+CHUNK_SIZE = 4096
+
+#_Classes_______________________________________________________________________
+
+class NormalizedData(LazyArray) :
+    """ Lazy view of *data* divided by *factors* (an array that broadcasts
+    against *data*, as returned by :func:`normalization_factors
+    <data_slicer.processing.normalization_factors>`). The result has the
+    floating point type given by the current :class:`DtypePolicy
+    <data_slicer.dtypes.DtypePolicy>`.
+    """
+    def __init__(self, data, factors) :
+        self.data = data
+        self.factors = factors
+        super().__init__(data.shape, dtypes.policy.float_dtype(data.dtype))
+
+    def _compute(self, region) :
+        # Select the factors that belong to the region, taking care of the
+        # dimensions that have length 1
+        factor_region = tuple(r if n > 1 else slice(None)
+                              for r, n in zip(region, self.factors.shape))
+        block = np.asarray(self.data[region], dtype=self.dtype)
+        block = block / self.factors[factor_region]
+        return block.astype(self.dtype, copy=False)
+
+#_Functions_____________________________________________________________________
+
+def _as_axes(axis, ndim) :
+    """ Return *axis* (int or tuple of int) as a sorted tuple of positive
+    dimensions.
+    """
+    if isinstance(axis, (int, np.integer)) :
+        axis = (axis,)
+    return tuple(sorted(int(a) % ndim for a in axis))
+
+def _reduce(data, ufunc, axes) :
+    """ Apply the reduction of *ufunc* over *axes* and keep the reduced
+    dimensions with length 1, such that the result broadcasts against
+    *data*. Lazy arrays are reduced blockwise.
+    """
+    if isinstance(data, LazyArray) :
+        result = data.reduce(ufunc, axis=axes)
+    else :
+        result = ufunc.reduce(np.asarray(data), axis=axes)
+    return np.expand_dims(result, axes)
+
+def normalization_factors(data, axis=2, mode='max', region=None) :
+    """
+    Calculate the factors by which every spectrum in *data* has to be
+    divided to normalize it. Only one small array of factors is created,
+    with the same dimensionality as *data* but length 1 along *axis*.
+
+    **Parameters**
+
+    ======  ====================================================================
+    data    array-like; N dimensional dataset.
+    axis    int or tuple of int; dimension(s) along which the spectra run. For
+            example, ``axis=2`` normalizes every spectrum along z while
+            ``axis=(0, 1)`` normalizes every xy slice as a whole.
+    mode    str; one of 'max' (divide by the maximum), 'area' (by the sum)
+            or 'region' (by the mean over *region*).
+    region  tuple (start, stop); index range along *axis* (which needs to be
+            a single dimension) to use in 'region' mode.
+    ======  ====================================================================
+
+    **Returns**
+
+    =======  ===================================================================
+    factors  np.array; the factors, shaped such that they broadcast against
+             *data*. Zero and non-finite factors are replaced by 1.
+    =======  ===================================================================
+    """
+    axes = _as_axes(axis, len(data.shape))
+    if mode == 'max' :
+        # fmax ignores NaNs
+        factors = _reduce(data, np.fmax, axes)
+    elif mode == 'area' :
+        factors = _reduce(data, np.add, axes)
+    elif mode == 'region' :
+        if region is None or len(axes) != 1 :
+            raise ValueError('*region* mode requires a *region* and a single '
+                             '*axis*.')
+        start, stop = region
+        key = len(data.shape)*[slice(None)]
+        key[axes[0]] = slice(start, stop)
+        selected = np.asarray(data[tuple(key)])
+        factors = selected.mean(axis=axes, keepdims=True)
+    else :
+        raise ValueError('Unknown normalization mode "{}". Use one of '
+                         '{}.'.format(mode, NORMALIZATION_MODES))
+    factors = np.asarray(factors, dtype=float)
+    factors[(factors == 0) | ~np.isfinite(factors)] = 1
+    return factors
+
+def normalize(data, axis=2, mode='max', region=None, in_place=False) :
+    """
+    Normalize every spectrum along *axis* of *data*. See
+    :func:`normalization_factors
+    <data_slicer.processing.normalization_factors>` for the arguments.
+
+    If *in_place* is *True*, *data* (which needs to be a np.array of
+    floating point type) is divided by the factors in place. Otherwise a
+    :class:`NormalizedData <data_slicer.processing.NormalizedData>` is
+    returned, which applies the factors only to the parts of the data that
+    are accessed. In neither case is a temporary of the size of *data*
+    created.
+    """
+    factors = normalization_factors(data, axis=axis, mode=mode,
+                                     region=region)
+    if in_place :
+        if not isinstance(data, np.ndarray) or \
+           not np.issubdtype(data.dtype, np.floating) :
+            raise TypeError('In place normalization requires a np.array of '
+                            'floating point type.')
+        data /= factors
+        return data
+    return NormalizedData(data, factors)
+
+def _edge_values(spectra, n_edge) :
+    """ Return the mean of the first and of the last *n_edge* channels of 
+    every row in *spectra*.
+    """
+    n_edge = max(1, min(n_edge, spectra.shape[1]))
+    return spectra[:,:n_edge].mean(axis=1), spectra[:,-n_edge:].mean(axis=1)
+
+@register('shirley_background')
+def shirley_background(spectra, n_edge=5, max_iter=50, tol=1e-6) :
+    """
+    Calculate the Shirley background of all rows of *spectra* at once. The 
+    background at channel *i* is 
+
+        ``B(i) = I_end + (I_start - I_end) * A(i) / A(0)``
+
+    where ``A(i)`` is the area between the spectrum and the background from 
+    *i* to the end of the spectrum and ``I_start`` and ``I_end`` are the 
+    averages over *n_edge* channels at either end. This is iterated until 
+    the background changes by less than *tol* (relative to the step 
+    ``I_start - I_end``) in every spectrum. Converged spectra are excluded 
+    from further iterations.
+    :func:`background_of_spectra 
+    <data_slicer.processing.background_of_spectra>` uses the compiled 
+    version of this kernel if numba is installed (see 
+    :mod:`data_slicer.kernels`).
+
+    **Parameters**
+
+    ========  ==================================================================
+    spectra   2d np.array of shape (n_spectra, n); one spectrum per row.
+    n_edge    int; number of channels at each end used to determine the 
+              end points.
+    max_iter  int; maximum number of iterations.
+    tol       float; convergence criterion.
+    ========  ==================================================================
+
+    **Returns**
+
+    ==========  ================================================================
+    background  np.array of the same shape as *spectra*.
+    ==========  ================================================================
+    """
+    spectra = np.asarray(spectra, dtype=float)
+    start, end = _edge_values(spectra, n_edge)
+    step = (start - end)[:,None]
+    background = np.repeat(end[:,None], spectra.shape[1], axis=1)
+    scale = np.abs(step[:,0])
+    scale[scale == 0] = 1
+    active = np.arange(len(spectra))
+    for i in range(max_iter) :
+        if not active.size :
+            break
+        signal = spectra[active] - background[active]
+        # Area from every channel to the end of the spectrum
+        area = np.cumsum(signal[:,::-1], axis=1)[:,::-1]
+        total = area[:,:1].copy()
+        total[total == 0] = 1
+        # The ratio is bounded by [0, 1] for physical spectra; clipping 
+        # keeps spectra without a clear step (e.g. pure noise) from diverging
+        ratio = np.clip(area / total, 0, 1)
+        new = end[active,None] + step[active] * ratio
+        change = np.abs(new - background[active]).max(axis=1)
+        background[active] = new
+        active = active[change > tol*scale[active]]
+    if active.size :
+        logger.warning(('shirley_background(): {} spectra did not converge '
+                        'within {} iterations.').format(active.size, 
+                                                        max_iter))
+    return background
+
+def background_of_spectra(spectra, mode='shirley', n_edge=5, region=None, 
+                          **kwargs) :
+    """
+    Calculate the background of all rows of the 2d array *spectra* 
+    according to *mode*.
+
+    **Parameters**
+
+    ========  ==================================================================
+    spectra   2d np.array of shape (n_spectra, n); one spectrum per row.
+    mode      str; 'constant' (mean over *region* or, if *region* is 
+              *None*, the minimum of each spectrum), 'linear' (straight 
+              line between the averages over *n_edge* channels at either 
+              end) or 'shirley' (see :func:`shirley_background 
+              <data_slicer.processing.shirley_background>`).
+    n_edge    int; number of channels at each end used by 'linear' and 
+              'shirley'.
+    region    tuple (start, stop); index range used by 'constant'.
+    (kwargs)  passed on to :func:`shirley_background 
+              <data_slicer.processing.shirley_background>`.
+    ========  ==================================================================
+    """
+    spectra = np.asarray(spectra, dtype=float)
+    n = spectra.shape[1]
+    if mode == 'constant' :
+        if region is None :
+            level = np.nanmin(spectra, axis=1)
+        else :
+            level = spectra[:,region[0]:region[1]].mean(axis=1)
+        return np.repeat(level[:,None], n, axis=1)
+    elif mode == 'linear' :
+        start, end = _edge_values(spectra, n_edge)
+        t = np.linspace(0, 1, n)
+        return start[:,None] + (end - start)[:,None]*t[None,:]
+    elif mode == 'shirley' :
+        return get_kernel('shirley_background')(spectra, n_edge=n_edge, 
+                                                **kwargs)
+    else :
+        raise ValueError('Unknown background mode "{}". Use one of '
+                         '{}.'.format(mode, BACKGROUND_MODES))
+
+def subtract_background(data, axis=2, mode='shirley', chunk_size=CHUNK_SIZE, 
+                        n_workers=None, **kwargs) :
+    """
+    Subtract the background from every spectrum along *axis* of *data*. 
+    The computation is vectorized over all spectra in a chunk and the 
+    chunks are distributed over a pool of threads.
+
+    **Parameters**
+
+    ==========  ================================================================
+    data        array-like; N dimensional dataset.
+    axis        int; dimension along which the spectra run.
+    mode        str; one of :const:`BACKGROUND_MODES 
+                <data_slicer.processing.BACKGROUND_MODES>`. See 
+                :func:`background_of_spectra 
+                <data_slicer.processing.background_of_spectra>`.
+    chunk_size  int; approximate number of spectra processed at once.
+    n_workers   int; number of threads.
+    (kwargs)    passed on to :func:`background_of_spectra 
+                <data_slicer.processing.background_of_spectra>`.
+    ==========  ================================================================
+
+    **Returns**
+
+    ======  ====================================================================
+    result  np.array of the same shape as *data*; the data minus its 
+            background, in the floating point type of the current 
+            :class:`DtypePolicy <data_slicer.dtypes.DtypePolicy>`.
+    ======  ====================================================================
+    """
+    ndim = len(data.shape)
+    axis = axis % ndim
+    # Bring the spectrum axis to the end (works for lazy arrays as well)
+    order = [d for d in range(ndim) if d != axis] + [axis]
+    moved = data.transpose(order)
+    shape = moved.shape
+    n = shape[-1]
+    result = np.empty(shape, dtype=dtypes.policy.float_dtype(data.dtype))
+    if 0 in shape :
+        return np.moveaxis(result, -1, axis)
+    # Treat a single spectrum like a set of one spectrum
+    if ndim == 1 :
+        result = result[np.newaxis]
+        moved = np.asarray(moved)[np.newaxis]
+    per_index = int(np.prod(result.shape[1:-1]))
+
+    def process(chunk) :
+        spectra = np.asarray(moved[chunk], dtype=float).reshape(-1, n)
+        background = background_of_spectra(spectra, mode=mode, **kwargs)
+        result[chunk] = (spectra - background).reshape(result[chunk].shape)
+
+    chunk_length = max(1, chunk_size // per_index)
+    map_chunks(process, result.shape[0], chunk_size=chunk_length, 
+               n_workers=n_workers)
+    if ndim == 1 :
+        return result[0]
+    return np.moveaxis(result, -1, axis)
@@ -0,0 +1,473 @@
+"""
+Remapping of data onto new coordinate grids, e.g. the conversion from
+angles to momenta or any other (nonlinear) regridding.
+
+The geometry of such a remapping is the same for every slice of a dataset.
+It is therefore captured once in a sparse :class:`InterpolationMatrix
+<data_slicer.remapping.InterpolationMatrix>`, which is cached in memory and
+on disk. Remapping a slice is then a sparse matrix-vector product and
+remapping the whole cube a single sparse matrix-matrix product.
+"""
+import logging
+
+import numpy as np
+
+from data_slicer.caching import CACHE_DIR, DiskCache, LRUCache, \
+                                function_token, hash_key
+from data_slicer.lazy import LazyArray
+from data_slicer.utilities import map_chunks
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Number of target pixels that are processed at once in InterpolationMatrix
+# .apply()
+CHUNK_SIZE = 2**16
+
+# Maximum factor by which a non-uniform axis is oversampled for display
+MAX_OVERSAMPLING = 8
+
+# Caches for interpolation matrices. Increase CACHE_VERSION whenever the 
+# construction of the matrices changes, to invalidate old files on disk
+CACHE_VERSION = 1
+memory_cache = LRUCache(max_items=16)
+disk_cache = DiskCache(CACHE_DIR / 'remapping', version=CACHE_VERSION)
+# Cache for the index maps used to display data with non-uniform axes
+index_map_cache = LRUCache(max_items=32)
+
+#_Classes_______________________________________________________________________
+
+class InterpolationMatrix() :
+    """
+    Sparse matrix describing a bilinear interpolation from a 2d source grid
+    of shape *source_shape* onto *n_target* target points. It is stored
+    in ELLPACK format: every row (target point) has exactly four entries,
+    the weights of the four source pixels surrounding it.
+
+    **Attributes**
+
+    ============  ==============================================================
+    indices       int array of shape (n_target, 4); flat indices into the
+                  source grid.
+    weights       float array of shape (n_target, 4); interpolation weights.
+    valid         bool array of shape (n_target,); *False* for target points
+                  outside of the source grid.
+    source_shape  tuple (nx, ny); shape of the source grid.
+    target_shape  tuple (nu, nv); shape of the target grid.
+    ============  ==============================================================
+    """
+    def __init__(self, indices, weights, valid, source_shape, target_shape) :
+        self.indices = indices
+        self.weights = weights
+        self.valid = valid
+        self.source_shape = tuple(int(n) for n in source_shape)
+        self.target_shape = tuple(int(n) for n in target_shape)
+
+    def __repr__(self) :
+        return '<InterpolationMatrix {} -> {}>'.format(self.source_shape,
+                                                       self.target_shape)
+
+    @property
+    def nbytes(self) :
+        return self.indices.nbytes + self.weights.nbytes + self.valid.nbytes
+
+    def to_arrays(self) :
+        """ Return a dictionary of np.arrays from which this matrix can be
+        restored with :meth:`from_arrays
+        <data_slicer.remapping.InterpolationMatrix.from_arrays>`.
+        """
+        return dict(indices=self.indices, weights=self.weights,
+                    valid=self.valid, source_shape=np.array(self.source_shape),
+                    target_shape=np.array(self.target_shape))
+
+    @classmethod
+    def from_arrays(cls, arrays) :
+        """ Inverse of :meth:`to_arrays
+        <data_slicer.remapping.InterpolationMatrix.to_arrays>`.
+        """
+        return cls(arrays['indices'], arrays['weights'], arrays['valid'],
+                   arrays['source_shape'], arrays['target_shape'])
+
+    def to_scipy(self) :
+        """ Return this matrix as a :class:`scipy.sparse.csr_matrix` of
+        shape (n_target, n_source). Requires scipy.
+        """
+        from scipy.sparse import csr_matrix
+        n_target = len(self.indices)
+        indptr = np.arange(0, 4*n_target+1, 4)
+        return csr_matrix((self.weights.ravel(), self.indices.ravel(),
+                           indptr),
+                          shape=(n_target, int(np.prod(self.source_shape))))
+
+    def target_rows(self, region=None) :
+        """ Return the flat indices of the target points in *region*, a
+        tuple of two slices into the target grid.
+        """
+        if region is None :
+            return None
+        nu, nv = self.target_shape
+        u = np.arange(nu)[region[0]]
+        v = np.arange(nv)[region[1]]
+        return (u[:,None]*nv + v[None,:]).ravel()
+
+    def apply(self, data, region=None, fill_value=0, n_workers=None) :
+        """
+        Remap *data* onto the target grid.
+
+        **Parameters**
+
+        ==========  ============================================================
+        data        array of shape ``source_shape + rest``; the first two
+                    dimensions are remapped, all others (e.g. the z
+                    dimension of a cube) are carried along.
+        region      tuple of two slices; if given, only this part of the
+                    target grid is computed.
+        fill_value  number; value assigned to target points outside the
+                    source grid.
+        n_workers   int; number of threads among which the target points are
+                    distributed.
+        ==========  ============================================================
+
+        **Returns**
+
+        ======  ================================================================
+        result  np.array of shape ``target_shape + rest`` (or the shape of
+                *region* + rest).
+        ======  ================================================================
+        """
+        data = np.asarray(data)
+        if data.shape[:2] != self.source_shape :
+            raise ValueError('Data of shape {} does not match the source '
+                             'grid {}.'.format(data.shape, self.source_shape))
+        rest = data.shape[2:]
+        flat = data.reshape((-1,) + rest)
+        rows = self.target_rows(region)
+        if rows is None :
+            indices, weights, valid = self.indices, self.weights, self.valid
+            shape = self.target_shape
+        else :
+            indices, weights, valid = [a[rows] for a in
+                                       (self.indices, self.weights,
+                                        self.valid)]
+            shape = (len(range(*region[0].indices(self.target_shape[0]))),
+                     len(range(*region[1].indices(self.target_shape[1]))))
+        dtype = np.result_type(data.dtype, weights.dtype, float)
+        result = np.empty((len(indices),) + rest, dtype=dtype)
+        expand = (slice(None),) + len(rest)*(np.newaxis,)
+
+        def process(chunk) :
+            # Accumulate the four contributions one at a time to avoid a
+            # temporary of four times the size of the result
+            w = weights[chunk]
+            out = result[chunk]
+            np.multiply(flat[indices[chunk,0]], w[:,0][expand], out=out)
+            for k in range(1, 4) :
+                out += flat[indices[chunk,k]] * w[:,k][expand]
+            out[~valid[chunk]] = fill_value
+
+        map_chunks(process, len(indices), chunk_size=CHUNK_SIZE,
+                   n_workers=n_workers)
+        return result.reshape(shape + rest)
+
+class RemappedData(LazyArray) :
+    """
+    Lazy view of *data* whose first two dimensions are remapped with an
+    :class:`InterpolationMatrix <data_slicer.remapping.InterpolationMatrix>`.
+    Only the requested part of the target grid and of the other dimensions
+    is computed when the array is indexed, so e.g. displaying a single z
+    slice only remaps that slice.
+    """
+    def __init__(self, data, matrix, fill_value=0) :
+        self.data = data
+        self.matrix = matrix
+        self.fill_value = fill_value
+        shape = matrix.target_shape + tuple(data.shape[2:])
+        dtype = np.result_type(data.dtype, matrix.weights.dtype, float)
+        super().__init__(shape, dtype)
+
+    def _compute(self, region) :
+        source = self.data[(slice(None), slice(None)) + region[2:]]
+        return self.matrix.apply(source, region=region[:2],
+                                 fill_value=self.fill_value)
+
+class RotatedData(RemappedData) :
+    """
+    :class:`RemappedData <data_slicer.remapping.RemappedData>` resulting from
+    an in-plane rotation by *alpha* degrees around *center*, as created by
+    :func:`rotate <data_slicer.remapping.rotate>`. Remembers the unrotated
+    data and the parameters of the rotation, such that consecutive rotations
+    can be combined into a single interpolation.
+    """
+    def __init__(self, data, matrix, alpha, center, axes, fill_value=0) :
+        super().__init__(data, matrix, fill_value=fill_value)
+        self.alpha = alpha
+        self.center = center
+        self.axes = axes
+
+#_Functions_____________________________________________________________________
+
+def _axis_weights(axis, x) :
+    """ For every value in *x*, find the index *i* in the monotonic *axis*
+    such that ``x`` lies between ``axis[i]`` and ``axis[i+1]`` as well as
+    the weight of ``axis[i+1]`` in a linear interpolation.
+    Return the indices, weights and a mask of values inside the axis range.
+    """
+    axis = np.asarray(axis, dtype=float)
+    n = len(axis)
+    if n < 2 :
+        raise ValueError('Axes need at least two values for interpolation.')
+    if axis[0] > axis[-1] :
+        # Descending axis: work on the reversed axis and translate back
+        i, w, valid = _axis_weights(axis[::-1], x)
+        return n-2-i, 1-w, valid
+    i = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, n-2)
+    w = (x - axis[i]) / (axis[i+1] - axis[i])
+    # Tolerate rounding errors at the edges of the axis
+    eps = 1e-9 * (axis[-1] - axis[0])
+    valid = (x >= axis[0] - eps) & (x <= axis[-1] + eps)
+    w = np.clip(w, 0, 1)
+    return i, w, valid
+
+def build_interpolation_matrix(source_axes, target_axes, mapping=None) :
+    """
+    Construct the :class:`InterpolationMatrix
+    <data_slicer.remapping.InterpolationMatrix>` that resamples data given
+    on the grid spanned by *source_axes* onto the grid spanned by
+    *target_axes*.
+
+    **Parameters**
+
+    ===========  ===============================================================
+    source_axes  tuple of two monotonic 1d arrays (x, y); coordinates of the
+                 source grid (they do not need to be evenly spaced).
+    target_axes  tuple of two 1d arrays (u, v); coordinates of the target
+                 grid.
+    mapping      callable or *None*; function ``mapping(U, V) -> (X, Y)``
+                 which returns the source coordinates that correspond to the
+                 target coordinates given as 2d arrays *U* and *V*. This is
+                 the inverse of the coordinate transformation. If *None*,
+                 the identity is used (i.e. plain regridding).
+    ===========  ===============================================================
+    """
+    x, y = [np.asarray(a, dtype=float) for a in source_axes]
+    u, v = [np.asarray(a, dtype=float) for a in target_axes]
+    U, V = np.meshgrid(u, v, indexing='ij')
+    if mapping is None :
+        X, Y = U, V
+    else :
+        X, Y = [np.broadcast_to(c, U.shape) for c in mapping(U, V)]
+    ix, wx, valid_x = _axis_weights(x, X.ravel())
+    iy, wy, valid_y = _axis_weights(y, Y.ravel())
+    ny = len(y)
+    n_source = len(x) * ny
+    index_dtype = np.int32 if n_source < 2**31 else np.int64
+    corner = ix*ny + iy
+    indices = np.stack([corner, corner+1, corner+ny, corner+ny+1],
+                       axis=-1).astype(index_dtype)
+    weights = np.stack([(1-wx)*(1-wy), (1-wx)*wy, wx*(1-wy), wx*wy],
+                       axis=-1).astype(np.float32)
+    valid = valid_x & valid_y
+    weights[~valid] = 0
+    indices[~valid] = 0
+    return InterpolationMatrix(indices, weights, valid, (len(x), ny),
+                               (len(u), len(v)))
+
+def get_interpolation_matrix(source_axes, target_axes, mapping=None,
+                             key=None, use_disk=True) :
+    """
+    Cached version of :func:`build_interpolation_matrix
+    <data_slicer.remapping.build_interpolation_matrix>`. Matrices are looked
+    up in memory, then on disk, and only built if neither contains them.
+
+    **Parameters**
+
+    ===========  ===============================================================
+    source_axes  see :func:`build_interpolation_matrix
+                 <data_slicer.remapping.build_interpolation_matrix>`.
+    target_axes  see :func:`build_interpolation_matrix
+                 <data_slicer.remapping.build_interpolation_matrix>`.
+    mapping      see :func:`build_interpolation_matrix
+                 <data_slicer.remapping.build_interpolation_matrix>`.
+    key          any object with a stable ``repr``; identifies the
+                 *mapping* in the cache. By default, the mapping is
+                 identified through its source code (see
+                 :func:`function_token <data_slicer.caching.function_token>`).
+                 If that is not possible, the matrix is not cached.
+    use_disk     bool; whether to use the on-disk cache.
+    ===========  ===============================================================
+    """
+    if key is None :
+        key = 'identity' if mapping is None else function_token(mapping)
+    if key is None :
+        logger.debug('get_interpolation_matrix(): mapping cannot be '
+                     'identified, not caching.')
+        return build_interpolation_matrix(source_axes, target_axes, mapping)
+
+    cache_key = hash_key([np.asarray(a, dtype=float) for a in source_axes],
+                         [np.asarray(a, dtype=float) for a in target_axes],
+                         key, CACHE_VERSION)
+    matrix = memory_cache.get(cache_key)
+    if matrix is not None :
+        return matrix
+    if use_disk :
+        arrays = disk_cache.get(cache_key)
+        if arrays is not None :
+            matrix = InterpolationMatrix.from_arrays(arrays)
+    if matrix is None :
+        matrix = build_interpolation_matrix(source_axes, target_axes, mapping)
+        if use_disk :
+            disk_cache.put(cache_key, matrix.to_arrays())
+    memory_cache.put(cache_key, matrix)
+    return matrix
+
+def remap(data, source_axes, target_axes, mapping=None, key=None,
+          fill_value=0, lazy=True) :
+    """
+    Remap the first two dimensions of *data* from *source_axes* to
+    *target_axes*. See :func:`get_interpolation_matrix
+    <data_slicer.remapping.get_interpolation_matrix>` for the arguments.
+
+    **Returns**
+
+    ======  ====================================================================
+    result  :class:`RemappedData <data_slicer.remapping.RemappedData>` if
+            *lazy* is *True*, otherwise the fully computed np.array.
+    ======  ====================================================================
+    """
+    matrix = get_interpolation_matrix(source_axes, target_axes,
+                                      mapping=mapping, key=key)
+    if lazy :
+        return RemappedData(data, matrix, fill_value=fill_value)
+    else :
+        return matrix.apply(data, fill_value=fill_value)
+
+def rotation_mapping(alpha, center) :
+    """ Return the function ``mapping(U, V) -> (X, Y)`` (as expected by 
+    :func:`build_interpolation_matrix 
+    <data_slicer.remapping.build_interpolation_matrix>`) that describes a 
+    counterclockwise rotation of the data by *alpha* degrees around the 
+    point *center* = (x0, y0).
+    """
+    x0, y0 = center
+    cos = np.cos(np.radians(alpha))
+    sin = np.sin(np.radians(alpha))
+    def mapping(U, V) :
+        # A target point takes its value from the source point that is 
+        # rotated onto it, i.e. apply the inverse rotation
+        du = U - x0
+        dv = V - y0
+        return x0 + cos*du + sin*dv, y0 - sin*du + cos*dv
+    return mapping
+
+def rotate(data, axes, alpha, center=None, fill_value=0, lazy=True) :
+    """
+    Rotate the first two dimensions of *data* by *alpha* degrees 
+    (counterclockwise) in the plane spanned by *axes*. The rotated data is 
+    given on the same grid as the original data. 
+    The interpolation matrix for a given geometry and angle is computed only 
+    once and cached (see :func:`get_interpolation_matrix 
+    <data_slicer.remapping.get_interpolation_matrix>`).
+
+    **Parameters**
+
+    ==========  ================================================================
+    data        array-like of shape (nx, ny, ...); the data to rotate.
+    axes        tuple of two 1d arrays (x, y); coordinates along the first two 
+                dimensions of *data*.
+    alpha       float; rotation angle in degrees.
+    center      tuple (x0, y0) or *None*; point around which to rotate. 
+                Defaults to the middle of the axes ranges.
+    fill_value  number; value for the regions that are rotated in from 
+                outside of the data.
+    lazy        bool; if *True*, return a :class:`RotatedData 
+                <data_slicer.remapping.RotatedData>` that rotates slices on 
+                demand, otherwise rotate all slices at once (distributed 
+                over a pool of threads).
+    ==========  ================================================================
+    """
+    x, y = [np.asarray(a, dtype=float) for a in axes]
+    if center is None :
+        center = ((x[0] + x[-1])/2, (y[0] + y[-1])/2)
+    center = tuple(float(c) for c in center)
+    alpha = float(alpha)
+    matrix = get_interpolation_matrix((x, y), (x, y), 
+                                      mapping=rotation_mapping(alpha, center),
+                                      key=('rotation', alpha, center))
+    rotated = RotatedData(data, matrix, alpha, center, (x, y), 
+                          fill_value=fill_value)
+    if lazy :
+        return rotated
+    else :
+        return rotated.compute()
+
+def is_uniform(axis, rtol=1e-3) :
+    """ Return *True* if the values in *axis* are evenly spaced (up to a 
+    relative tolerance *rtol* of the average spacing).
+    """
+    axis = np.asarray(axis, dtype=float)
+    if len(axis) < 3 :
+        return True
+    steps = np.diff(axis)
+    step = (axis[-1] - axis[0]) / (len(axis) - 1)
+    return bool(np.all(np.abs(steps - step) <= rtol*abs(step)))
+
+def fractional_index(axis, x) :
+    """ Return the (fractional) index at which the coordinate *x* lies on 
+    the monotonic *axis*, by linear interpolation between the axis values.
+    """
+    axis = np.asarray(axis, dtype=float)
+    indices = np.arange(len(axis), dtype=float)
+    if axis[0] > axis[-1] :
+        return np.interp(x, axis[::-1], indices[::-1])
+    return np.interp(x, axis, indices)
+
+def uniform_index_map(axis) :
+    """
+    Create the map that resamples data given on the non-uniform *axis* onto 
+    a uniform display grid spanning the same range, by nearest neighbour 
+    lookup. The display grid is fine enough to show the smallest step of 
+    *axis* with at least one pixel, but at most :const:`MAX_OVERSAMPLING 
+    <data_slicer.remapping.MAX_OVERSAMPLING>` times as fine as the original 
+    grid.
+
+    **Returns**
+
+    =======  ===================================================================
+    indices  1d int array or *None*; for every display pixel, the index of the 
+             data pixel to show there. *None* if *axis* is uniform and no 
+             resampling is needed.
+    =======  ===================================================================
+    """
+    axis = np.asarray(axis, dtype=float)
+    n = len(axis)
+    if is_uniform(axis) :
+        return None
+    span = axis[-1] - axis[0]
+    min_step = np.abs(np.diff(axis)).min()
+    n_display = int(np.ceil(abs(span) / max(min_step, abs(span)*1e-9))) + 1
+    n_display = int(np.clip(n_display, n, MAX_OVERSAMPLING*n))
+    centers = axis[0] + (np.arange(n_display) + 0.5) * span/n_display
+    return np.rint(fractional_index(axis, centers)).astype(np.intp)
+
+def display_index_maps(xscale, yscale) :
+    """ Return the :func:`uniform_index_map 
+    <data_slicer.remapping.uniform_index_map>` for both *xscale* and 
+    *yscale*. The maps are computed once per pair of axes and cached.
+    """
+    key = hash_key(np.asarray(xscale, dtype=float), 
+                   np.asarray(yscale, dtype=float))
+    maps = index_map_cache.get(key)
+    if maps is None :
+        maps = (uniform_index_map(xscale), uniform_index_map(yscale))
+        index_map_cache.put(key, maps)
+    return maps
+
+def apply_index_maps(image, maps) :
+    """ Resample the 2d *image* with the index *maps* returned by 
+    :func:`display_index_maps <data_slicer.remapping.display_index_maps>`.
+    """
+    for dim, indices in enumerate(maps) :
+        if indices is not None :
+            image = image.take(indices, axis=dim)
+    return image
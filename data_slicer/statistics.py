@@ -0,0 +1,264 @@
+"""
+Histograms and percentile statistics of whole datasets, computed in a single
+chunked and parallel pass. They provide the colour levels for displayed
+slices, such that the individual images never need to be scanned.
+"""
+import itertools
+import logging
+
+import numpy as np
+
+from data_slicer.caching import LRUCache
+from data_slicer.lazy import CHUNK_BYTES
+from data_slicer.utilities import map_chunks
+
+logger = logging.getLogger('ds.'+__name__)
+
+#_Constants_____________________________________________________________________
+
+# Number of bins of the histograms of whole datasets
+HISTOGRAM_BINS = 1024
+# Number of bins of the histogram of each chunk, before they are merged
+CHUNK_BINS = 4096
+# Datasets with more values than this are only sampled
+MAX_SAMPLES = 2**24
+# Percentiles used for the colour levels by default
+DEFAULT_PERCENTILES = (0.1, 99.9)
+
+# Cache for the histograms of datasets, see get_histogram()
+histogram_cache = LRUCache(max_items=16)
+
+# Unique tokens that identify the owners of cached histograms (ids of 
+# deleted objects may be reused)
+_tokens = itertools.count()
+
+#_Classes_______________________________________________________________________
+
+class Histogram() :
+    """
+    Histogram of all finite values of a dataset.
+
+    **Attributes**
+
+    ======  ====================================================================
+    counts  1d int array; number of values in each bin.
+    edges   1d array of length ``len(counts)+1``; bin edges.
+    vmin    float; exact minimum of the (sampled) data.
+    vmax    float; exact maximum of the (sampled) data.
+    n_nan   int; number of values that are NaN or infinite.
+    ======  ====================================================================
+    """
+    def __init__(self, counts, edges, vmin, vmax, n_nan=0) :
+        self.counts = counts
+        self.edges = edges
+        self.vmin = vmin
+        self.vmax = vmax
+        self.n_nan = n_nan
+        self._cumulative = None
+
+    def __repr__(self) :
+        return '<Histogram: {} values in [{}, {}]>'.format(self.total,
+                                                           self.vmin,
+                                                           self.vmax)
+
+    @property
+    def total(self) :
+        return int(self.counts.sum())
+
+    @property
+    def nbytes(self) :
+        return self.counts.nbytes + self.edges.nbytes
+
+    def percentile(self, q) :
+        """ Estimate the *q*-th percentile (0 <= q <= 100) of the data by
+        linear interpolation within the bins. *q* can also be an array.
+        """
+        q = np.asarray(q, dtype=float)
+        total = self.total
+        if total == 0 :
+            return np.full(q.shape, np.nan)[()]
+        cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+        values = np.interp(q/100*total, cumulative, self.edges)
+        # The extremes are known exactly
+        values = np.where(q <= 0, self.vmin, values)
+        values = np.where(q >= 100, self.vmax, values)
+        return values[()]
+
+    def cdf(self, values) :
+        """ Return the fraction of the data that is smaller than or equal 
+        to *values* (i.e. the cumulative distribution function), linearly 
+        interpolated within the bins.
+        """
+        if self._cumulative is None :
+            cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+            self._cumulative = cumulative / max(cumulative[-1], 1)
+        return np.interp(values, self.edges, self._cumulative)
+
+    def levels(self, lower=None, upper=None) :
+        """ Return the colour levels [low, high] that correspond to the
+        percentiles *lower* and *upper*. Default to
+        :const:`DEFAULT_PERCENTILES
+        <data_slicer.statistics.DEFAULT_PERCENTILES>`.
+        """
+        if lower is None :
+            lower = DEFAULT_PERCENTILES[0]
+        if upper is None :
+            upper = DEFAULT_PERCENTILES[1]
+        low, high = self.percentile([lower, upper])
+        if not high > low :
+            # Avoid degenerate levels for constant data
+            high = low + 1
+        return [float(low), float(high)]
+
+#_Functions_____________________________________________________________________
+
+def _block_histogram(block) :
+    """ Return (vmin, vmax, counts, n_nan) for the np.array *block*, where
+    *counts* is a histogram with :const:`CHUNK_BINS
+    <data_slicer.statistics.CHUNK_BINS>` bins spanning [vmin, vmax].
+    """
+    block = np.asarray(block).ravel()
+    finite = np.isfinite(block)
+    values = block[finite] if not finite.all() else block
+    n_nan = block.size - values.size
+    if values.size == 0 :
+        return np.inf, -np.inf, np.zeros(CHUNK_BINS, dtype=np.int64), n_nan
+    vmin, vmax = values.min(), values.max()
+    counts = np.histogram(values, bins=CHUNK_BINS, range=(vmin, vmax))[0]
+    return vmin, vmax, counts, n_nan
+
+def _merge_histograms(parts, bins) :
+    """ Combine the chunk histograms *parts* (as returned by
+    :func:`_block_histogram <data_slicer.statistics._block_histogram>`)
+    into one :class:`Histogram <data_slicer.statistics.Histogram>` with
+    *bins* bins. Counts are moved to the bin that contains the center of
+    their original bin.
+    """
+    vmin = min(p[0] for p in parts)
+    vmax = max(p[1] for p in parts)
+    n_nan = sum(p[3] for p in parts)
+    if vmin > vmax :
+        # No finite values at all
+        return Histogram(np.zeros(bins, dtype=np.int64),
+                         np.linspace(0, 1, bins+1), np.nan, np.nan, n_nan)
+    edges = np.linspace(vmin, vmax, bins+1)
+    width = (vmax - vmin) / bins
+    counts = np.zeros(bins, dtype=np.int64)
+    for lo, hi, part_counts, _ in parts :
+        if lo > hi :
+            continue
+        if width == 0 :
+            counts[0] += part_counts.sum()
+            continue
+        part_edges = np.linspace(lo, hi, len(part_counts)+1)
+        centers = (part_edges[:-1] + part_edges[1:]) / 2
+        indices = np.clip(((centers - vmin)/width).astype(int), 0, bins-1)
+        counts += np.bincount(indices, weights=part_counts,
+                              minlength=bins).astype(np.int64)
+    return Histogram(counts, edges, float(vmin), float(vmax), n_nan)
+
+def sample_steps(shape, max_samples=MAX_SAMPLES) :
+    """ Return the strides (one per dimension) of a regular grid with about
+    *max_samples* points in an array of *shape*. The overall stride is
+    spread as evenly as possible over the dimensions, such that the samples
+    cover the whole array instead of a few slices of it.
+    """
+    size = int(np.prod(shape))
+    if max_samples is None or size <= max_samples :
+        return len(shape)*(1,)
+    remaining = size / max_samples
+    steps = []
+    for d, n in enumerate(shape) :
+        step = int(np.ceil(remaining ** (1/(len(shape) - d)) - 1e-9))
+        step = max(1, min(step, n))
+        steps.append(step)
+        remaining /= step
+    return tuple(steps)
+
+def compute_histogram(data, bins=HISTOGRAM_BINS, max_samples=MAX_SAMPLES,
+                      n_workers=None) :
+    """
+    Compute the histogram of all finite values in the array-like *data* in
+    a single pass. The data is processed in chunks along its first dimension
+    which are distributed over a pool of threads. If *data* contains more
+    than *max_samples* values, only a regular grid of values is used, with
+    the stride spread evenly over all dimensions (see :func:`sample_steps
+    <data_slicer.statistics.sample_steps>`).
+
+    **Parameters**
+
+    ===========  ===============================================================
+    data         array-like (np.array or e.g. a :class:`LazyArray
+                 <data_slicer.lazy.LazyArray>`).
+    bins         int; number of bins of the result.
+    max_samples  int or *None*; maximum number of values to process. *None*
+                 means no limit.
+    n_workers    int; number of threads.
+    ===========  ===============================================================
+
+    **Returns**
+
+    =========  =================================================================
+    histogram  :class:`Histogram <data_slicer.statistics.Histogram>`.
+    =========  =================================================================
+    """
+    shape = data.shape
+    if len(shape) == 0 or 0 in shape :
+        return _merge_histograms([_block_histogram(np.empty(0))], bins)
+    n = shape[0]
+    size = int(np.prod(shape))
+    steps = sample_steps(shape, max_samples)
+    indices = np.arange(0, n, steps[0])
+    # Stride of the remaining dimensions within each index along the first
+    rest = tuple(slice(None, None, step) for step in steps[1:])
+    itemsize = np.dtype(data.dtype).itemsize
+    bytes_per_index = max(1, size // n * itemsize)
+    chunk_size = max(1, CHUNK_BYTES // bytes_per_index)
+
+    def process(chunk) :
+        selected = indices[chunk]
+        if steps[0] == 1 :
+            block = np.asarray(data[selected[0]:selected[-1]+1])
+            block = block[(slice(None),) + rest]
+        else :
+            block = np.stack([np.asarray(data[i])[rest] for i in selected])
+        return _block_histogram(block)
+
+    parts = map_chunks(process, len(indices), chunk_size=chunk_size,
+                       n_workers=n_workers)
+    histogram = _merge_histograms(parts, bins)
+    logger.debug('compute_histogram(): {}'.format(histogram))
+    return histogram
+
+def new_token() :
+    """ Return a number that has not been returned before. Objects use it 
+    in the *key* of :func:`get_histogram 
+    <data_slicer.statistics.get_histogram>` to identify themselves. 
+    """
+    return next(_tokens)
+
+def get_histogram(data, key=None, bins=HISTOGRAM_BINS,
+                  max_samples=MAX_SAMPLES, n_workers=None) :
+    """ Cached version of :func:`compute_histogram
+    <data_slicer.statistics.compute_histogram>`. *key* identifies the state
+    of *data*, e.g. a tuple of its owner and a counter that is increased
+    whenever the data changes. If *key* is *None*, nothing is cached.
+    """
+    if key is None :
+        return compute_histogram(data, bins=bins, max_samples=max_samples,
+                                 n_workers=n_workers)
+    cache_key = (key, bins, max_samples)
+    histogram = histogram_cache.get(cache_key)
+    if histogram is None :
+        histogram = compute_histogram(data, bins=bins,
+                                      max_samples=max_samples,
+                                      n_workers=n_workers)
+        histogram_cache.put(cache_key, histogram)
+    return histogram
+
+def robust_levels(data, lower=None, upper=None, key=None) :
+    """ Shorthand for ``get_histogram(data, key).levels(lower, upper)``. See
+    :func:`get_histogram <data_slicer.statistics.get_histogram>` and
+    :meth:`Histogram.levels <data_slicer.statistics.Histogram.levels>`.
+    """
+    return get_histogram(data, key=key).levels(lower, upper)
@@ -0,0 +1,78 @@
+"""
+Check that chunked out-of-core arrays only read what they need and respect
+the memory budget of their cache.
+"""
+import numpy as np
+
+from data_slicer.caching import LRUCache
+from data_slicer import dtypes
+from data_slicer.chunked import ChunkedArray, as_chunked, default_chunks
+from data_slicer.dataloading import load_data
+from data_slicer.lazy import LazyArray
+from data_slicer.utilities import make_slice
+
+class Store() :
+    """ Array-like that records the regions that are read from it. """
+    def __init__(self, data) :
+        self.data = data
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.reads = []
+
+    def __getitem__(self, key) :
+        self.reads.append(key)
+        return self.data[key]
+
+def test_chunked_array() :
+    """ Slices only read (and cache) the chunks they touch. """
+    data = np.random.rand(40, 30, 20)
+    store = Store(data)
+    cache = LRUCache(max_bytes=20 * 10*10*10*8)
+    chunked = ChunkedArray(store, chunks=(10, 10, 10), cache=cache)
+    assert as_chunked(store).source is store
+    assert as_chunked(chunked) is chunked
+    assert np.array_equal(chunked[5], data[5])
+    assert len(store.reads) == 3*2
+    assert np.array_equal(make_slice(chunked, 2, 12, integrate=1),
+                          data[...,11:14].sum(2))
+    # Only the chunks of the other x ranges are new
+    assert len(store.reads) == 3*2 + 3*3
+    # Everything touched so far is cached
+    assert np.array_equal(chunked[2:8, ::-3, 11], data[2:8, ::-3, 11])
+    assert len(store.reads) == 15
+    assert np.array_equal(chunked[...], data)
+    assert len(chunked.cached_chunks) == 20
+    assert cache.nbytes <= cache.max_bytes
+    # Reductions of data that does not fit into the cache bypass it
+    cached = set(chunked.cached_chunks)
+    assert np.allclose(chunked.sum(axis=(0, 1)), data.sum(axis=(0, 1)))
+    assert set(chunked.cached_chunks) == cached
+    chunked.clear_cache()
+    assert len(cache) == 0
+
+def test_memmap(tmp_path) :
+    """ Memory-mapped files are read in chunks and never converted. """
+    data = np.random.rand(20, 15, 10)
+    filename = str(tmp_path / 'data.npy')
+    np.save(filename, data)
+    dtypes.set_policy(storage='float32')
+    try :
+        loaded = load_data(filename).data
+    finally :
+        dtypes.set_policy()
+    assert isinstance(loaded, np.memmap) and loaded.dtype == np.float64
+    chunked = as_chunked(loaded)
+    assert isinstance(chunked, ChunkedArray)
+    assert chunked.source is loaded
+    assert np.array_equal(chunked[3:7, 2], data[3:7, 2])
+    # In-memory arrays are left alone
+    assert as_chunked(data) is data
+    assert as_chunked(np.asarray(loaded) + 1).__class__ is np.ndarray
+
+def test_default_chunks() :
+    """ Chunks are about the right size and fit the shape. """
+    chunks = default_chunks((5, 4000, 3000), np.float32)
+    assert chunks[0] == 5
+    assert 2**19 < np.prod(chunks) * 4 <= 2**23
+    assert default_chunks((3, 4), float) == (3, 4)
+    assert not isinstance(as_chunked(np.zeros(3)), LazyArray)
@@ -0,0 +1,97 @@
+"""
+Check that the dtype policy is honoured and that integrations do not
+overflow in small storage types.
+"""
+import pickle
+
+import numpy as np
+import pytest
+
+from data_slicer import dtypes
+from data_slicer.dataloading import load_data
+from data_slicer.lazy import TransposedArray
+from data_slicer.masking import Mask, masked_slice, masked_sum
+from data_slicer.processing import normalize, subtract_background
+from data_slicer.utilities import make_slice
+
+@pytest.fixture
+def policy() :
+    """ Restore the default policy after the test. """
+    yield dtypes.policy
+    dtypes.set_policy()
+
+def test_overflow(policy, monkeypatch) :
+    """ Sums of small types are exact; conversions refuse to wrap. """
+    counts = np.full((40, 30, 20), 65000, dtype=np.uint16)
+    counts[::3] = 65535
+    expected = counts.astype(np.int64)
+    sliced = make_slice(counts, 2, 10, integrate=10, silent=True)
+    assert sliced.dtype == np.int64
+    assert np.array_equal(sliced, expected.sum(2))
+    lazy = TransposedArray(counts.transpose(2, 0, 1), (1, 2, 0))
+    assert np.array_equal(make_slice(lazy, 0, 5, integrate=5),
+                          expected[:11].sum(0))
+    mask = Mask(np.ones(counts.shape, dtype=bool))
+    assert np.array_equal(masked_slice(counts, mask, 1, 0, integrate=29),
+                          expected.sum(1))
+    assert np.array_equal(masked_sum(counts, mask, (0, 1)),
+                          expected.sum(axis=(0, 1)))
+    # A float16 accumulator stops counting at 2048 and overflows at 65504
+    half = np.ones((300, 300, 2), dtype=np.float16)
+    assert np.array_equal(make_slice(half, 2, 0), np.ones((300, 300)))
+    assert np.all(masked_sum(half, Mask(np.ones((1, 1, 1), dtype=bool),
+                                        half.shape), (0, 1)) == 90000)
+
+    dtypes.set_policy(storage=np.uint16)
+    assert dtypes.policy.to_storage(counts) is counts
+    stored = dtypes.policy.to_storage(np.array([0.4, 1.6, 65535.]))
+    assert stored.dtype == np.uint16
+    assert np.array_equal(stored, [0, 2, 65535])
+    for bad in ([-1., 2.], [70000, 1]) :
+        with pytest.raises(OverflowError) :
+            dtypes.policy.to_storage(np.array(bad))
+    with pytest.raises(ValueError) :
+        dtypes.policy.to_storage(np.array([1, np.nan]))
+    dtypes.set_policy(storage='float32')
+    with pytest.raises(OverflowError) :
+        dtypes.policy.to_storage(np.array([1e39]))
+    # Conversions run in blocks along the first dimension
+    monkeypatch.setattr(dtypes, 'BLOCK_BYTES', 50*60*8*7)
+    dtypes.set_policy(storage=np.int16)
+    large = np.random.rand(100, 50, 60) * 1000
+    large[97, 3, 2] = 40000
+    with pytest.raises(OverflowError) :
+        dtypes.policy.to_storage(large)
+    large[97, 3, 2] = 0
+    assert np.array_equal(dtypes.policy.to_storage(large), np.rint(large))
+
+def test_policy(policy, tmp_path) :
+    """ Loaders, processing and display follow the policy. """
+    data = np.random.rand(6, 7, 8) * 100
+    filename = str(tmp_path / 'data.npy')
+    np.save(filename, data)
+    assert load_data(filename).data.dtype == np.float64
+    dtypes.set_policy(storage='float32', float='float32')
+    # Memory-mapped .npy files are not read into memory for the conversion
+    assert load_data(filename).data.dtype == np.float64
+    filename = str(tmp_path / 'data.p')
+    with open(filename, 'wb') as f :
+        pickle.dump(data, f)
+    loaded = load_data(filename)
+    assert loaded.data.dtype == np.float32
+    assert np.allclose(loaded.data, data)
+    # Slices accumulate in double precision
+    assert make_slice(loaded.data, 2, 3, integrate=2).dtype == np.float64
+    counts = np.random.randint(1, 1000, size=(6, 7, 8)).astype(np.uint16)
+    normalized = normalize(counts, axis=2)
+    assert normalized.dtype == np.float32
+    assert normalized[0, 0].dtype == np.float32
+    assert np.allclose(normalized[...], counts / counts.max(axis=2,
+                                                            keepdims=True))
+    assert subtract_background(counts, mode='constant').dtype == np.float32
+    # Images are only converted if a display type is set
+    assert dtypes.policy.to_display(counts[0]).dtype == np.uint16
+    dtypes.set_policy(display='float32')
+    assert dtypes.policy.to_display(counts[0]).dtype == np.float32
+    dtypes.set_policy(accumulation=np.float32)
+    assert make_slice(counts, 0, 0).dtype == np.float32
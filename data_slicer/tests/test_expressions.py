@@ -0,0 +1,50 @@
+"""
+Check the expression evaluator and lazily evaluated expression datasets.
+"""
+import numpy as np
+import pytest
+
+from data_slicer.expressions import Expression, ExpressionData, evaluate
+from data_slicer.lazy import TransposedArray
+
+def test_evaluate() :
+    """ Chunked evaluation agrees with numpy, including broadcasting. """
+    a = np.random.rand(20, 6, 7) + 1
+    b = np.random.rand(20, 6, 7) + 1
+    assert Expression('(a-b)/(a+b)').names == ('a', 'b')
+    expected = (a - b) / (a + b)
+    result = evaluate('(a-b)/(a+b)', dict(a=a, b=b), chunk_size=50)
+    assert np.allclose(result, expected)
+    result = evaluate('where(a > 1.5, sqrt(a), -c)', dict(a=a, c=b[0]), 
+                      chunk_size=50, n_workers=3)
+    assert np.allclose(result, np.where(a > 1.5, np.sqrt(a), -b[0]))
+    assert evaluate('a > 1.5', dict(a=a), chunk_size=50).dtype == bool
+    for bad in ('a.real', 'a[0]', 'open(a)', '__import__("os")', 'a +') :
+        with pytest.raises(ValueError) :
+            Expression(bad)
+    with pytest.raises(ValueError, match='"&"') :
+        Expression('a > 0 and a < 1')
+    result = evaluate('(a > 0.5) & ~(a > 1.5)', dict(a=a), chunk_size=50)
+    assert np.array_equal(result, (a > 0.5) & (a <= 1.5))
+    with pytest.raises(NameError) :
+        evaluate('a + q', dict(a=a))
+
+def test_expression_data() :
+    """ Only the accessed parts are evaluated, also for lazy inputs. """
+    a = np.random.rand(8, 9, 10) + 1
+    b = np.random.rand(8, 9, 10) + 1
+    lazy_b = TransposedArray(b.transpose(2, 0, 1), (1, 2, 0))
+    data = ExpressionData('(a-b)/(a+b) * k', dict(a=a, b=lazy_b, k=2))
+    expected = 2 * (a - b) / (a + b)
+    assert data.shape == a.shape
+    assert data.dtype == float
+    assert np.allclose(data[...,3], expected[...,3])
+    assert np.allclose(data[2:5, ::2], expected[2:5, ::2])
+    assert np.allclose(data.sum(axis=(0, 1)), expected.sum(axis=(0, 1)))
+    assert np.allclose(data.compute(), expected)
+    # Broadcasting against a single spectrum
+    spectrum = b[0, 0]
+    data = ExpressionData('a / s', dict(a=a, s=spectrum))
+    assert np.allclose(data[1], a[1] / spectrum)
+    with pytest.raises(ValueError) :
+        ExpressionData('k + 1', dict(k=2))
@@ -0,0 +1,102 @@
+"""
+Check the batched fits of many spectra against the parameters of synthetic
+data and the coarse to fine order of the fits.
+"""
+import numpy as np
+import pytest
+
+from data_slicer import fitting
+from data_slicer.chunked import ChunkedArray
+from data_slicer.fitting import fit, refinement_levels, snake_order
+
+def lorentzian(x, *, x0=0, gamma=1, a=1, b=0) :
+    return a / (1 + ((x - x0)/gamma)**2) + b
+
+def dispersing_peaks(nx=30, ny=40, n=150, noise=0.01) :
+    """ Lorentzians whose positions change slowly through the cube. """
+    x = np.linspace(-1, 1, n)
+    x0 = 0.3*np.sin(np.linspace(0, 3, nx))[:,None] + \
+         0.2*np.linspace(0, 1, ny)[None]
+    gamma = 0.08 + 0.03*np.cos(np.linspace(0, 2, ny))[None] + 0*x0
+    data = lorentzian(x, x0=x0[..., None], gamma=gamma[..., None], a=2, 
+                      b=0.1)
+    data += noise*np.random.default_rng(0).standard_normal(data.shape)
+    return x, data, x0, gamma
+
+def test_refinement_levels() :
+    """ Every spectrum is fitted once, after the one it starts from. """
+    for shape in [(1000,), (30, 40), (5, 6, 7), (3,)] :
+        levels = refinement_levels(shape, first=16)
+        indices = np.concatenate([level[0] for level in levels])
+        assert np.array_equal(np.sort(indices), np.arange(np.prod(shape)))
+        fitted = set(levels[0][0])
+        for level, sources in levels[1:] :
+            assert fitted.issuperset(sources)
+            fitted.update(level)
+        # The first level is a path through neighbours
+        coords = np.array(np.unravel_index(levels[0][0], shape))
+        steps = np.abs(np.diff(coords, axis=1)).sum(axis=0)
+        assert len(set(steps)) <= 1
+    coords = np.array(np.unravel_index(snake_order((3, 4, 5)), (3, 4, 5)))
+    assert np.all(np.abs(np.diff(coords, axis=1)).sum(axis=0) == 1)
+
+def test_fit() :
+    """ Warm starts follow the dispersion, which cold starts miss. """
+    x, data, x0, gamma = dispersing_peaks()
+    # Invalid points are ignored
+    data[3, 4, 10:30] = np.nan
+    p0 = dict(x0=0, gamma=0.1, a=1, b=0)
+    result = fit(lorentzian, data, x=x, axis=2, p0=p0, batch_size=100, 
+                 n_workers=2)
+    assert result.converged.all()
+    assert np.allclose(result['x0'], x0, atol=5e-3)
+    assert np.allclose(np.abs(result['gamma']), gamma, atol=5e-3)
+    assert result.as_cube().shape == (30, 40, 4)
+    # The errors are of the order of the deviations
+    deviation = np.std(result['x0'] - x0)
+    assert 0.3 < np.median(result.get_error('x0')) / deviation < 3
+    best_fit = result.best_fit()
+    assert best_fit.shape == data.shape
+    assert np.nanstd(best_fit - data) < 0.02
+    cold = fit(lorentzian, data, x=x, axis=2, p0=p0, warm_start=False)
+    assert (np.abs(cold['x0'] - x0) > 0.01).any()
+
+def test_fit_expression() :
+    """ Expressions and processes give the same result as functions. """
+    x, data, x0, gamma = dispersing_peaks(nx=2, ny=40)
+    cut = data[1].T
+    p0 = dict(x0=0, gamma=0.1, a=1)
+    expected = fit(lorentzian, cut, x=x, axis=0, p0=p0, fixed=dict(b=0.1))
+    result = fit('a / (1 + ((x - x0)/gamma)**2) + b', cut, x=x, axis=0, 
+                 p0=p0, fixed=dict(b=0.1), processes=True, n_workers=2)
+    assert result.names == ('x0', 'gamma', 'a')
+    assert np.allclose(result.values, expected.values)
+    assert result.as_cube().shape == (40, 1, 3)
+    with pytest.raises(ValueError) :
+        fit(lambda x, y, *, a=1 : a*x*y, data, p0=dict(a=1))
+    # Processes are not silently replaced by threads
+    with pytest.raises(ValueError, match='picklable') :
+        fit(lambda x, *, a=1 : a*x, cut, p0=dict(a=1), axis=0, 
+            processes=True)
+
+def test_fit_slabs(monkeypatch) :
+    """ Lazy data is read and fitted slab by slab. """
+    x, data, x0, gamma = dispersing_peaks(nx=12, ny=10)
+    p0 = dict(x0=0, gamma=0.1, a=1, b=0)
+    expected = fit(lorentzian, data, x=x, axis=2, p0=p0)
+    monkeypatch.setattr(fitting, 'SLAB_BYTES', 3*10*150*8)
+    chunked = ChunkedArray(data, chunks=(4, 10, 150))
+    result = fit(lorentzian, chunked, x=x, axis=2, p0=p0)
+    assert result.values.shape == (12, 10, 4)
+    assert result.converged.all()
+    assert np.allclose(result.values, expected.values, atol=1e-4)
+    # Slabs along y if the spectra run along x
+    result = fit(lorentzian, ChunkedArray(data.transpose(2, 0, 1)), x=x, 
+                 axis=0, p0=p0)
+    assert np.allclose(result.values, expected.values, atol=1e-4)
+
+if __name__ == "__main__" :
+    test_refinement_levels()
+    test_fit()
+    test_fit_expression()
+    test_fit_slabs()
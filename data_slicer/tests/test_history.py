@@ -0,0 +1,63 @@
+"""
+Check the copy-on-write array and the undo/redo history.
+"""
+import numpy as np
+import pytest
+
+from data_slicer.history import History, PatchedArray, freeze
+
+def test_patched_array() :
+    """ Writes only copy the touched chunks and snapshots stay valid. """
+    base = freeze(np.random.rand(10, 12, 14))
+    with pytest.raises(ValueError) :
+        base[0, 0, 0] = 1
+    patched = PatchedArray(base, chunk_shape=(4, 4, 4))
+    expected = np.array(base)
+    patched[1:3, 2:7, 5] = -1
+    expected[1:3, 2:7, 5] = -1
+    assert len(patched.patches) == 2
+    assert patched.patched_bytes < expected.nbytes
+    assert np.array_equal(patched[...], expected)
+    assert np.array_equal(patched[::-2, 3], expected[::-2, 3])
+    snapshot = patched.snapshot()
+    patched[..., 5] += 1
+    assert np.array_equal(patched[..., 5], expected[..., 5] + 1)
+    patched.restore(snapshot)
+    assert np.array_equal(patched[...], expected)
+    # The base is never modified
+    assert base.min() >= 0
+
+def test_history() :
+    """ Linear undo/redo with a limited number of steps. """
+    history = History(max_steps=4)
+    for i in range(6) :
+        history.record('step{}'.format(i), value=i)
+    assert history.labels == ['step0', 'step3', 'step4', 'step5']
+    assert history.undo()['value'] == 4
+    assert history.undo()['value'] == 3
+    assert history.redo()['value'] == 4
+    history.record('other', value=-1)
+    assert not history.can_redo
+    assert history.labels == ['step0', 'step3', 'step4', 'other']
+    history.undo()
+    history.undo()
+    history.undo()
+    with pytest.raises(IndexError) :
+        history.undo()
+    assert history.current['value'] == 0
+    # Updates change the current state without adding a step
+    history.update(value=10)
+    assert history.current['value'] == 10
+    assert len(history) == 4
+
+def test_full_states() :
+    """ Only the latest full arrays are kept; views do not count. """
+    data = np.random.rand(4, 5, 6)
+    history = History(max_full=2)
+    history.record('load', data=data)
+    history.record('crop', data=data[1:])
+    for i in range(3) :
+        history.record('step{}'.format(i), data=data + i)
+        history.record('view{}'.format(i), data=history.current['data'][1:])
+    assert history.n_full == 2
+    assert history.labels == ['load', 'step1', 'view1', 'step2', 'view2']
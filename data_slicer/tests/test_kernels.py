@@ -0,0 +1,66 @@
+"""
+Check that all backends of the kernel registry agree with each other and
+with the pyqtgraph functions they replace.
+"""
+import numpy as np
+import pyqtgraph as pg
+import pytest
+
+from data_slicer import kernels
+from data_slicer.kernels import get_kernel
+from data_slicer.peaks import find_peaks
+from data_slicer.processing import subtract_background
+
+def test_kernels() :
+    """ Numpy kernels reproduce pyqtgraph, loop kernels reproduce numpy. """
+    block = np.random.rand(12, 9, 4)
+    points = np.random.rand(50, 2) * [13, 10] - 0.5
+    points[:3] = [[11, 8], [0, 0], [11, 3.5]]
+    expected = pg.functions.interpolateArray(block, points, order=1)
+    for backend in ('numpy', 'python') :
+        result = get_kernel('interpolate_points', backend)(block, points)
+        assert result.shape == expected.shape
+        assert np.allclose(result, expected)
+    assert np.allclose(get_kernel('interpolate_points', 'python')(
+                       block[...,0], points), expected[:,0])
+
+    lut = (np.random.rand(256, 3) * 255).astype(np.uint8)
+    image = np.random.rand(20, 30) * 1.4 - 0.2
+    image[2, 3] = np.nan
+    expected = pg.makeRGBA(image, levels=(0, 1), lut=lut)[0]
+    valid = ~np.isnan(image)
+    for backend in ('numpy', 'python') :
+        rgba = get_kernel('make_rgba', backend)(image, (0, 1), lut)
+        assert np.array_equal(rgba[valid], expected[valid])
+        assert rgba[2, 3, 3] == 0
+
+    x = np.linspace(-1, 1, 40)
+    spectra = np.array([np.tanh(5*x + s) + 1 + 0.1*np.random.rand(40)
+                        for s in range(-2, 3)])
+    background = subtract_background(spectra, axis=1)
+    kernels.set_backend('python')
+    try :
+        assert np.allclose(subtract_background(spectra, axis=1), background)
+        data = np.random.rand(6, 50)
+        python_peaks = find_peaks(data, prominence=0.1, width=(1, None))
+    finally :
+        kernels.set_backend('numba' if kernels.numba else 'numpy')
+    peaks = find_peaks(data, prominence=0.1, width=(1, None))
+    assert len(peaks) == len(python_peaks) > 0
+    for field in peaks.dtype.names :
+        assert np.allclose(peaks[field], python_peaks[field])
+
+def test_registry() :
+    """ Unknown kernels and backends are reported. """
+    with pytest.raises(KeyError) :
+        get_kernel('no_such_kernel')
+    with pytest.raises(ValueError) :
+        kernels.set_backend('fortran')
+    # Backends without an own implementation use the numpy one
+    kernels.register('test_kernel')(np.add)
+    assert get_kernel('test_kernel', 'numba') is np.add
+    del kernels._kernels['test_kernel']
+    assert kernels.get_backend() in kernels.backend_info()
+    if kernels.numba is None :
+        with pytest.raises(ImportError) :
+            kernels.set_backend('numba')
@@ -0,0 +1,66 @@
+"""
+Check masked slices and projections against NaN-aware numpy reductions.
+"""
+import numpy as np
+import pytest
+
+from data_slicer.lazy import TransposedArray
+from data_slicer.masking import Mask, MaskedData, MaskValues, \
+                                fill_invalid, has_invalid, mask_invalid, \
+                                masked_slice, masked_sum
+
+def test_mask() :
+    """ Bit-packed storage, broadcast masks and valid counts. """
+    valid = np.random.rand(5, 6, 13) > 0.3
+    mask = Mask(valid)
+    assert mask.nbytes < valid.nbytes
+    assert np.array_equal(mask.valid(), valid)
+    assert np.array_equal(mask.valid((slice(1, 3), 2)), valid[1:3, 2])
+    assert np.array_equal(mask.count(2, 3, 9), valid[...,3:9].sum(2))
+    assert np.array_equal(mask.count(0, 1, 4), valid[1:4].sum(0))
+    assert np.array_equal(mask.count_over((0, 1)), valid.sum(axis=(0, 1)))
+    transposed = mask.transpose((2, 0, 1))
+    assert np.array_equal(transposed.valid(), valid.transpose(2, 0, 1))
+    # A detector mask that is constant along z
+    detector = Mask(valid[...,:1], (5, 6, 13))
+    full = np.broadcast_to(valid[...,:1], (5, 6, 13))
+    assert np.array_equal(detector.broadcast(), full)
+    assert np.array_equal(detector.count(2, 2, 7), full[...,2:7].sum(2))
+    assert np.array_equal(detector.count_over(2), full.sum(2))
+    values = MaskValues(detector)
+    assert values.shape == (5, 6, 13)
+    assert np.array_equal(values[1:4, 2:6, 3:5], full[1:4, 2:6, 3:5])
+    with pytest.raises(ValueError) :
+        Mask(valid, (5, 6, 12))
+
+def test_masked_reductions() :
+    """ Masked slices and sums equal the NaN-mean times the window size. """
+    data = np.random.rand(8, 9, 20)
+    data[2:4, 3:5, 5:12] = np.nan
+    data[6, 7] = np.nan
+    mask = mask_invalid(data, n_workers=2)
+    assert np.array_equal(mask.valid(), np.isfinite(data))
+    filled = fill_invalid(data, mask)
+    assert not np.isnan(filled).any()
+    assert np.isnan(data).any()
+    assert has_invalid(data, n_workers=2)
+    assert not has_invalid(filled, n_workers=2)
+
+    with np.errstate(invalid='ignore'), \
+         pytest.warns(RuntimeWarning, match='Mean of empty slice') :
+        expected = np.nanmean(data[...,3:10], axis=2) * 7
+    result = masked_slice(filled, mask, dim=2, index=6, integrate=3)
+    assert np.allclose(result, expected, equal_nan=True)
+    assert np.isnan(result[6, 7])
+    # The integration window is clipped at the edges
+    result = masked_slice(filled, mask, dim=0, index=0, integrate=2)
+    assert np.allclose(result, np.nanmean(data[:3], axis=0) * 3)
+
+    expected = np.nanmean(data, axis=(0, 1)) * 8 * 9
+    assert np.allclose(masked_sum(filled, mask, (0, 1)), expected)
+
+    # Lazy data
+    lazy = fill_invalid(TransposedArray(data, (0, 1, 2)), mask)
+    assert isinstance(lazy, MaskedData)
+    assert np.array_equal(lazy[2:5, 1], filled[2:5, 1])
+    assert np.allclose(masked_sum(lazy, mask, (0, 1)), expected)
@@ -0,0 +1,182 @@
+"""
+Check that models evaluated on sparse meshgrids and in pieces give the same
+results as on full meshgrids.
+"""
+import numpy as np
+import pytest
+
+from data_slicer import model as model_module
+from data_slicer.caching import DiskCache
+from data_slicer.model import Model
+
+def band(x, y, z, *, a=1, E0=-1) :
+    return np.exp(-(a*(x**2 + y**2) + E0 - z)**2)
+
+def test_calculate_model_data(monkeypatch) :
+    """ Chunks, threads and processes agree with the dense evaluation. """
+    axes = [np.linspace(-1, 1, 30), np.linspace(-1, 1, 20), 
+            np.linspace(-2, 0, 50)]
+    expected = band(*np.meshgrid(*axes), a=2)
+    m = Model(band, pointwise=True)
+    m.MIN_AXIS_LENGTH = 0
+    assert np.allclose(m.calculate_model_data(axes, a=2), expected)
+    # Pieces of 2 or 3 slices along the longest (z) axis
+    monkeypatch.setattr(model_module, 'CHUNK_BYTES', 8*30*20*3)
+    assert np.allclose(m.calculate_model_data(a=2), expected)
+    m.processes = True
+    m.n_workers = 2
+    assert np.allclose(m.calculate_model_data(a=2), expected)
+    # Unpicklable models fall back to threads
+    m.set_model(lambda x, y, z, *, a=1 : a*x + 0*z)
+    m.set_axes(axes)
+    assert np.allclose(m.calculate_model_data(a=3), 
+                       3*np.meshgrid(*axes)[0])
+    # Models that are not pointwise are evaluated in one piece
+    m.set_model(lambda x, y, z : np.exp(x + y + z) / 
+                                 np.exp(x + y + z).sum())
+    m.pointwise = False
+    assert np.isclose(m.calculate_model_data(axes).sum(), 1)
+    # Models that do not depend on all axes are broadcast
+    m = Model(lambda x, y : np.ones_like(x))
+    assert m.calculate_model_data([[0, 1], [0, 2]]).shape == (100, 100)
+    meshes, points = m.get_values_around(1, 0.1)
+    assert len(points) == len(meshes[1]) == 100*100
+
+def test_isocurves() :
+    """ Slices are evaluated on their own and isocurves are cached. """
+    calls = []
+    def counted(x, y, z, *, a=1, E0=-1) :
+        calls.append(z.size)
+        return band(x, y, z, a=a, E0=E0)
+    m = Model(counted)
+    m.MIN_AXIS_LENGTH = 0
+    axes = [np.linspace(-1, 1, 30), np.linspace(-1, 1, 20), 
+            np.linspace(-2, 0, 50)]
+    full = m.calculate_model_data(axes, a=2)
+    assert np.allclose(m.calculate_slice_data(2, axes[2][7], a=2), 
+                       full[..., 7])
+    assert np.allclose(m.calculate_slice_data(0, axes[0][3], a=2), 
+                       full[:, 3])
+    calls.clear()
+    path = m.get_isocurve_path(0.5, dim=2, value=axes[2][40], a=2)
+    assert calls == [1] and not path.isEmpty()
+    assert m.get_isocurve_path(0.5, dim=2, value=axes[2][40], a=2) is path
+    m.get_isocurve_path(0.5, dim=2, value=axes[2][40], a=3)
+    assert len(calls) == 2
+
+def test_expression_model(monkeypatch) :
+    """ Expression models agree with the equivalent function. """
+    axes = [np.linspace(-1, 1, 30), np.linspace(-1, 1, 20), 
+            np.linspace(-2, 0, 50)]
+    expected = band(*np.meshgrid(*axes), a=2)
+    m = Model('exp(-(a*(x**2 + y**2) + E0 - z)**2)', 
+              parameters=dict(a=1, E0=-1), use_cache=False)
+    m.MIN_AXIS_LENGTH = 0
+    assert m.model.axis_names == ('x', 'y', 'z')
+    assert (m.n_args, m.n_kwargs) == (3, 2)
+    assert np.allclose(m.calculate_model_data(axes, a=2), expected)
+    monkeypatch.setattr(model_module, 'CHUNK_BYTES', 8*30*20*3)
+    assert np.allclose(m.calculate_model_data(a=2), expected)
+    assert np.allclose(m.calculate_slice_data(2, axes[2][4], a=2), 
+                       expected[..., 4])
+    m.processes = True
+    assert np.allclose(m.calculate_model_data(a=2), expected)
+    # Explicit order of the axes
+    m.set_model('x - E', axis_names=('E', 'x'))
+    reference = Model(lambda E, x : x - E)
+    reference.MIN_AXIS_LENGTH = 0
+    axes = [np.arange(3), np.arange(5)]
+    assert np.allclose(m.calculate_model_data(axes), 
+                       reference.calculate_model_data(axes))
+    with pytest.raises(TypeError) :
+        m.calculate_model_data(c=1)
+    with pytest.raises(ValueError) :
+        Model('a*x + b', axis_names=('x',))
+
+def test_sweep(monkeypatch) :
+    """ Sweeps agree with evaluating the model for every parameter value. """
+    m = Model(band, pointwise=True)
+    m.MIN_AXIS_LENGTH = 0
+    axes = [np.linspace(-1, 1, 6), np.linspace(-1, 1, 5), 
+            np.linspace(-2, 0, 4)]
+    m.set_axes(axes)
+    E0s = np.linspace(-1.5, -0.5, 30)
+    a_values = [0.5, 1, 2]
+    expected = np.empty((5, 6, 4, 30, 3))
+    for i, E0 in enumerate(E0s) :
+        for j, a in enumerate(a_values) :
+            expected[..., i, j] = m.calculate_model_data(E0=E0, a=a)
+    assert np.allclose(m.sweep(dict(E0=E0s, a=a_values)), expected)
+    # In pieces along the longest dimension, which is that of E0 here
+    monkeypatch.setattr(model_module, 'CHUNK_BYTES', 8*5*6*4*3*4)
+    assert np.allclose(m.sweep(dict(E0=E0s, a=a_values)), expected)
+    assert [len(axis) for axis in m.sweep_axes] == [5, 6, 4, 30, 3]
+    assert np.array_equal(m.sweep_axes[0], axes[1])
+    # Fixed parameters and expressions
+    m.set_model('exp(-(a*(x**2 + y**2) + E0 - z)**2)', 
+                parameters=dict(a=1, E0=-1))
+    assert np.allclose(m.sweep(dict(E0=E0s), axes=axes, a=2), 
+                       expected[..., 2])
+
+def product(x, y, *, a=1) :
+    return a*x*y + OFFSET
+
+# Used by product() to check that changes of globals are noticed
+OFFSET = 0
+
+def test_cache(monkeypatch, tmp_path) :
+    """ Evaluations are reused from memory and from disk. """
+    monkeypatch.setattr(model_module, 'disk_cache', DiskCache(tmp_path))
+    model_module.memory_cache.clear()
+    # Count the evaluations. Models that use mutable objects (like a list 
+    # of calls) are not cached, see caching.function_token().
+    calls = []
+    compute = Model._compute
+    def counted(self, meshes, kwargs, *args) :
+        calls.append(kwargs['a'])
+        return compute(self, meshes, kwargs, *args)
+    monkeypatch.setattr(Model, '_compute', counted)
+    axes = [np.linspace(0, 1, 5), np.linspace(0, 2, 4)]
+    m = Model(product, use_cache=True, use_disk=True)
+    m.MIN_AXIS_LENGTH = 0
+    data = m.calculate_model_data(axes, a=2)
+    # Cached results are shared and therefore read-only
+    with pytest.raises(ValueError) :
+        data[0, 0] = 100
+    assert m.calculate_model_data(axes, a=2) is data
+    assert np.allclose(data, 2*np.outer(axes[1], axes[0]))
+    assert calls == [2]
+    m.calculate_model_data(axes, a=3)
+    m.calculate_model_data([axes[0], axes[1][:3]], a=3)
+    assert calls == [2, 3, 3]
+    # A new session only finds the evaluations on disk
+    model_module.memory_cache.clear()
+    m = Model(product, use_cache=True, use_disk=True)
+    m.MIN_AXIS_LENGTH = 0
+    m.calculate_model_data(axes, a=3)
+    assert calls == [2, 3, 3] and len(model_module.memory_cache) == 1
+    m.use_cache = m.use_disk = False
+    m.calculate_model_data(axes, a=3)
+    assert calls == [2, 3, 3, 3]
+    # Changes of the globals that the model uses are noticed
+    m.use_cache = True
+    monkeypatch.setitem(globals(), 'OFFSET', 10)
+    assert np.allclose(m.calculate_model_data(axes, a=2), 
+                       2*np.outer(axes[1], axes[0]) + 10)
+    assert calls == [2, 3, 3, 3, 2]
+    # Caching is opt-in
+    assert not Model(product).use_cache
+    # Expressions are identified by their source and defaults
+    token = Model('a*x*y', parameters=dict(a=1)).model.token
+    assert token == Model('a*x*y', parameters=dict(a=1)).model.token
+    assert token != Model('a*x*y', parameters=dict(a=2)).model.token
+
+def test_sweep_not_pointwise() :
+    """ Models that are not pointwise are evaluated per parameter value. """
+    m = Model(lambda x, y, *, a=1 : np.exp(a*x*y) / np.exp(a*x*y).sum())
+    m.MIN_AXIS_LENGTH = 0
+    axes = [np.linspace(0, 1, 5), np.linspace(0, 2, 4)]
+    data = m.sweep(dict(a=[1, 2, 3]), axes=axes)
+    assert data.shape == (4, 5, 3)
+    assert np.allclose(data.sum(axis=(0, 1)), 1)
+    assert np.allclose(data[..., 1], m.calculate_model_data(axes, a=2))
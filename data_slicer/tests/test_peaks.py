@@ -0,0 +1,57 @@
+"""
+Check the vectorized peak finding on synthetic data.
+"""
+import numpy as np
+import pytest
+
+from data_slicer.lazy import LazyArray
+from data_slicer.peaks import find_peaks, peak_indices
+
+class Recorder(LazyArray) :
+    """ Lazy view of *data* that records the size of every read block. """
+    def __init__(self, data) :
+        self.data = data
+        self.reads = []
+        super().__init__(data.shape, data.dtype)
+
+    def _compute(self, region) :
+        block = self.data[region]
+        self.reads.append(block.size)
+        return block
+
+def test_find_peaks_positions() :
+    """ A single gaussian per spectrum at a known position. """
+    nx, ny, nz = 20, 15, 100
+    z = np.arange(nz)
+    centers = np.random.randint(10, nz-10, size=(nx, ny))
+    data = np.exp(-(z - centers[:,:,None])**2/8)
+    peaks = find_peaks(data, axis=2, prominence=0.5, chunk_size=16,
+                       n_workers=2)
+    assert len(peaks) == nx*ny
+    indices = peak_indices(peaks, 2)
+    assert np.all(indices[:,2] == centers[indices[:,0], indices[:,1]])
+    # Lazy data is read chunk by chunk
+    lazy = Recorder(data.transpose(2, 0, 1))
+    lazy_peaks = find_peaks(lazy, axis=0, prominence=0.5, chunk_size=16, 
+                            n_workers=2)
+    assert np.array_equal(lazy_peaks, peaks)
+    assert max(lazy.reads) < data.size / 10
+
+def test_find_peaks_scipy() :
+    """ Compare prominences and widths to scipy on noisy integer data
+    (which contains many plateaus).
+    """
+    signal = pytest.importorskip('scipy.signal')
+    data = np.random.randint(0, 5, size=(10, 200)).astype(float)
+    peaks = find_peaks(data, axis=1, prominence=1)
+    for i, spectrum in enumerate(data) :
+        positions, properties = signal.find_peaks(spectrum, prominence=1,
+                                                  width=0)
+        found = peaks[peaks['coords'][:,0] == i]
+        assert np.array_equal(found['position'], positions)
+        assert np.allclose(found['prominence'], properties['prominences'])
+        assert np.allclose(found['width'], properties['widths'])
+
+if __name__ == "__main__" :
+    test_find_peaks_positions()
+    test_find_peaks_scipy()
@@ -1,8 +1,11 @@
 """
 Simply start up PIT with its example data.
 """
+import numpy as np
 from pyqtgraph.Qt import QtCore
 
+from data_slicer.lazy import IndexedArray, TransposedArray, select
+from data_slicer.masking import MaskedData
 from data_slicer.pit import MainWindow
 
 def create_pit() :
@@ -41,6 +44,201 @@ def test_pit(qtbot) :
         qtbot.keyClick(mw.integrated_plot, QtCore.Qt.Key_Up)
     assert mw.integrated_plot.slider_width.get_value() == 2*n_intervals+1
 
+def test_set_region(qtbot) :
+    """ Partial updates patch the integrated intensity correctly. """
+    data = np.random.rand(20, 30, 40)
+    mw = MainWindow(data=data)
+    qtbot.add_widget(mw)
+    pit = mw.data_handler
+    # Modification in place, followed by a notification
+    data[:, 4, 30:] *= 3
+    pit.data.notify_region_changed(np.s_[:, 4, 30:])
+    assert np.allclose(pit.integrated, data.sum(axis=(0, 1)))
+    pit.set_region(np.s_[2:5, 3:9, 10:20], 2.)
+    data[2:5, 3:9, 10:20] = 2.
+    assert np.allclose(pit.integrated, data.sum(axis=(0, 1)))
+    # The main image is only updated if the region is displayed
+    pit.set_region(np.s_[:, :, 0], 0.)
+    assert np.allclose(mw.image_data, 0)
+
+def test_history(qtbot) :
+    """ Steps can be undone and redone without copying the loaded data. """
+    data = np.random.rand(20, 30, 40)
+    mw = MainWindow(data=data)
+    qtbot.add_widget(mw)
+    pit = mw.data_handler
+    assert not pit.get_data().flags.writeable
+    assert np.shares_memory(pit.get_data(), data)
+    pit.set_region(np.s_[:5, :5, :5], -1.)
+    pit.roll_axes()
+    pit.normalize()
+    assert pit.history.labels == ['load', 'set_region', 'roll_axes', 
+                                  'normalize']
+    pit.undo()
+    assert pit.get_data().shape == (30, 40, 20)
+    assert np.allclose(pit.get_data()[:5, :5, :5], -1)
+    pit.undo()
+    pit.undo()
+    assert np.array_equal(pit.get_data(), data)
+    pit.redo()
+    assert np.allclose(pit.get_data()[:5, :5, :5], -1)
+    # The original data was not touched
+    assert data.min() >= 0
+    pit.reset_data()
+    assert np.array_equal(pit.get_data(), data)
+    pit.undo()
+    assert np.allclose(pit.get_data()[:5, :5, :5], -1)
+
+def test_crop(qtbot) :
+    """ Cropping installs a view and slices the axes. """
+    data = np.random.rand(30, 20, 10)
+    mw = MainWindow(data=data)
+    qtbot.add_widget(mw)
+    pit = mw.data_handler
+    pit.prepare_data(data, axes=[np.linspace(0, 1, 30), np.arange(20), 
+                                 np.arange(10)])
+    pit.crop((5, 15), None, (2, 8))
+    assert pit.get_data().shape == (10, 20, 6)
+    assert np.shares_memory(pit.get_data(), data)
+    assert np.allclose(pit.axes[0], np.linspace(0, 1, 30)[5:15])
+    assert np.allclose(pit.integrated, data[5:15, :, 2:8].sum(axis=(0, 1)))
+    pit.undo()
+    assert pit.get_data().shape == data.shape
+    # Select the region by dragging a rectangle in the main plot
+    mw.select_crop()
+    mw.crop_roi.setPos([0.25, 4])
+    mw.crop_roi.setSize([0.5, 10])
+    xlim, ylim = mw.get_crop_limits()
+    assert abs(xlim[0] - 7) <= 1 and abs(xlim[1] - 22) <= 1
+    assert abs(ylim[0] - 4) <= 1 and abs(ylim[1] - 14) <= 1
+    mw.crop()
+    assert mw.crop_roi is None
+    assert pit.get_data().shape == (xlim[1]-xlim[0], ylim[1]-ylim[0], 10)
+    # Masked lazy data
+    data[1, 2] = np.nan
+    pit.prepare_data(data)
+    pit.set_region(np.s_[0], 1.)
+    pit.crop((1, 5), (2, 9))
+    assert pit.mask.data_shape == (4, 7, 10)
+    assert np.isnan(mw.image_data[0, 0])
+
+def test_outer_dimensions(qtbot) :
+    """ Extra dimensions are navigated with sliders through views. """
+    data = np.random.rand(20, 15, 10, 4, 3)
+    data[2, 3, 4, 1, 0] = np.nan
+    mw = MainWindow(data=data)
+    qtbot.add_widget(mw)
+    pit = mw.data_handler
+    assert len(mw.outer_plots) == 2
+    assert np.shares_memory(pit.get_data(), data)
+    pit.z.set_value(4)
+    generation = pit.generation
+    pit.outer[0].set_value(1)
+    assert pit.outer_index == (1, 0)
+    assert pit.mask is not None
+    # NaNs are filled on access instead of copying the sub-cube
+    assert isinstance(pit.get_data(), MaskedData)
+    assert np.allclose(pit.integrated, 
+                       np.nanmean(data[..., 1, 0], axis=(0, 1)) * 20*15)
+    pit.set_outer_index((3, 2))
+    assert pit.outer[1].get_value() == 2
+    assert np.allclose(mw.image_data, data[:, :, 4, 3, 2])
+    # Switching back reuses the cached sub-cube
+    pit.set_outer_index((0, 0))
+    assert pit.generation == generation
+    pit.roll_axes()
+    pit.set_outer_index((-1, 1))
+    assert np.allclose(pit.get_data(), data[..., 3, 1].transpose(1, 2, 0))
+    # Navigation is not recorded: undo reverts the roll and returns to the 
+    # sub-cube of the restored state
+    pit.undo()
+    assert pit.outer_index == (0, 0)
+    assert pit.history.labels == ['load', 'roll_axes']
+    # Lazy data is viewed through an IndexedArray
+    lazy = TransposedArray(data.transpose(4, 0, 1, 2, 3), (1, 2, 3, 4, 0))
+    view = select(select(lazy, (2,)), (1,))
+    assert isinstance(view, IndexedArray) and view.data is lazy
+    assert np.allclose(view[5, :, 2:5], data[5, :, 2:5, 1, 2])
+
+def test_outer_playback_history(qtbot) :
+    """ Navigation does not push processing steps out of the history. """
+    data = np.random.rand(10, 12, 8, 30) + 1
+    mw = MainWindow(data=data)
+    qtbot.add_widget(mw)
+    pit = mw.data_handler
+    pit.history.max_steps = 10
+    player = mw.outer_plots[0].player
+    player.step(4)
+    pit.normalize()
+    # Processed data keeps its sub-cube
+    player.play()
+    player.step()
+    assert not player.is_playing
+    assert pit.outer_index == (4,)
+    pit.undo()
+    assert np.allclose(pit.get_data(), data[..., 4])
+    for i in range(25) :
+        player.step()
+    assert pit.outer_index == (29,)
+    assert np.allclose(pit.get_data(), data[..., 29])
+    pit.normalize()
+    pit.undo()
+    assert np.allclose(pit.get_data(), data[..., 29])
+    pit.redo()
+    assert np.allclose(pit.get_data()[...], data[..., 29] / 
+                       data[..., 29].max(axis=2, keepdims=True))
+    assert pit.history.labels == ['load', 'normalize']
+    pit.undo()
+    pit.reset_data()
+    assert np.allclose(pit.get_data(), data[..., 29])
+
+def test_overlay_model(qtbot) :
+    """ 3D models are evaluated per slice and their isocurves reused. """
+    data = np.random.rand(40, 30, 20)
+    mw = MainWindow(data=data)
+    qtbot.add_widget(mw)
+    pit = mw.data_handler
+    pit.prepare_data(data, axes=[np.linspace(-1, 1, 40), 
+                                 np.linspace(-1, 1, 30), 
+                                 np.linspace(-2, 0, 20)])
+    calls = []
+    def band(x, y, z, *, E0=-1.5) :
+        calls.append(np.broadcast(x, y, z).shape)
+        return x**2 + y**2 + E0 - z
+    pit.overlay_model(band, E0=-1)
+    # One slice and the cut
+    assert calls == [(30, 40, 1), (pit.get_cut_data().shape[0], 20)]
+    for z in [12, 13, 14, 13, 12] :
+        pit.z.set_value(z)
+    assert len(calls) == 5
+    assert not pit.iso.path().isEmpty()
+    assert pit.iso.parentItem() is mw.main_plot.image_item
+    pit.remove_model()
+    assert pit.model is None
+    pit.overlay_model(lambda x, y : x**2 + y**2)
+    assert pit.model.data.shape == (30, 40)
+
+def test_fit_model(qtbot) :
+    """ Masked entries are ignored and the maps open in a new window. """
+    x = np.linspace(-1, 1, 50)
+    x0 = np.linspace(-0.3, 0.3, 20)[:,None] + np.zeros((20, 10))
+    data = np.exp(-(x - x0[..., None])**2/0.02)
+    data[2, 3, 20:30] = 1e6
+    mw = MainWindow(data=data)
+    qtbot.add_widget(mw)
+    pit = mw.data_handler
+    pit.prepare_data(data, axes=[None, None, x])
+    pit.set_mask(data < 1e5)
+    result = pit.fit_model('a*exp(-(z - z0)**2/w)', 
+                           p0=dict(z0=-0.3, w=0.05, a=1), show=True)
+    assert np.allclose(result['z0'], x0, atol=1e-6)
+    window = pit.fit_windows[-1]
+    qtbot.add_widget(window)
+    assert window.data_handler.get_data().shape == (20, 10, 3)
+    cut = pit.fit_model(lambda x, *, z0=0, w=1 : np.exp(-(x - z0)**2/w), 
+                        p0=dict(z0=0, w=0.05), source='cut')
+    assert cut.cost.shape == (pit.get_cut_data().shape[0],)
+
 if __name__ == "__main__" :
     from pyqtgraph.Qt import QtGui
 
@@ -0,0 +1,49 @@
+"""
+Check the stepping logic of the player and that it drops frames instead of
+falling behind.
+"""
+import time
+
+import pytest
+
+from data_slicer.playback import Player, advance
+from data_slicer.utilities import TracedVariable
+
+def test_advance() :
+    """ Loops, ping-pong and single runs through a range. """
+    assert advance(8, 3, 2, 9) == (3, 1, False)
+    assert advance(3, 2, 2, 9, direction=-1) == (9, -1, False)
+    # Ping-pong reflects at both ends
+    assert advance(8, 3, 2, 9, mode='pingpong') == (7, -1, False)
+    assert advance(3, 3, 2, 9, -1, 'pingpong') == (4, 1, False)
+    assert advance(9, 1, 2, 9, 1, 'pingpong') == (8, -1, False)
+    assert advance(5, 14, 2, 9, 1, 'pingpong') == (5, 1, False)
+    assert advance(8, 3, 2, 9, mode='once') == (9, 1, True)
+    # Positions outside of the range start over
+    assert advance(20, 1, 2, 9) == (2, 1, False)
+    with pytest.raises(ValueError) :
+        advance(0, 1, 0, 1, mode='bounce')
+
+def test_player(qtbot) :
+    """ Frames that are not due are skipped; the range is respected. """
+    z = TracedVariable(10, name='z')
+    z.set_allowed_values(range(100))
+    player = Player(z, fps=20)
+    states = []
+    player.sig_state_changed.connect(states.append)
+    player.set_range(10, 40)
+    player.play()
+    assert player.is_playing
+    # Pretend that showing frames took half a second
+    player._t0 = time.perf_counter() - 0.5
+    player.on_timeout()
+    assert z.get_value() == 20
+    assert player.dropped == 9
+    player.set_mode('pingpong')
+    player.step(25)
+    assert z.get_value() == 35 and player._direction == -1
+    player.set_mode('once')
+    player.step(30)
+    assert z.get_value() == 10
+    assert states == [True, False]
+    qtbot.waitUntil(lambda : not player.is_playing)
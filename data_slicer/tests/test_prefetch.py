@@ -0,0 +1,39 @@
+"""
+Check that the slice prefetcher computes the slices ahead in the direction
+of the requests and returns the same slices as computing them directly.
+"""
+import numpy as np
+
+from data_slicer.masking import Mask, fill_invalid, masked_slice
+from data_slicer.prefetch import SlicePrefetcher
+from data_slicer.utilities import make_slice
+
+def test_prefetch() :
+    """ Stepping through z fills the cache ahead of the requests. """
+    data = np.random.rand(20, 15, 30)
+    prefetcher = SlicePrefetcher(max_ahead=4, lookahead=10)
+    for z in (10, 9, 8) :
+        image = prefetcher.get_slice(data, z, integrate=1, key=0)
+        assert np.allclose(image, make_slice(data, 2, z, integrate=1))
+    prefetcher.wait()
+    cached = {key[1] for key in prefetcher.cache.keys()}
+    assert cached == {10, 9, 8, 7, 6, 5, 4}
+    # Cached slices are returned as they are
+    assert prefetcher.get_slice(data, 7, integrate=1, key=0) is \
+           prefetcher.cache.get((0, 7, 1))
+    # Jumps do not trigger prefetching and the range is respected
+    prefetcher.get_slice(data, 28, key=0)
+    prefetcher.get_slice(data, 29, key=0)
+    prefetcher.wait()
+    assert (0, 30, 0) not in prefetcher.cache
+    # Masked slices
+    data[3, 4] = np.nan
+    mask = Mask(np.isfinite(data))
+    filled = fill_invalid(data, mask)
+    for z in (0, 2, 4) :
+        image = prefetcher.get_slice(filled, z, mask=mask, key=1)
+    prefetcher.wait()
+    assert np.allclose(prefetcher.cache.get((1, 6, 0)),
+                       masked_slice(filled, mask, 2, 6), equal_nan=True)
+    prefetcher.invalidate()
+    assert len(prefetcher.cache) == 0
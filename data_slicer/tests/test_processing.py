@@ -0,0 +1,72 @@
+"""
+Check the preprocessing steps on synthetic data.
+"""
+import numpy as np
+import pytest
+
+from data_slicer.lazy import TransposedArray
+from data_slicer.processing import normalize, shirley_background, \
+                                   subtract_background
+
+def test_normalize() :
+    """ Lazy and in place normalization agree with plain broadcasting. """
+    data = np.random.rand(6, 7, 20)
+    expected = data / data.max(axis=2, keepdims=True)
+    lazy = normalize(data, axis=2, mode='max')
+    assert np.allclose(lazy[2:5, 3], expected[2:5, 3])
+    assert np.allclose(lazy.compute(), expected)
+    expected = data / data.sum(axis=(0, 1), keepdims=True)
+    assert np.allclose(normalize(data, axis=(0, 1), mode='area')[...,4], 
+                       expected[...,4])
+    # Lazy input
+    view = TransposedArray(data, (2, 0, 1))
+    expected = data / data[...,5:10].mean(axis=2, keepdims=True)
+    result = normalize(view, axis=0, mode='region', region=(5, 10))
+    assert np.allclose(result.compute(), expected.transpose(2, 0, 1))
+    # In place
+    copy = data.copy()
+    assert normalize(copy, axis=2, in_place=True) is copy
+    assert np.allclose(copy.max(axis=2), 1)
+    with pytest.raises(TypeError) :
+        normalize(np.ones((3, 4), dtype=int), axis=1, in_place=True)
+
+def shirley_reference(spectrum, n_edge=5, n_iter=100) :
+    """ Straightforward implementation for a single spectrum. """
+    start = spectrum[:n_edge].mean()
+    end = spectrum[-n_edge:].mean()
+    background = np.full(len(spectrum), end)
+    for i in range(n_iter) :
+        signal = spectrum - background
+        area = np.array([signal[j:].sum() for j in range(len(spectrum))])
+        background = end + (start - end) * area / area[0]
+    return background
+
+def test_shirley() :
+    """ Vectorized Shirley backgrounds match the simple implementation 
+    (up to the clipping of the area ratio to [0, 1]).
+    """
+    x = np.linspace(-1, 1, 100)
+    centers = np.random.uniform(-0.3, 0.3, size=8)
+    peaks = np.exp(-(x[None,:] - centers[:,None])**2 / 0.01)
+    steps = 0.5 / (1 + np.exp((x[None,:] - centers[:,None]) / 0.05))
+    spectra = 3*peaks + steps + 0.1
+    background = shirley_background(spectra)
+    for spectrum, result in zip(spectra, background) :
+        assert np.allclose(result, shirley_reference(spectrum), atol=1e-3)
+
+def test_subtract_background() :
+    """ Chunked, threaded subtraction along any axis. """
+    data = np.random.rand(7, 30, 9) + np.linspace(3, 1, 30)[:,None]
+    result = subtract_background(data, axis=1, mode='linear', n_edge=30, 
+                                 chunk_size=20, n_workers=3)
+    assert result.shape == data.shape
+    expected = data - data.mean(axis=1, keepdims=True)
+    assert np.allclose(result, expected)
+    result = subtract_background(data, axis=1, mode='constant', 
+                                 region=(0, 30))
+    assert np.allclose(result, expected)
+
+if __name__ == "__main__" :
+    test_normalize()
+    test_shirley()
+    test_subtract_background()
@@ -0,0 +1,133 @@
+"""
+Check the sparse remapping of data onto new grids and the lazy evaluation of
+remapped data.
+"""
+import numpy as np
+import pytest
+
+from data_slicer import remapping
+from data_slicer.caching import DiskCache, function_token
+from data_slicer.lazy import normalize_key
+from data_slicer.remapping import build_interpolation_matrix, \
+                                  display_index_maps, \
+                                  get_interpolation_matrix, remap, rotate
+
+# Used by shifted() to check that changes of globals are noticed
+SHIFT = 1
+
+def shifted(U, V) :
+    return U + SHIFT, V
+
+@pytest.fixture(autouse=True)
+def disk_cache(monkeypatch, tmp_path) :
+    """ Keep the interpolation matrices of the tests out of the real cache. 
+    """
+    cache = DiskCache(tmp_path)
+    monkeypatch.setattr(remapping, 'disk_cache', cache)
+    monkeypatch.setattr(remapping, 'memory_cache', remapping.LRUCache())
+    return cache
+
+def test_regrid_linear() :
+    """ Regridding data that is linear in x and y has to be exact. """
+    x = np.linspace(0, 1, 30)
+    y = np.linspace(-1, 2, 40)
+    data = 2*x[:,None] + 3*y[None,:]
+    u = np.linspace(0.1, 0.9, 17)
+    # Descending target and source axes are allowed
+    v = np.linspace(1.5, -0.5, 23)
+    result = remap(data, (x, y), (u, v), lazy=False)
+    assert np.allclose(result, 2*u[:,None] + 3*v[None,:], atol=1e-5)
+    flipped = remap(data[:,::-1], (x, y[::-1]), (u, v), lazy=False)
+    assert np.allclose(flipped, result, atol=1e-5)
+
+def test_mapping_and_fill() :
+    """ A shift by a constant, with points outside the source grid. """
+    x = np.arange(10.)
+    y = np.arange(8.)
+    data = np.random.rand(10, 8)
+    matrix = build_interpolation_matrix((x, y), (x, y),
+                                        mapping=lambda U, V : (U+1, V))
+    result = matrix.apply(data, fill_value=np.nan)
+    assert np.allclose(result[:-1], data[1:])
+    assert np.all(np.isnan(result[-1]))
+
+def test_lazy_indexing() :
+    """ Indexing the lazy result gives the same as indexing the full one. """
+    x = np.arange(12.)
+    y = np.arange(9.)
+    data = np.random.rand(12, 9, 5)
+    u = np.linspace(0, 11, 20)
+    v = np.linspace(0, 8, 15)
+    lazy = remap(data, (x, y), (u, v), key='test')
+    full = lazy.compute()
+    assert full.shape == (20, 15, 5)
+    for key in [(slice(2, 7), 3, slice(None, None, -2)), (Ellipsis, 1),
+                (-1,), (slice(None), [0, 4, 2])] :
+        assert np.allclose(lazy[key], full[key])
+    assert np.allclose(lazy.sum(axis=(0, 1)), full.sum(axis=(0, 1)))
+    assert np.allclose(lazy.transpose(2, 0, 1)[1], full.transpose(2, 0, 1)[1])
+
+def test_normalize_key() :
+    region, post = normalize_key((slice(8, 2, -2), 4), (10, 6))
+    assert region == (slice(3, 9), slice(4, 5))
+    a = np.arange(60).reshape(10, 6)
+    assert np.array_equal(a[region][post], a[8:2:-2, 4])
+
+def test_rotate() :
+    """ A rotation by 90 degrees around the center is a rot90. """
+    x = np.arange(10.)
+    data = np.random.rand(10, 10, 3)
+    rotated = rotate(data, (x, x), 90)
+    assert np.allclose(rotated[:,:,1], np.rot90(data[:,:,1]))
+    assert np.allclose(rotate(data, (x, x), 90, lazy=False), 
+                       np.rot90(data))
+
+def test_display_index_maps() :
+    """ Non-uniform axes are resampled onto a uniform display grid on 
+    which every data pixel is visible and appears at its axis value.
+    """
+    x = np.linspace(0, 1, 40)**1.5
+    y = np.linspace(5, -5, 30)
+    mx, my = display_index_maps(x, y)
+    assert my is None
+    assert np.array_equal(np.unique(mx), np.arange(40))
+    centers = (np.arange(len(mx)) + 0.5) / len(mx)
+    assert np.all(np.abs(x[mx] - centers) <= np.diff(x).max())
+    # Descending axes are displayed in their given order
+    mx, _ = display_index_maps(x[::-1], y)
+    assert mx[0] == 0 and mx[-1] == 39 and np.all(np.diff(mx) >= 0)
+
+def test_mapping_token(monkeypatch, disk_cache) :
+    """ Cached matrices follow the globals that the mapping uses. """
+    x = np.arange(10.)
+    first = get_interpolation_matrix((x, x), (x, x), mapping=shifted)
+    monkeypatch.setitem(globals(), 'SHIFT', 3)
+    second = get_interpolation_matrix((x, x), (x, x), mapping=shifted)
+    assert not np.array_equal(first.indices, second.indices)
+    assert len(list(disk_cache.directory.glob('*.npz'))) == 2
+    # Mutable globals make a function unidentifiable
+    monkeypatch.setitem(globals(), 'SHIFT', [1])
+    assert function_token(shifted) is None
+    # Nested functions are identified by their code, not their address
+    def outer_a() :
+        return lambda U, V : (U, V)
+    def outer_b() :
+        return lambda U, V : (U, V)
+    assert function_token(outer_a) == function_token(outer_b) is not None
+
+def test_disk_cache_limit(tmp_path) :
+    """ The least recently used files are deleted beyond the limit. """
+    cache = DiskCache(tmp_path, max_bytes=3000, version=2)
+    for i in range(4) :
+        cache.put(str(i), dict(a=np.zeros(100)))
+    assert cache.nbytes() <= 3000
+    assert cache.get('3') is not None and cache.get('0') is None
+    assert DiskCache(tmp_path, version=1).get('3') is None
+
+if __name__ == "__main__" :
+    test_regrid_linear()
+    test_mapping_and_fill()
+    test_lazy_indexing()
+    test_normalize_key()
+    test_rotate()
+    test_display_index_maps()
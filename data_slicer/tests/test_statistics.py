@@ -0,0 +1,66 @@
+"""
+Check the streaming histogram and percentile estimates against numpy.
+"""
+import numpy as np
+
+from data_slicer.cmaps import transfer_function
+from data_slicer.statistics import compute_histogram, get_histogram, \
+                                   new_token, sample_steps
+
+def test_percentiles() :
+    """ Percentiles agree with np.percentile to within a bin width. """
+    data = np.random.normal(size=(50, 40, 30))
+    data[0, 0, :5] = np.nan
+    histogram = compute_histogram(data, n_workers=3)
+    assert histogram.n_nan == 5
+    assert histogram.total == data.size - 5
+    finite = data[np.isfinite(data)]
+    assert histogram.vmin == finite.min()
+    assert histogram.vmax == finite.max()
+    width = histogram.edges[1] - histogram.edges[0]
+    q = [1, 10, 50, 90, 99]
+    assert np.allclose(histogram.percentile(q), np.percentile(finite, q),
+                       atol=2*width)
+
+def test_sampling_and_cache() :
+    """ Large data is sampled; cached results are reused per key. """
+    data = np.random.rand(100, 20, 20)
+    histogram = compute_histogram(data, max_samples=10000)
+    assert histogram.total <= 2*10000
+    assert abs(histogram.percentile(50) - 0.5) < 0.05
+    # The samples are spread over all dimensions
+    assert sample_steps(data.shape, 10000) == (2, 2, 1)
+    assert sample_steps(data.shape, 100) == (8, 8, 7)
+    data[1:] = np.nan
+    assert compute_histogram(data, max_samples=100).n_nan > 0
+    first = get_histogram(data, key=('test', 1))
+    assert get_histogram(data, key=('test', 1)) is first
+    assert get_histogram(data, key=('test', 2)) is not first
+    assert new_token() != new_token()
+
+def test_constant() :
+    """ Constant data yields non-degenerate levels. """
+    low, high = compute_histogram(np.ones((4, 5))).levels()
+    assert low == 1 and high > low
+
+def test_equalize() :
+    """ Histogram equalization uses all colors about equally often. """
+    data = np.random.lognormal(size=(200, 200))
+    histogram = compute_histogram(data)
+    levels = histogram.levels(0, 100)
+    n = 4096
+    transfer = transfer_function('equalize', levels=levels, 
+                                 histogram=histogram, n=n)
+    assert np.all(np.diff(transfer) >= 0)
+    # Map the data through the transfer function like pyqtgraph would
+    low, high = levels
+    index = np.clip(((data - low)/(high - low)*n).astype(int), 0, n-1)
+    colors = np.floor(transfer[index]*8).clip(0, 7)
+    fractions = np.bincount(colors.astype(int).ravel()) / data.size
+    assert np.allclose(fractions, 1/8, atol=0.03)
+
+if __name__ == "__main__" :
+    test_percentiles()
+    test_sampling_and_cache()
+    test_constant()
+    test_equalize()
@@ -1,6 +1,8 @@
 
 import logging
+import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -9,6 +11,8 @@ from matplotlib.figure import Figure
 from matplotlib.patheffects import withStroke
 from pyqtgraph import Qt as qt
 
+from data_slicer import dtypes
+
 logger = logging.getLogger('ds.'+__name__)
 # The logging level for signals
 SIGNALS = 5
@@ -45,6 +49,12 @@ class TracedVariable(qt.QtCore.QObject) :
     sig_allowed_values_changed  :class:`Signal <pyqtgraph.Qt.QtCore.Signal>`; 
                                 the signal that is emitted whenever 
                                 ``self.allowed_values`` are set or unset.
+    sig_region_changed          :class:`Signal <pyqtgraph.Qt.QtCore.Signal>`; 
+                                the signal that is emitted with the 
+                                modified index region when only a part of 
+                                an array-valued ``self._value`` was 
+                                changed, see :func:`notify_region_changed 
+                                <data_slicer.utilities.TracedVariable.notify_region_changed>`.
     allowed_values              :class:`array <numpy.ndarray>`; a sorted 
                                 list of all values that self._value can 
                                 assume. If set, all tries to set the value 
@@ -55,6 +65,7 @@ class TracedVariable(qt.QtCore.QObject) :
     sig_value_changed = qt.QtCore.Signal()
     sig_value_read = qt.QtCore.Signal()
     sig_allowed_values_changed = qt.QtCore.Signal()
+    sig_region_changed = qt.QtCore.Signal(object)
 
     def __init__(self, value=None, name=None) :
         # Initialize instance variables
@@ -82,6 +93,16 @@ class TracedVariable(qt.QtCore.QObject) :
                    self.__class__.__name__, self.name))
         self.sig_value_changed.emit()
 
+    def notify_region_changed(self, region) :
+        """ Emit sig_region_changed with *region* (an index or tuple of 
+        slices) to signal that only this part of the (array) value was 
+        modified in place. Listeners can then update just the affected 
+        results instead of reacting as to sig_value_changed.
+        """
+        logger.log(SIGNALS, '{} {}: Emitting sig_region_changed.'.format(
+                   self.__class__.__name__, self.name))
+        self.sig_region_changed.emit(region)
+
     def get_value(self) :
         """ Emit sig_value_changed and return the internal self._value. 
 
@@ -188,6 +209,47 @@ def pop_kwarg(name, kwargs, default=1) :
     else :
         return default
 
+def iter_chunks(n, chunk_size) :
+    """ Yield :class:`slice` objects that divide the range ``[0, n)`` into
+    consecutive pieces of length *chunk_size* (the last one can be shorter).
+    """
+    chunk_size = max(1, int(chunk_size))
+    for start in range(0, n, chunk_size) :
+        yield slice(start, min(start + chunk_size, n))
+
+def map_chunks(func, n, chunk_size=None, n_workers=None) :
+    """
+    Apply *func* to consecutive chunks of the range ``[0, n)`` using a pool
+    of threads. Since numpy releases the GIL for most of its array
+    operations, this gives a real speedup for vectorized *func*.
+
+    **Parameters**
+
+    ==========  ================================================================
+    func        callable; called with a single :class:`slice` argument.
+    n           int; length of the range to be divided into chunks.
+    chunk_size  int; number of elements per chunk. Defaults to an even
+                division of *n* among the workers.
+    n_workers   int; number of threads. Defaults to the number of CPUs. If
+                1, everything is executed in the calling thread.
+    ==========  ================================================================
+
+    **Returns**
+
+    =======  ===================================================================
+    results  list; the return values of *func* in the order of the chunks.
+    =======  ===================================================================
+    """
+    if n_workers is None :
+        n_workers = os.cpu_count() or 1
+    if chunk_size is None :
+        chunk_size = int(np.ceil(n/n_workers)) if n > 0 else 1
+    chunks = list(iter_chunks(n, chunk_size))
+    if n_workers == 1 or len(chunks) <= 1 :
+        return [func(chunk) for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=n_workers) as executor :
+        return list(executor.map(func, chunks))
+
 def make_slice_3d(data, d, i, integrate=0, silent=False) :
     """ 
     :deprecated: 
@@ -287,7 +349,9 @@ def make_slice(data, dim, index, integrate=0, silent=False) :
 
     ===  =======================================================================
     res  np.array; slice at *index* alond *dim* with dimensions shape[:d] + 
-         shape[d+1:].
+         shape[d+1:]. The sum is taken in the accumulation dtype of the 
+         current :class:`DtypePolicy <data_slicer.dtypes.DtypePolicy>`, 
+         such that integrating e.g. uint16 counts does not overflow.
     ===  =======================================================================
     """
     # Find the dimensionality and the number of slices along the specified 
@@ -316,18 +380,13 @@ def make_slice(data, dim, index, integrate=0, silent=False) :
             warnings.warn(warning)
         stop = n_slices
     
-    # Roll the original data such that the specified dimension comes first
-    i_original = np.arange(ndim)
-    i_rolled = np.roll(i_original, dim)
-    data = np.moveaxis(data, i_original, i_rolled)
-    # Take the slice
-    sliced = data[start:stop].sum(0)
-    # Bring back to more intuitive form. For that we have to remove the now 
-    # lost dimension from the index arrays and shift all indices.
-    i_original = np.concatenate((i_original[:dim], i_original[dim+1:]))
-    i_original[i_original>dim] -= 1
-    i_rolled = np.roll(i_original, dim)
-    return np.moveaxis(sliced, i_rolled, i_original)
+    # Take the slice by plain indexing, which only reads the required part 
+    # of *data* (also for lazy array-likes) and avoids a full copy
+    key = ndim*[slice(None)]
+    key[dim] = slice(start, stop)
+    dtype = dtypes.policy.accumulation_dtype(data.dtype)
+    # np.asarray() evaluates array-likes whose sums are lazy (e.g. dask)
+    return np.asarray(data[tuple(key)].sum(dim, dtype=dtype))
 
 def roll_array(a, i) :
     """ Cycle the arrangement of the dimensions in an *N* dimensional array.
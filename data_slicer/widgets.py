@@ -12,6 +12,8 @@ from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
 from data_slicer.cmaps import load_cmap, ds_cmap
 from data_slicer.cutline import Cutline
 from data_slicer.imageplot import ImagePlot, Scalebar
+from data_slicer.kernels import get_kernel
+from data_slicer.statistics import get_histogram, new_token
 from data_slicer.utilities import make_slice, TracedVariable
 
 logger = logging.getLogger('ds.'+__name__)
@@ -104,6 +106,10 @@ class ThreeDWidget(QtWidgets.QWidget) :
 
         # Initialize instance variables
         self.data = TracedVariable(None, name='data')
+        # Counter that identifies the current state of the data
+        self.generation = 0
+        # Identifies this widget in the histogram cache
+        self._token = new_token()
         self.cmap = load_cmap(DEFAULT_CMAP)
         self.lut = self.cmap.getLookupTable()
         self.gloptions = 'translucent'
@@ -175,7 +181,9 @@ class ThreeDWidget(QtWidgets.QWidget) :
         ====  ==================================================================
         """
         self.data.set_value(data)
-        self.levels = [data.min(), data.max()]
+        self.generation += 1
+        self.levels = get_histogram(data, key=('3d', self._token, 
+                                               self.generation)).levels()
         self.xscale, self.yscale, self.zscale = [1/s for s in data.shape]
         self._update_sliders()
 
@@ -205,8 +213,10 @@ class ThreeDWidget(QtWidgets.QWidget) :
         return self.get_slice(2, i, integrate)
 
     def make_texture(self, cut) :
-        """ Wrapper for :func:`makeRGBA <pyqtgraph.makeRGBA>`."""
-        return pg.makeRGBA(cut, levels=self.levels, lut=self.lut)[0]
+        """ Colour *cut* with the 'make_rgba' kernel (see 
+        :func:`make_rgba <data_slicer.kernels.make_rgba>`).
+        """
+        return get_kernel('make_rgba')(cut, self.levels, self.lut)
 #        return pg.makeRGBA(cut, levels=self.levels)[0]
 
     def initialize_xy(self) :
@@ -467,7 +477,7 @@ class FreeSliceWidget(ThreeDWidget) :
         super()._initialize_planes()
         # selector
         xy = self.get_xy_slice(0)
-        self.selector.set_image(xy, lut=self.lut)
+        self.selector.set_image(xy, lut=self.lut, levels=self.levels)
         # cutline in selector
         if not hasattr(self, 'cutline') :
             self.cutline = Cutline(self.selector)
@@ -547,7 +557,7 @@ class FreeSliceWidget(ThreeDWidget) :
         """ 
         z = self.slider_xy.pos.get_value()
         cut = self.get_xy_slice(z)
-        self.selector.set_image(cut, lut=self.lut)
+        self.selector.set_image(cut, lut=self.lut, levels=self.levels)
 
     def _on_cmap_change(self) :
         """ Update all elements affected by the cmap change. """